@@ -4,7 +4,18 @@ from flask_swagger_ui import get_swaggerui_blueprint
 from app.extensions import db, migrate, jwt
 from app.routes import register_routes
 from app.auth import register_auth_routes
-from app.cli import create_admin, seed_roles
+from app.auth.utils import identity_cache, token_version_cache, is_token_revoked
+from app.cli import create_admin, seed_roles, analytics_cli, content_cli, rebuild_search_index
+from app.utils.activity import activity_tracker, session_activity
+from app.utils.audit import audit_sink
+from app.utils.content_cache import content_version_cache
+from app.utils.enrichment import client_enricher, user_agent_cache
+from app.utils.geoip import geo_lookup
+from app.utils.ingestion import view_ingestor
+from app.utils.metrics import breakdown_cache, metrics_cache
+from app.utils.timeseries import closed_bucket_cache
+from app.utils.logging_utils import session_id_cache
+from app.utils.search import search_index
 
 def create_app(config_name="config.Config"):
     """
@@ -21,6 +32,27 @@ def create_app(config_name="config.Config"):
     db.init_app(app)
     migrate.init_app(app, db)
     jwt.init_app(app)
+    view_ingestor.init_app(app)
+    client_enricher.init_app(app)
+    geo_lookup.init_app(app)
+    activity_tracker.init_app(app)
+    session_activity.init_app(app)
+    audit_sink.init_app(app)
+
+    # ----------------------------
+    # Configure in-process caches
+    # ----------------------------
+    session_id_cache.configure(
+        maxsize=app.config.get('SESSION_CACHE_SIZE', 10000),
+        ttl=app.config.get('SESSION_CACHE_TTL', 3600)
+    )
+    identity_cache.configure(ttl=app.config.get('AUTH_IDENTITY_CACHE_TTL', 0))
+    token_version_cache.configure(ttl=app.config.get('JWT_TOKEN_VERSION_CACHE_TTL', 60))
+    user_agent_cache.configure(maxsize=app.config.get('USER_AGENT_CACHE_SIZE', 2048))
+    metrics_cache.configure(ttl=app.config.get('METRICS_CACHE_TTL', 5))
+    breakdown_cache.configure(ttl=app.config.get('VIEW_STATS_CACHE_TTL', 60))
+    closed_bucket_cache.configure(ttl=app.config.get('TIMESERIES_CACHE_TTL', 3600))
+    content_version_cache.configure(ttl=app.config.get('CONTENT_VERSION_CACHE_TTL', 1.0))
 
     # ----------------------------
     # Register application routes
@@ -39,16 +71,18 @@ def create_app(config_name="config.Config"):
     app.register_blueprint(swaggerui_blueprint, url_prefix='/docs')
 
     # ----------------------------
-    # Database setup
+    # Database setup (schema is managed by `flask db upgrade`)
     # ----------------------------
-    with app.app_context():
-        db.create_all()
+    search_index.init_app(app)
 
     # ----------------------------
     # Register custom CLI commands
     # ----------------------------
     app.cli.add_command(create_admin)
     app.cli.add_command(seed_roles)
+    app.cli.add_command(analytics_cli)
+    app.cli.add_command(content_cli)
+    app.cli.add_command(rebuild_search_index)
 
     # ----------------------------
     # JWT error handlers
@@ -73,6 +107,16 @@ def create_app(config_name="config.Config"):
             return redirect('/dcp/auth/login')
         return {"msg": reason}, 401
 
+    @jwt.token_in_blocklist_loader
+    def check_token_version(jwt_header, jwt_payload):
+        return is_token_revoked(jwt_payload)
+
+    @jwt.revoked_token_loader
+    def handle_revoked_token(jwt_header, jwt_payload):
+        if request.accept_mimetypes.accept_html:
+            return redirect('/dcp/auth/login')
+        return {"msg": "Token has been revoked"}, 401
+
     @jwt.expired_token_loader
     def handle_expired_token(jwt_header, jwt_payload):
         if request.accept_mimetypes.accept_html:
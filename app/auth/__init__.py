@@ -1,6 +1,8 @@
 from flask import Blueprint
 
 from . user_routes import auth_bp
+from .utils import reset_request_identity
 
 def register_auth_routes(app):
      app.register_blueprint(auth_bp, url_prefix='/api/v1/auth')
+     app.before_request(reset_request_identity)
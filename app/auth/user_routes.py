@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import (
     create_access_token, create_refresh_token,
     set_access_cookies, set_refresh_cookies,
@@ -6,12 +6,17 @@ from flask_jwt_extended import (
 )
 from marshmallow import ValidationError
 from datetime import timedelta
+from sqlalchemy import func
 
 from app.models.user import User, Role
-from app.models.log import AuditLog
+from app.models.log import AuditLog, SessionLog
 from app.extensions import db
 from .schemas import RegisterSchema, LoginSchema
-from .utils import roles_required, get_current_user
+from .utils import (
+    roles_required, get_current_user, invalidate_identity,
+    build_token_claims, bump_token_version, forget_token_version, load_user_with_roles,
+    preload_role_names
+)
 from app.utils.logging_utils import (
     log_session, log_audit_action, update_last_activity,
     format_last_login
@@ -74,15 +79,16 @@ def register():
     user.set_password(data['password'])
     user.roles.append(role)
     db.session.add(user)
-    db.session.commit()
+    db.session.flush()
 
-    # Log the user creation action for auditing
+    # Log the user creation action for auditing, committed together with the user
     log_audit_action(
         actor_id=current_user.id,
         target_user_id=user.id,
         action_type='create',
         description=f"Created user '{user.username}' with role '{role.name}'"
     )
+    db.session.commit()
 
     return jsonify({
         "msg": "User registered successfully",
@@ -117,8 +123,11 @@ def login():
     if not user.is_active:
         return jsonify({"msg": "Your account is inactive. Please contact an administrator."}), 403
 
-    access_token = create_access_token(identity=user.username, expires_delta=timedelta(minutes=15))
-    refresh_token = create_refresh_token(identity=user.username)
+    claims = build_token_claims(user)
+    access_token = create_access_token(
+        identity=user.username, expires_delta=timedelta(minutes=15), additional_claims=claims
+    )
+    refresh_token = create_refresh_token(identity=user.username, additional_claims=claims)
 
     # Log session for auditing
     log_session(user)
@@ -126,7 +135,7 @@ def login():
     resp = jsonify({
         "msg": "Login successful",
         "username": user.username,
-        "roles": [role.name for role in user.roles]
+        "roles": sorted(user.role_names)
     })
 
     set_access_cookies(resp, access_token)
@@ -144,8 +153,17 @@ def refresh():
     Returns:
         JSON response with new access token.
     """
-    current_user = get_jwt_identity()
-    new_access_token = create_access_token(identity=current_user, expires_delta=timedelta(minutes=15))
+    username = get_jwt_identity()
+    claims = {}
+    if current_app.config.get('JWT_EMBED_ROLES'):
+        # Re-read roles so the new access token reflects current permissions.
+        user, _ = load_user_with_roles(username)
+        if not user or not user.is_active:
+            return jsonify({"msg": "User not found or inactive"}), 401
+        claims = build_token_claims(user)
+    new_access_token = create_access_token(
+        identity=username, expires_delta=timedelta(minutes=15), additional_claims=claims
+    )
     return jsonify(access_token=new_access_token)
 
 
@@ -156,21 +174,34 @@ def get_users():
     Retrieve a paginated list of users filtered by optional search, role, and status.
     Enforces role-based visibility restrictions.
 
+    Users are returned in id order. The listing takes a constant number of
+    queries: last login is taken from a grouped subquery and roles are
+    loaded in bulk.
+
     Query Parameters:
         limit (int): Number of users to return (default 10).
         offset (int): Number of users to skip (default 0).
+        after_id (int): Keyset pagination; return users with an id greater than this
+            (takes precedence over offset).
         search (str): Search keyword for username or email.
         role (str): Filter users by role name.
         status (str): Filter by active status ('active' or 'inactive').
 
     Returns:
-        JSON response with total user count and list of user data including formatted last login.
+        JSON response with total user count, list of user data including formatted
+        last login, and next_after_id for fetching the next page.
     """
     current_user = get_current_user()
     update_last_activity(current_user)
 
-    limit = int(request.args.get('limit', 10))
-    offset = int(request.args.get('offset', 0))
+    try:
+        limit = int(request.args.get('limit', 10))
+        offset = int(request.args.get('offset', 0))
+        after_id = request.args.get('after_id', type=int)
+    except ValueError:
+        return jsonify({"msg": "limit and offset must be integers."}), 400
+    if limit < 1:
+        return jsonify({"msg": "limit must be a positive integer."}), 400
     search = request.args.get('search', '').strip()
     role = request.args.get('role', '').strip()
     status = request.args.get('status', '').strip()
@@ -198,18 +229,38 @@ def get_users():
         return jsonify({"msg": "You do not have permission to view users."}), 403
 
     total = query.count()
-    users = query.limit(limit).offset(offset).all()
+
+    last_logins = (
+        db.session.query(
+            SessionLog.user_id.label('user_id'),
+            func.max(SessionLog.login_time).label('last_login')
+        )
+        .group_by(SessionLog.user_id)
+        .subquery()
+    )
+    page = (
+        query.outerjoin(last_logins, last_logins.c.user_id == User.id)
+        .add_columns(last_logins.c.last_login)
+        .order_by(User.id)
+    )
+    if after_id is not None:
+        page = page.filter(User.id > after_id)
+    else:
+        page = page.offset(offset)
+    rows = page.limit(limit).all()
+
+    users = [user for user, _ in rows]
+    preload_role_names(users)
 
     return jsonify({
         "total": total,
         "users": [
             dict(
                 user.to_dict(),
-                last_login=format_last_login(
-                    user.session_logs[-1].login_time.isoformat() if user.session_logs else None
-                )
-            ) for user in users
-        ]
+                last_login=format_last_login(last_login.isoformat() if last_login else None)
+            ) for user, last_login in rows
+        ],
+        "next_after_id": users[-1].id if users and len(users) == limit else None
     })
 
 
@@ -267,6 +318,7 @@ def update_user(user_id):
 
     old_roles = [role.name for role in user.roles]
     old_status = user.is_active
+    old_username = user.username
 
     # Role and permission checks before update
     if current_user.has_role('root'):
@@ -282,11 +334,12 @@ def update_user(user_id):
     else:
         return jsonify({"msg": "Insufficient permissions to update user."}), 403
 
-    db.session.commit()
-
     new_roles = [role.name for role in user.roles]
     new_status = user.is_active
 
+    if old_roles != new_roles or old_status != new_status or old_username != user.username:
+        bump_token_version(user)
+
     # Track changes for audit logging
     changes = []
     if old_roles != new_roles:
@@ -305,6 +358,10 @@ def update_user(user_id):
             description='; '.join(changes)
         )
 
+    db.session.commit()
+    invalidate_identity(old_username, user.username)
+    forget_token_version(user.id)
+
     return jsonify({
         "msg": "User updated successfully",
         "user": {
@@ -343,6 +400,7 @@ def update_user_roles(user, roles):
         role = Role.query.filter_by(name=role_name).first()
         if role:
             user.roles.append(role)
+    user.invalidate_roles()
 
 
 @auth_bp.route('/users/<int:user_id>', methods=['DELETE'])
@@ -370,8 +428,11 @@ def delete_user(user_id):
             action_type='delete',
             description=f"Deleted user '{user.username}'"
         )
+        username = user.username
         db.session.delete(user)
         db.session.commit()
+        invalidate_identity(username)
+        forget_token_version(user_id)
         return jsonify({"msg": "User deleted successfully"})
 
     return jsonify({"msg": "Insufficient permissions to delete user."}), 403
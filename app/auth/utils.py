@@ -1,9 +1,163 @@
 # app/auth/utils.py
 
 from functools import wraps
-from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity
-from flask import jsonify
-from app.models.user import User
+from typing import NamedTuple
+from flask_jwt_extended import verify_jwt_in_request, get_jwt_identity, get_jwt
+from flask import jsonify, g, current_app
+from app.extensions import db
+from app.models.user import User, Role, user_roles
+from app.utils.cache import TTLCache
+
+
+class Identity(NamedTuple):
+    """Authorization-relevant snapshot of a user."""
+    user_id: int
+    username: str
+    is_active: bool
+    roles: frozenset
+
+
+# Optional cross-request cache: username -> Identity. Disabled unless
+# AUTH_IDENTITY_CACHE_TTL is set (see create_app).
+identity_cache = TTLCache(maxsize=1024, ttl=0)
+
+
+# user id -> current token version (-1 for deleted or inactive users).
+token_version_cache = TTLCache(maxsize=10000, ttl=60)
+
+
+def identity_cache_enabled():
+    return bool(identity_cache.ttl)
+
+
+def invalidate_identity(*usernames):
+    """Drop cached identities, e.g. after a role, status or username change."""
+    for username in usernames:
+        identity_cache.pop(username)
+
+
+def build_token_claims(user):
+    """
+    Additional JWT claims for a user: id, role names and token version.
+    Empty unless JWT_EMBED_ROLES is enabled.
+    """
+    if not current_app.config.get('JWT_EMBED_ROLES'):
+        return {}
+    return {
+        "uid": user.id,
+        "roles": sorted(user.role_names),
+        "tv": user.token_version or 0,
+    }
+
+
+def bump_token_version(user):
+    """Invalidate the user's outstanding tokens; takes effect when the caller commits."""
+    user.token_version = (user.token_version or 0) + 1
+
+
+def forget_token_version(user_id):
+    """Drop the cached token version after it changed in the database."""
+    token_version_cache.pop(user_id)
+
+
+def current_token_version(user_id):
+    """Current token version of a user, from the in-memory cache when possible."""
+    version = token_version_cache.get(user_id)
+    if version is None:
+        row = db.session.query(User.token_version, User.is_active).filter(User.id == user_id).first()
+        version = row.token_version if row and row.is_active else -1
+        token_version_cache.set(user_id, version)
+    return version
+
+
+def is_token_revoked(jwt_payload):
+    """
+    True if a token carrying a token version ("tv" claim) is outdated.
+    Tokens issued without embedded claims are never revoked here.
+    """
+    if 'tv' not in jwt_payload or 'uid' not in jwt_payload:
+        return False
+    return current_token_version(jwt_payload['uid']) != jwt_payload['tv']
+
+
+def load_user_with_roles(username):
+    """
+    Load a user and the names of its roles with a single joined query.
+    Returns (user, identity), or (None, None) if the user does not exist.
+    """
+    rows = (
+        db.session.query(User, Role.name)
+        .outerjoin(user_roles, user_roles.c.user_id == User.id)
+        .outerjoin(Role, Role.id == user_roles.c.role_id)
+        .filter(User.username == username)
+        .all()
+    )
+    if not rows:
+        return None, None
+
+    user = rows[0][0]
+    role_names = frozenset(name for _, name in rows if name)
+    user.set_role_names(role_names)
+    identity = Identity(user.id, user.username, user.is_active, role_names)
+    if identity_cache_enabled():
+        identity_cache.set(username, identity)
+    return user, identity
+
+
+def preload_role_names(users):
+    """Load the role names of many users with one query, so has_role/to_dict don't query per user."""
+    if not users:
+        return
+    rows = (
+        db.session.query(user_roles.c.user_id, Role.name)
+        .join(Role, Role.id == user_roles.c.role_id)
+        .filter(user_roles.c.user_id.in_([user.id for user in users]))
+        .all()
+    )
+    names = {}
+    for user_id, name in rows:
+        names.setdefault(user_id, set()).add(name)
+    for user in users:
+        user.set_role_names(names.get(user.id, ()))
+
+
+def reset_request_identity():
+    """Forget the identity resolved for a previous request sharing this app context."""
+    g.pop('current_user', None)
+    g.pop('current_identity', None)
+
+
+def _load_into_request(username):
+    user, identity = load_user_with_roles(username)
+    g.current_user = user
+    g.current_identity = identity
+    return user, identity
+
+
+def get_current_identity():
+    """
+    Identity of the JWT user, resolved at most once per request.
+    Taken from embedded token claims when present, then from the cross-request
+    cache when enabled, otherwise loaded with one query.
+    """
+    if 'current_identity' in g:
+        return g.current_identity
+
+    # Tokens with embedded roles were already checked against the token
+    # version by the blocklist loader, so they can be trusted as-is.
+    claims = get_jwt()
+    if 'roles' in claims and 'uid' in claims:
+        g.current_identity = Identity(claims['uid'], get_jwt_identity(), True, frozenset(claims['roles']))
+        return g.current_identity
+
+    username = get_jwt_identity()
+    identity = identity_cache.get(username) if identity_cache_enabled() else None
+    if identity is None:
+        _, identity = _load_into_request(username)
+    else:
+        g.current_identity = identity
+    return identity
+
 
 def roles_required(*required_roles):
     """
@@ -27,16 +181,12 @@ def roles_required(*required_roles):
             # Ensure JWT is present and valid
             verify_jwt_in_request()
 
-            # Get identity from JWT
-            username = get_jwt_identity()
-            user = User.query.filter_by(username=username).first()
-
-            if not user:
+            identity = get_current_identity()
+            if not identity:
                 return jsonify({"msg": "User not found"}), 404
 
             # Check if user has at least one required role
-            user_roles = {role.name for role in user.roles}
-            if not user_roles.intersection(required_roles):
+            if not identity.roles.intersection(required_roles):
                 return jsonify({"msg": "Access forbidden: insufficient role"}), 403
 
             return fn(*args, **kwargs)
@@ -46,5 +196,11 @@ def roles_required(*required_roles):
 
 # JWT contains username
 def get_current_user():
-    username = get_jwt_identity()
-    return User.query.filter_by(username=username).first()
+    """
+    The User for the current JWT, loaded once per request together with its
+    role names, so has_role checks on it do not hit the database.
+    """
+    if g.get('current_user') is not None:
+        return g.current_user
+    user, _ = _load_into_request(get_jwt_identity())
+    return user
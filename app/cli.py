@@ -2,10 +2,17 @@
 
 import os
 import click
+from flask import current_app
 from flask.cli import with_appcontext
 
 from app.models.user import User, Role
 from app.extensions import db
+from app.utils.content_archive import ContentImporter, export_content, open_archive
+from app.utils.content_cache import bump_content_version
+from app.utils.login_stats import rebuild_login_counters, rebuild_user_activity
+from app.utils.metrics import rebuild_daily_metrics
+from app.utils.rollups import rebuild_rollups, verify_rollups
+from app.utils.search import search_index
 
 @click.command("seed-roles")
 @with_appcontext
@@ -66,3 +73,176 @@ def create_admin():
         click.secho(f"✅ Admin user '{username}' created successfully.", fg="green")
     else:
         click.secho("ℹ️  Admin user already exists. No changes made.", fg="blue")
+
+
+@click.command("rebuild-search-index")
+@with_appcontext
+def rebuild_search_index():
+    """
+    Re-indexes all topics and published subtopics for full-text search.
+
+    Usage:
+        flask rebuild-search-index
+    """
+    count = search_index.rebuild()
+    click.secho(f"✅ Indexed {count} documents ({search_index.backend.name} backend).", fg="green")
+
+
+@click.group("analytics")
+def analytics_cli():
+    """Maintenance commands for analytics aggregates."""
+
+
+@analytics_cli.command("rebuild-rollups")
+@with_appcontext
+def rebuild_rollups_command():
+    """
+    Rebuilds the SubTopicAnalytics totals and hourly/daily buckets from raw views.
+
+    Usage:
+        flask analytics rebuild-rollups
+    """
+    processed = rebuild_rollups()
+    click.secho(f"✅ Rollups rebuilt from {processed} views.", fg="green")
+
+
+@analytics_cli.command("rebuild-daily-metrics")
+@with_appcontext
+def rebuild_daily_metrics_command():
+    """
+    Rebuilds the daily/hourly site metrics from raw sessions and views.
+
+    Usage:
+        flask analytics rebuild-daily-metrics
+    """
+    sessions, views = rebuild_daily_metrics()
+    click.secho(f"✅ Daily metrics rebuilt from {sessions} sessions and {views} views.", fg="green")
+
+
+@analytics_cli.command("rebuild-login-counters")
+@with_appcontext
+def rebuild_login_counters_command():
+    """
+    Rebuilds the per-day login device/browser/OS counters from the session log.
+
+    Usage:
+        flask analytics rebuild-login-counters
+    """
+    processed = rebuild_login_counters()
+    click.secho(f"✅ Login counters rebuilt from {processed} logins.", fg="green")
+
+
+@analytics_cli.command("rebuild-user-activity")
+@with_appcontext
+def rebuild_user_activity_command():
+    """
+    Recomputes each user's last login and last audit activity timestamps.
+
+    Usage:
+        flask analytics rebuild-user-activity
+    """
+    updated = rebuild_user_activity()
+    click.secho(f"✅ Activity summary rebuilt for {updated} users.", fg="green")
+
+
+@analytics_cli.command("verify-rollups")
+@with_appcontext
+def verify_rollups_command():
+    """
+    Compares the rollup tables against the raw SubTopicView rows.
+    Exits with status 1 if any mismatch is found.
+
+    Usage:
+        flask analytics verify-rollups
+    """
+    problems = verify_rollups()
+    if not problems:
+        click.secho("✅ Rollups match raw view data.", fg="green")
+        return
+    for problem in problems:
+        click.secho(f"❌ {problem}", fg="red")
+    raise click.exceptions.Exit(1)
+
+
+@click.group("content")
+def content_cli():
+    """Bulk export and import of topics, subtopics and quizzes."""
+
+
+@content_cli.command("export")
+@click.option("--output", "-o", default="-", show_default=True,
+              help="Archive path ('-' for stdout); gzip-compressed if it ends in .gz.")
+@click.option("--chunk-size", default=1000, show_default=True, help="Rows fetched per query round-trip.")
+@with_appcontext
+def export_content_command(output, chunk_size):
+    """
+    Streams every topic, subtopic and quiz to a JSON Lines archive.
+
+    Usage:
+        flask content export -o content.jsonl.gz
+    """
+    if output == "-":
+        counts = export_content(click.get_text_stream("stdout"), chunk_size)
+    else:
+        with open_archive(output, "w") as out:
+            counts = export_content(out, chunk_size)
+    click.secho(
+        f"✅ Exported {counts['topics']} topics, {counts['subtopics']} subtopics "
+        f"and {counts['quizzes']} quizzes.", fg="green", err=True
+    )
+
+
+@content_cli.command("import")
+@click.argument("archive")
+@click.option("--dry-run", is_flag=True, help="Validate and apply in a transaction that is rolled back.")
+@click.option("--chunk-size", default=1000, show_default=True, help="Rows per multi-row upsert.")
+@with_appcontext
+def import_content_command(archive, dry_run, chunk_size):
+    """
+    Loads a JSON Lines archive (plain or gzip, '-' for stdin), upserting topics
+    and subtopics by slug and replacing the quizzes of the listed subtopics.
+    Nothing is written if any record is invalid. Exits with status 1 then.
+    Running web workers refresh their content caches through the shared
+    content version, so they need no restart.
+
+    Usage:
+        flask content import content.jsonl.gz [--dry-run]
+    """
+    importer = ContentImporter(chunk_size)
+    # A savepoint lets a dry run or a failed import be undone as a whole.
+    savepoint = db.session.begin_nested()
+    try:
+        if archive == "-":
+            importer.run(click.get_text_stream("stdin"))
+        else:
+            with open_archive(archive, "r") as lines:
+                importer.run(lines)
+    except Exception:
+        savepoint.rollback()
+        raise
+
+    counts = importer.counts
+    summary = f"{counts['topics']} topics, {counts['subtopics']} subtopics and {counts['quizzes']} quizzes"
+    if importer.error_count:
+        savepoint.rollback()
+        for error in importer.errors:
+            click.secho(f"❌ line {error['line']}: {error['errors']}", fg="red")
+        click.secho(f"❌ {importer.error_count} invalid records; nothing imported.", fg="red")
+        raise click.exceptions.Exit(1)
+    if dry_run:
+        savepoint.rollback()
+        click.secho(f"ℹ️  Dry run: {summary} would be imported.", fg="blue")
+        return
+
+    savepoint.commit()
+    db.session.commit()
+    # Running web workers see the shared content version move and rebuild their
+    # sidebar/navigation caches (and in-memory search index) on their own.
+    bump_content_version()
+    if search_index.backend.persistent:
+        search_index.rebuild()
+    click.secho(f"✅ Imported {summary}.", fg="green")
+    click.echo(
+        f"Running workers pick up the new content within "
+        f"{current_app.config.get('CONTENT_VERSION_CACHE_TTL', 1.0):g}s; no restart needed."
+    )
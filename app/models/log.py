@@ -17,6 +17,29 @@ class SessionLog(db.Model):
 
     user = db.relationship('User', backref='session_logs')
 
+    __table_args__ = (
+        # Per-user last-login lookup of the user listing
+        db.Index('ix_session_log_user_login', 'user_id', 'login_time'),
+        # Login trends over a time range
+        db.Index('ix_session_log_login_time', 'login_time'),
+    )
+
+
+class LoginDeviceCounter(db.Model):
+    """
+    Logins per UTC day, user and device/browser/OS, maintained as sessions
+    are logged so device analytics never scan the full session log.
+    Unknown values are stored as an empty string (they are part of the key).
+    """
+    __tablename__ = 'login_device_counters'
+
+    day = db.Column(db.Date, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    device = db.Column(db.String(64), primary_key=True, default='')
+    browser = db.Column(db.String(64), primary_key=True, default='')
+    os = db.Column(db.String(64), primary_key=True, default='')
+    logins = db.Column(db.Integer, default=0, nullable=False)
+
 
 class AuditLog(db.Model):
     __tablename__ = 'audit_log'
@@ -29,3 +52,8 @@ class AuditLog(db.Model):
 
     actor = db.relationship('User', foreign_keys=[actor_id], backref='performed_actions')
     target_user = db.relationship('User', foreign_keys=[target_user_id], backref='audit_records')
+
+    __table_args__ = (
+        db.Index('ix_audit_log_actor_timestamp', 'actor_id', 'timestamp'),
+        db.Index('ix_audit_log_timestamp', 'timestamp'),
+    )
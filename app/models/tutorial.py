@@ -2,7 +2,8 @@
 
 from datetime import datetime, timezone
 from sqlalchemy import (
-    Column, Integer, String, Text, DateTime, Float, Enum, ForeignKey
+    Column, Integer, String, Text, Date, DateTime, Float, Enum, ForeignKey,
+    Index, UniqueConstraint
 )
 from sqlalchemy.orm import relationship
 from app.extensions import db
@@ -92,6 +93,17 @@ class Quiz(db.Model):
         return f"<Quiz {self.question[:30]}...>"
 
 
+class ContentVersion(db.Model):
+    """
+    Single row (id 1) counting content writes, shared by every worker
+    process; caches derived from the content tables are rebuilt when it moves.
+    """
+    __tablename__ = 'content_version'
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+
+
 # ----------------------------
 # Analytics & Tracking Models (Non-Flask db.Model)
 # ----------------------------
@@ -101,10 +113,14 @@ class Session(db.Model):
     Tracks anonymous user sessions (used for analytics, search, and error correlation).
     """
     __tablename__ = 'sessions'
+    __table_args__ = (
+        Index('ix_sessions_started_at', 'started_at'),
+    )
 
     id = Column(Integer, primary_key=True)
     session_id = Column(String, unique=True, nullable=False)
     ip_address = Column(String)
+    user_agent = Column(String, nullable=True)  # raw header, enriched into browser/os/device_type
     browser = Column(String)
     os = Column(String)
     device_type = Column(String, nullable=True)
@@ -125,6 +141,10 @@ class SubTopicView(db.Model):
     Tracks time spent and scroll depth.
     """
     __tablename__ = 'subtopic_views'
+    __table_args__ = (
+        Index('ix_subtopic_views_viewed_at_subtopic', 'viewed_at', 'subtopic_id'),
+        Index('ix_subtopic_views_session_viewed_at', 'session_id', 'viewed_at'),
+    )
 
     id = Column(Integer, primary_key=True)
     subtopic_id = Column(Integer, ForeignKey('sub_topic.id'), nullable=False)
@@ -148,15 +168,79 @@ class SubTopicAnalytics(db.Model):
     total_views = Column(Integer, default=0)
     total_time_spent = Column(Float, default=0.0)
     average_scroll_depth = Column(Float, default=0.0)
+    # Number of views that reported time spent / scroll depth, needed to keep averages incremental.
+    time_spent_samples = Column(Integer, default=0)
+    scroll_depth_samples = Column(Integer, default=0)
 
     subtopic = relationship("SubTopic", back_populates="analytics")
 
 
+class SubTopicAnalyticsBucket(db.Model):
+    """
+    Time-bucketed (hourly or daily) view aggregates per subtopic.
+    Maintained incrementally as views are ingested.
+    """
+    __tablename__ = 'subtopic_analytics_buckets'
+    __table_args__ = (
+        UniqueConstraint('subtopic_id', 'granularity', 'bucket_start', name='uq_subtopic_bucket'),
+        Index('ix_subtopic_buckets_granularity_start', 'granularity', 'bucket_start'),
+    )
+
+    id = Column(Integer, primary_key=True)
+    subtopic_id = Column(Integer, ForeignKey('sub_topic.id'), nullable=False)
+    granularity = Column(String(8), nullable=False)  # 'hour' or 'day'
+    bucket_start = Column(DateTime, nullable=False)
+    views = Column(Integer, default=0, nullable=False)
+    time_spent_total = Column(Float, default=0.0, nullable=False)
+    time_spent_samples = Column(Integer, default=0, nullable=False)
+    scroll_depth_total = Column(Float, default=0.0, nullable=False)
+    scroll_depth_samples = Column(Integer, default=0, nullable=False)
+    scroll_0_25 = Column(Integer, default=0, nullable=False)
+    scroll_25_50 = Column(Integer, default=0, nullable=False)
+    scroll_50_75 = Column(Integer, default=0, nullable=False)
+    scroll_75_100 = Column(Integer, default=0, nullable=False)
+
+
+class DailyMetrics(db.Model):
+    """
+    Site-wide totals per UTC day, maintained incrementally by view ingestion
+    and session creation.
+    """
+    __tablename__ = 'daily_metrics'
+
+    day = Column(Date, primary_key=True)
+    views = Column(Integer, default=0, nullable=False)
+    unique_sessions = Column(Integer, default=0, nullable=False)
+    new_sessions = Column(Integer, default=0, nullable=False)
+    time_spent_total = Column(Float, default=0.0, nullable=False)
+    time_spent_samples = Column(Integer, default=0, nullable=False)
+
+
+class HourlyMetrics(db.Model):
+    """Site-wide views and new sessions per UTC hour (hour-of-day and weekday histograms)."""
+    __tablename__ = 'hourly_metrics'
+
+    hour_start = Column(DateTime, primary_key=True)
+    views = Column(Integer, default=0, nullable=False)
+    new_sessions = Column(Integer, default=0, nullable=False)
+
+
+class DailySessionActivity(db.Model):
+    """Sessions that viewed content on a given UTC day; backs DailyMetrics.unique_sessions."""
+    __tablename__ = 'daily_session_activity'
+
+    day = Column(Date, primary_key=True)
+    session_id = Column(Integer, ForeignKey('sessions.id', ondelete='CASCADE'), primary_key=True)
+
+
 class SearchQuery(db.Model):
     """
     Stores search terms entered by users for analysis and UX improvements.
     """
     __tablename__ = 'search_queries'
+    __table_args__ = (
+        Index('ix_search_queries_searched_at', 'searched_at'),
+    )
 
     id = Column(Integer, primary_key=True)
     query_text = Column(String, nullable=False)
@@ -171,6 +255,9 @@ class ErrorLog(db.Model):
     Logs client-side or API errors to help with debugging and quality tracking.
     """
     __tablename__ = 'error_logs'
+    __table_args__ = (
+        Index('ix_error_logs_logged_at', 'logged_at'),
+    )
 
     id = Column(Integer, primary_key=True)
     error_message = Column(String, nullable=False)
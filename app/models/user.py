@@ -21,6 +21,11 @@ class User(db.Model):
     password_hash = db.Column(db.String(128), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_active = db.Column(db.Boolean, default=True)  # <-- Add this line
+    # Bumped on role, status or username changes to invalidate outstanding JWTs
+    token_version = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    # Activity summary, maintained on login (log_session) and audit writes (log_audit_action)
+    last_login_at = db.Column(db.DateTime, nullable=True)
+    last_activity_at = db.Column(db.DateTime, nullable=True, index=True)
     # Many-to-many relationship: users <-> roles
     roles = db.relationship('Role', secondary=user_roles, backref='users', lazy='dynamic')
 
@@ -32,9 +37,26 @@ class User(db.Model):
         """Validates the password against the stored hash."""
         return bcrypt.check_password_hash(self.password_hash, password)
 
+    @property
+    def role_names(self):
+        """Set of role names, loaded at most once per instance (see invalidate_roles)."""
+        names = self.__dict__.get('_role_names')
+        if names is None:
+            names = frozenset(role.name for role in self.roles)
+            self.__dict__['_role_names'] = names
+        return names
+
+    def set_role_names(self, names):
+        """Pre-populate the role name set, e.g. from a joined query."""
+        self.__dict__['_role_names'] = frozenset(names)
+
+    def invalidate_roles(self):
+        """Forget the loaded role names after the roles relationship changed."""
+        self.__dict__.pop('_role_names', None)
+
     def has_role(self, role_name):
         """Checks if the user has a specific role."""
-        return self.roles.filter(Role.name == role_name).count() > 0
+        return role_name in self.role_names
 
     def get_role_names(self):
         """Returns a list of role names assigned to the user."""
@@ -50,7 +72,7 @@ class User(db.Model):
             "email": self.email,
             "is_active": self.is_active,
             "created_at": self.created_at.isoformat() if self.created_at else None,
-            "roles": [role.name for role in self.roles]
+            "roles": sorted(self.role_names)
         }
 
 
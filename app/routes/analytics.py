@@ -1,18 +1,29 @@
 import logging
-from sqlalchemy import func, extract, distinct, cast, Date, String, desc, case
+from sqlalchemy import func, case, select, union_all
 from datetime import datetime, timezone, timedelta
-from flask import Blueprint, request, jsonify, request
+from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
-from app.models.tutorial import Topic, SubTopic, Session, SubTopicView, SearchQuery, ErrorLog
+from marshmallow import ValidationError
+from app.models.tutorial import (
+    Topic, SubTopic, SubTopicView, SubTopicAnalyticsBucket, SearchQuery, ErrorLog
+)
 from app.extensions import db
-from user_agents import parse
-from datetime import datetime, date
+from app.utils.enrichment import EnrichmentJob, client_enricher, enrichment_fields, user_agent_cache
+from app.utils.geoip import geo_lookup
 from app.utils.logging_utils import (
-    get_country_from_ip,
-    format_last_login,
     get_client_ip,
-    get_or_create_session
+    get_or_create_session,
+    resolve_session_pk,
+    session_id_cache
     )
+from app.utils.ingestion import view_ingestor
+from app.utils.metrics import (
+    breakdown_cache, engagement_metrics, engagement_rates, metrics_cache, summary_metrics, view_breakdown
+)
+from app.utils.rollups import SCROLL_BANDS, bucket_start
+from app.utils.time_ranges import last_days
+from app.utils.timeseries import TimeSeries
+from app.routes.schemas import SubTopicViewSchema
 
 
 logger = logging.getLogger(__name__)
@@ -27,23 +38,26 @@ def start_session():
         return jsonify({"error": "session_id is required"}), 400
 
     user_agent_str = request.headers.get('User-Agent', '')
-    user_agent = parse(user_agent_str)
-
     ip_addr = get_client_ip(request)
-    country = get_country_from_ip(ip_addr)
+    device_type = data.get('device_type')
 
     env_data = {
         'ip_address': ip_addr,
-        'browser': user_agent.browser.family,
-        'os': user_agent.os.family,
-        'device_type': data.get('device_type'),
-        'country': country,
+        'user_agent': user_agent_str,
+        'device_type': device_type,
     }
+    if not client_enricher.deferred:
+        env_data.update(enrichment_fields('session', ip_addr, user_agent_str, fill_device=not device_type))
 
     session, created = get_or_create_session(session_id, **env_data)
     if session is None:
         return jsonify({"error": "Failed to start or update session"}), 500
 
+    if client_enricher.deferred:
+        client_enricher.submit(
+            EnrichmentJob('session', session.id, ip_addr, user_agent_str, fill_device=not device_type)
+        )
+
     if created:
         return jsonify({"message": "Session started"}), 201
     else:
@@ -62,40 +76,42 @@ def record_subtopic_view():
         "scroll_depth_percent": float (optional)
     }
     """
-    data = request.get_json() or {}
-
-    session_id = data.get('session_id')
-    subtopic_id = data.get('subtopic_id')
-
-    if not session_id or not subtopic_id:
-        return jsonify({"error": "session_id and subtopic_id are required"}), 400
+    try:
+        data = SubTopicViewSchema().load(request.get_json() or {})
+    except ValidationError as err:
+        message = "; ".join(f"{field}: {' '.join(errors)}" for field, errors in err.messages.items())
+        return jsonify({"error": message}), 400
 
-    session = Session.query.filter_by(session_id=session_id).first()
-    if not session:
+    session_pk = resolve_session_pk(data['session_id'])
+    if session_pk is None:
         return jsonify({"error": "Session not found"}), 404
 
-    time_spent = data.get('time_spent_seconds')
-    scroll_percent = data.get('scroll_depth_percent')
-
     # if time_spent < 30 or scroll_percent < 25:
     #     return jsonify({"message": "View ignored — not enough engagement"}), 200
 
-    view = SubTopicView(
-        subtopic_id=subtopic_id,
-        session_id=session.id,
-        viewed_at=datetime.now(timezone.utc),
-        time_spent_seconds=time_spent,
-        scroll_depth_percent=scroll_percent
-    )
+    view = {
+        'subtopic_id': data['subtopic_id'],
+        'session_id': session_pk,
+        'viewed_at': datetime.now(timezone.utc),
+        'time_spent_seconds': data['time_spent_seconds'],
+        'scroll_depth_percent': data['scroll_depth_percent'],
+    }
 
-    db.session.add(view)
     try:
-        db.session.commit()
+        accepted = view_ingestor.submit(view)
     except Exception as e:
         db.session.rollback()
         logger.error("Database error recording subtopic view", exc_info=True)
         return jsonify({"error": "Failed to record view"}), 500
 
+    if not accepted:
+        logger.warning("Subtopic view rejected: ingestion queue is full")
+        response = jsonify({"error": "Analytics ingestion is overloaded, retry later"})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+    if view_ingestor.buffered:
+        return jsonify({"message": "Subtopic view queued"}), 202
     return jsonify({"message": "Subtopic view recorded"}), 201
 
 
@@ -114,14 +130,11 @@ def record_search_query():
     if not query_text or not query_text.strip():
         return jsonify({"error": "query_text is required"}), 400
 
-    session = None
-    session_id = data.get('session_id')
-    if session_id:
-        session = Session.query.filter_by(session_id=session_id).first()
+    session_pk = resolve_session_pk(data.get('session_id'))
 
     search_query = SearchQuery(
         query_text=query_text.strip(),
-        session_id=session.id if session else None,
+        session_id=session_pk,
         searched_at=datetime.now(timezone.utc)
     )
 
@@ -154,17 +167,14 @@ def record_error_log():
     if not error_message or not error_message.strip():
         return jsonify({"error": "error_message is required"}), 400
 
-    session = None
-    session_id = data.get('session_id')
-    if session_id:
-        session = Session.query.filter_by(session_id=session_id).first()
+    session_pk = resolve_session_pk(data.get('session_id'))
 
     error_log = ErrorLog(
         error_message=error_message.strip(),
         url=data.get('url'),
         stack_trace=data.get('stack_trace'),
         error_type=data.get('error_type'),
-        session_id=session.id if session else None,
+        session_id=session_pk,
         logged_at=datetime.now(timezone.utc)
     )
 
@@ -179,121 +189,89 @@ def record_error_log():
     return jsonify({"message": "Error log recorded"}), 201
 
 
-@bp.route("/metrics", methods=["GET"])
+@bp.route('/cache-stats', methods=['GET'])
 @jwt_required()
-def get_summary_metrics():
-    today = date.today()
+def cache_stats():
+    """Hit/miss counters of the in-process analytics caches, for monitoring."""
+    return jsonify({
+        "session_ids": session_id_cache.stats(),
+        "user_agents": user_agent_cache.stats(),
+        "geoip": geo_lookup.stats(),
+        "metrics": metrics_cache.stats(),
+        "view_breakdowns": breakdown_cache.stats(),
+    })
 
-    # Total sessions = proxy for users (unless you have a user model)
-    total_users = db.session.query(func.count(Session.id)).scalar()
 
-    # Subtopic views today
-    views_today = db.session.query(func.count(SubTopicView.id)) \
-        .filter(func.date(SubTopicView.viewed_at) == today).scalar()
+@bp.route("/metrics", methods=["GET"])
+@jwt_required()
+def get_summary_metrics():
+    """
+    Dashboard counters. Sessions are a proxy for users; "today" is the
+    current UTC day. Served from the materialized daily metrics.
+    """
+    metrics = summary_metrics()
 
     # All subtopics = "Topic Contents"
     total_topic_contents = db.session.query(func.count(SubTopic.id)).scalar()
 
-    # Query the number of user sessions that started today.
-    # This represents the count of "new users today" for analytics purposes.
-    # Note: Assumes each session corresponds to a unique user interaction.
-    new_users_today = db.session.query(func.count(Session.id)) \
-        .filter(func.date(Session.started_at) == today) \
-        .scalar()
-
     return jsonify({
-        "users": total_users,
-        "views_today": views_today,
+        "users": metrics["users"],
+        "views_today": metrics["views_today"],
         "topic_contents": total_topic_contents,
-        "new_users_today": new_users_today
+        "new_users_today": metrics["new_users_today"]
     })
 
 @bp.route('/engagement-summary', methods=['GET'])
 @jwt_required()
 def engagement_summary():
-    now = datetime.utcnow()
-    week_start = now - timedelta(days=7)
-
-    # 🧍 Unique Visitors This Week
-    unique_visitors = db.session.query(
-        func.count(distinct(Session.session_id))
-    ).filter(Session.started_at >= week_start).scalar()
-
-    # 🕐 Peak Activity Hour (e.g., 14 → 2PM)
-    peak_hour_data = db.session.query(
-        extract('hour', SubTopicView.viewed_at).label('hour'),
-        func.count().label('views')
-    ).filter(SubTopicView.viewed_at >= week_start) \
-     .group_by('hour') \
-     .order_by(func.count().desc()) \
-     .first()
-
-    peak_hour_range = (
-        f"{peak_hour_data.hour}:00 - {peak_hour_data.hour + 1}:00"
-        if peak_hour_data else "N/A"
-    )
-
-    # 📈 Highest Day of the Week (e.g., Friday)
-    peak_day_data = db.session.query(
-        extract('dow', SubTopicView.viewed_at).label('day_of_week'),
-        func.count().label('views')
-    ).filter(SubTopicView.viewed_at >= week_start) \
-     .group_by('day_of_week') \
-     .order_by(func.count().desc()) \
-     .first()
-
-    day_names = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
-    peak_day = (
-        day_names[int(peak_day_data.day_of_week)] if peak_day_data else "N/A"
-    )
-
-    return jsonify({
-        "unique_visitors": unique_visitors,
-        "peak_hour_range": peak_hour_range,
-        "peak_day": peak_day
-    })
+    """
+    Unique visitors (sessions started), peak activity hour and busiest
+    weekday over the last week, from the materialized hourly metrics.
+    """
+    return jsonify(engagement_metrics())
 
 
 @bp.route('/engagement-rate', methods=['GET'])
 @jwt_required()
 def engagement_rate():
-    week_ago = datetime.utcnow() - timedelta(days=7)
-
-    # Step 1: Total unique sessions (recent)
-    total_visitors = db.session.query(
-        Session.id
-    ).filter(Session.started_at >= week_ago).all()
-
-    total_ids = [s.id for s in total_visitors]
-
-    if not total_ids:
-        return jsonify({
-            "engagement_rate_percent": 0,
-            "engaged_visitors": 0,
-            "total_visitors": 0
-        })
-
-    # Step 2: How many of those sessions had at least one subtopic view?
-    engaged_visitors = db.session.query(
-        func.count(distinct(SubTopicView.session_id))
-    ).filter(
-        SubTopicView.session_id.in_(total_ids),
-        SubTopicView.viewed_at >= week_ago
-    ).scalar()
-
-    rate = (engaged_visitors / len(total_ids)) * 100
-    # print("Engaged:", engaged_visitors, "Total:", total_visitors)
+    """
+    Share of recent sessions with at least one subtopic view.
 
-    return jsonify({
-        "engagement_rate_percent": round(rate, 1),
-        "engaged_visitors": engaged_visitors,
-        "total_visitors": len(total_ids)
-    })
+    Query Parameters:
+        days (int): Window of session start times, 1-365 (default 7).
+        breakdown (str): "day" to add a per-day breakdown by session start date.
+        cohort_days (int): Count a session as engaged only if it viewed content
+            within this many days of starting (default: any view in the window).
+    """
+    days = request.args.get('days', default=7, type=int)
+    cohort_days = request.args.get('cohort_days', type=int)
+    breakdown = request.args.get('breakdown')
+    if days is None or not 1 <= days <= 365:
+        return jsonify({"error": "days must be between 1 and 365"}), 400
+    if cohort_days is not None and not 1 <= cohort_days <= 365:
+        return jsonify({"error": "cohort_days must be between 1 and 365"}), 400
+    if breakdown not in (None, 'day'):
+        return jsonify({"error": "breakdown must be 'day'"}), 400
+
+    since = datetime.utcnow() - timedelta(days=days)
+    result = engagement_rates(since, cohort_days=cohort_days, by_day=breakdown == 'day')
+    result["window_days"] = days
+    if cohort_days is not None:
+        result["cohort_days"] = cohort_days
+    return jsonify(result)
 
 
 @bp.route('/top-contents')
 @jwt_required()
 def get_content_views():
+    """
+    The 20 most viewed subtopics over the last day, week, 30 days or year,
+    up to now (?range=daily|weekly|monthly|yearly).
+
+    Whole buckets of the window come from the rollups: hourly ones for
+    ``daily``, daily ones otherwise. The partial bucket at the start of the
+    window is counted from the raw views, so the window is exact.
+    """
     range_type = request.args.get('range', 'daily')
     now = datetime.utcnow()  # naive UTC datetime
 
@@ -309,33 +287,50 @@ def get_content_views():
     else:
         return jsonify({'error': 'Invalid range'}), 400
 
-    scroll_0_25 = func.count(case((SubTopicView.scroll_depth_percent.between(0, 25), 1), else_=None))
-    scroll_25_50 = func.count(case((SubTopicView.scroll_depth_percent.between(25, 50), 1), else_=None))
-    scroll_50_75 = func.count(case((SubTopicView.scroll_depth_percent.between(50, 75), 1), else_=None))
-    scroll_75_100 = func.count(case((SubTopicView.scroll_depth_percent.between(75, 100), 1), else_=None))
-
-    avg_time_spent = func.avg(SubTopicView.time_spent_seconds)
+    granularity = 'hour' if range_type == 'daily' else 'day'
+    first_bucket = bucket_start(since, granularity)
+    if first_bucket < since:
+        first_bucket += timedelta(hours=1) if granularity == 'hour' else timedelta(days=1)
+
+    bucket = SubTopicAnalyticsBucket
+    band_names = [name for name, _, _ in SCROLL_BANDS]
+    rolled_up = (
+        select(
+            bucket.subtopic_id, bucket.views, bucket.time_spent_total, bucket.time_spent_samples,
+            *(getattr(bucket, name) for name in band_names),
+        )
+        .where(bucket.granularity == granularity, bucket.bucket_start >= first_bucket)
+    )
+    leading = (
+        select(
+            SubTopicView.subtopic_id,
+            func.count(SubTopicView.id).label('views'),
+            func.coalesce(func.sum(SubTopicView.time_spent_seconds), 0).label('time_spent_total'),
+            func.count(SubTopicView.time_spent_seconds).label('time_spent_samples'),
+            *(func.sum(case((SubTopicView.scroll_depth_percent.between(low, high), 1), else_=0)).label(name)
+              for name, low, high in SCROLL_BANDS),
+        )
+        .where(SubTopicView.viewed_at >= since, SubTopicView.viewed_at < first_bucket)
+        .group_by(SubTopicView.subtopic_id)
+    )
+    rows = union_all(rolled_up, leading).subquery()
+    total_views = func.sum(rows.c.views)
 
     query = (
         db.session.query(
             SubTopic.id.label('subtopic_id'),
             SubTopic.title.label('subtopic_title'),
             Topic.title.label('topic_title'),
-            func.count(SubTopicView.id).label('views'),
-            avg_time_spent.label('avg_time_spent_seconds'),
-            scroll_0_25.label('scroll_0_25'),
-            scroll_25_50.label('scroll_25_50'),
-            scroll_50_75.label('scroll_50_75'),
-            scroll_75_100.label('scroll_75_100'),
+            total_views.label('views'),
+            func.sum(rows.c.time_spent_total).label('time_spent_total'),
+            func.sum(rows.c.time_spent_samples).label('time_spent_samples'),
+            *(func.sum(rows.c[name]).label(name) for name in band_names),
         )
-        .join(SubTopic, SubTopic.id == SubTopicView.subtopic_id)
+        .select_from(rows)
+        .join(SubTopic, SubTopic.id == rows.c.subtopic_id)
         .join(Topic, Topic.id == SubTopic.topic_id)
-        .filter(
-            SubTopicView.viewed_at.isnot(None),
-            SubTopicView.viewed_at >= since
-        )
         .group_by(SubTopic.id, Topic.id)
-        .order_by(func.count(SubTopicView.id).desc())
+        .order_by(total_views.desc())
         .limit(20)
     )
 
@@ -347,7 +342,9 @@ def get_content_views():
             "subtopic_title": row.subtopic_title,
             "topic_title": row.topic_title,
             "views": row.views,
-            "avg_time_spent_seconds": float(row.avg_time_spent_seconds or 0),
+            "avg_time_spent_seconds": (
+                float(row.time_spent_total) / row.time_spent_samples if row.time_spent_samples else 0.0
+            ),
             "scroll_distribution": {
                 "0-25%": row.scroll_0_25,
                 "25-50%": row.scroll_25_50,
@@ -359,76 +356,61 @@ def get_content_views():
     return jsonify({"views": response}), 200
 
 
+view_trends = TimeSeries('subtopic-views', SubTopicView.viewed_at, {
+    'views': func.count(SubTopicView.id),
+    'time_spent': func.coalesce(func.sum(SubTopicView.time_spent_seconds), 0),
+    'users': func.count(func.distinct(SubTopicView.session_id)),
+})
+
+
 @bp.route('/daily-trends')
 @jwt_required()
 def daily_trends():
+    """
+    Views, time spent and unique sessions per bucket, with empty buckets
+    filled with zeros.
+
+    Query Parameters:
+        range (str): 7d, 28d (default), 90d or 365d.
+        granularity (str): day (default), week or month.
+    """
     range_param = request.args.get('range', '28d')
     range_days_map = {"7d": 7, "28d": 28, "90d": 90, "365d": 365}
     days = range_days_map.get(range_param)
     if days is None:
         return jsonify({"error": "Invalid range value"}), 400
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ('day', 'week', 'month'):
+        return jsonify({"error": "Invalid granularity value"}), 400
 
-    end_date = datetime.utcnow().date()
-    start_date = end_date - timedelta(days=days)
-
-    results = (
-    db.session.query(
-        SubTopicView.viewed_at.label('viewed_at'),
-        func.count(SubTopicView.id).label('views'),
-        func.coalesce(func.sum(SubTopicView.time_spent_seconds), 0).label('time_spent'),
-        func.count(func.distinct(SubTopicView.session_id)).label('unique_users')
-    )
-    .filter(SubTopicView.viewed_at >= start_date)
-    .group_by(func.date(SubTopicView.viewed_at))
-    .order_by(func.date(SubTopicView.viewed_at))
-    .all()
-    )
+    start, end = last_days(days)
 
     response = {"labels": [], "views": [], "time_spent": [], "users": []}
-    last_date = None
-    aggregate = {"views": 0, "time_spent": 0, "users": 0}
-
-    for row in results:
-        # Extract date part from datetime
-        day = row.viewed_at.date()
-        # Prepare the response as usual
-        response["labels"].append(format_last_login(day.strftime("%Y-%m-%d")))
-        response["views"].append(row.views)
-        response["time_spent"].append(row.time_spent)
-        response["users"].append(row.unique_users)
+    for bucket, values in view_trends.fetch(start, end, granularity):
+        response["labels"].append(bucket.strftime("%b %d, %Y"))
+        response["views"].append(values['views'])
+        response["time_spent"].append(values['time_spent'])
+        response["users"].append(values['users'])
 
     return jsonify(response)
 
 @bp.route('/views/stats', methods=['GET'])
 def device_country_stats_progressive():
+    """
+    Views in the selected range by device type, OS, browser and country.
+
+    Query Parameters:
+        range (str): 7d, 28d (default), 90d or 365d.
+        top (int): Keep the N largest keys per dimension and group the rest as "Other".
+    """
     range_param = request.args.get('range', '28d').lower()
     range_days_map = {"7d": 7, "28d": 28, "90d": 90, "365d": 365}
     days = range_days_map.get(range_param)
     if days is None:
         return jsonify({"error": "Invalid range parameter"}), 400
+    top = request.args.get('top', type=int)
+    if top is not None and top < 1:
+        return jsonify({"error": "top must be a positive integer"}), 400
 
-    end_date = datetime.utcnow().date()
-    start_date = end_date - timedelta(days=days)
-
-    def aggregate_by_field(field):
-        field_attr = getattr(Session, field)
-        results = (
-            db.session.query(
-                field_attr.label('key'),
-                func.count(SubTopicView.id).label('views')
-            )
-            .join(SubTopicView, SubTopicView.session_id == Session.id)
-            .group_by(field_attr)
-            .order_by(func.count(SubTopicView.id).desc())
-            .all()
-        )
-        # print(f"{field} stats:", results)
-        return [{"key": k or "Unknown", "views": v} for k, v in results]
-
-    response = {
-        "device_type": aggregate_by_field('device_type'),
-        "os": aggregate_by_field('os'),
-        "browser": aggregate_by_field('browser'),
-        "country": aggregate_by_field('country'),
-    }
-    return jsonify(response)
+    start, end = last_days(days)
+    return jsonify(view_breakdown(start, end, top=top))
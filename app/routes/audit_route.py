@@ -2,14 +2,18 @@
 
 from flask import Blueprint, jsonify, current_app, request, abort
 from flask_jwt_extended import jwt_required
-from sqlalchemy import func, extract, desc
-from datetime import datetime, timedelta
+from sqlalchemy import func, extract, desc, or_
+from datetime import date, datetime, timedelta
 from sqlalchemy.orm import aliased
 from app.models.log import AuditLog, SessionLog
-from app.models.user import User, Role
+from app.models.user import User, Role, user_roles
 from app.extensions import db
 from sqlalchemy.exc import SQLAlchemyError
+from app.utils.db_utils import string_agg
 from app.utils.logging_utils import format_last_login
+from app.utils.login_stats import device_distributions
+from app.utils.time_ranges import day_range, utc_now
+from app.utils.timeseries import TimeSeries
 
 bp = Blueprint("audit", __name__)
 
@@ -30,76 +34,72 @@ def audit_summary():
 @jwt_required()
 def inactive_users():
     """
-    Return paginated list of users who have had no audit log activity
-    in the last 14 days, including their roles and last seen info.
-    Supports pagination via query params: ?page=1&per_page=20
+    Return users with no audit log activity in the last N days, including
+    their roles and last seen info, ordered by username.
+
+    Query Parameters:
+        days (int): Inactivity threshold in days (default INACTIVE_USER_DAYS, 14).
+        per_page (int): Page size, 1-100 (default 5).
+        after (str): Keyset pagination; return users after this username.
+        page (int): Page number, used when ``after`` is not given (default 1).
     """
     try:
-        threshold = datetime.utcnow() - timedelta(days=14)
+        days = request.args.get('days', default=current_app.config.get('INACTIVE_USER_DAYS', 14), type=int)
+        if days is None or not 1 <= days <= 3650:
+            return jsonify({"error": "days must be between 1 and 3650"}), 400
+        threshold = datetime.utcnow() - timedelta(days=days)
 
         # Pagination parameters with validation
         page = request.args.get('page', default=1, type=int)
         per_page = request.args.get('per_page', default=5, type=int)
+        after = request.args.get('after')
         page = max(page, 1)
         per_page = min(max(per_page, 1), 100)  # Limit max per_page to 100
 
-        # IDs of users active in audit logs within threshold
-        active_audit_ids = db.session.query(AuditLog.actor_id).filter(
-            AuditLog.timestamp >= threshold
-        ).distinct()
-
-        # Subquery for last login and last seen per user
-        last_seen_subq = db.session.query(
-            SessionLog.user_id.label("uid"),
-            func.max(SessionLog.login_time).label("last_login"),
-            func.max(SessionLog.last_activity).label("last_seen")
-        ).group_by(SessionLog.user_id).subquery()
-
-        # Subquery for concatenated role names per user
-        roles_subq = db.session.query(
-            User.id.label("uid"),
-            func.group_concat(Role.name, ', ').label("role_names")
-        ).join(User.roles).group_by(User.id).subquery()
-
-        # Main query: users excluding recent active ones
+        inactive = or_(User.last_activity_at.is_(None), User.last_activity_at < threshold)
+        total = db.session.query(func.count(User.id)).filter(inactive).scalar()
+
         query = db.session.query(
-            User.id,
-            User.username,
-            roles_subq.c.role_names,
-            last_seen_subq.c.last_seen
-        ).outerjoin(
-            last_seen_subq, User.id == last_seen_subq.c.uid
-        ).outerjoin(
-            roles_subq, User.id == roles_subq.c.uid
-        ).filter(
-            ~User.id.in_(active_audit_ids)
-        ).order_by(User.username.asc())
-
-        # Paginate the query
-        paginated = query.paginate(page=page, per_page=per_page, error_out=False)
-        users = paginated.items
+            User.id, User.username, User.last_login_at, User.last_activity_at
+        ).filter(inactive).order_by(User.username.asc())
+        if after is not None:
+            query = query.filter(User.username > after)
+        else:
+            query = query.offset((page - 1) * per_page)
+        users = query.limit(per_page).all()
+
+        # Role names of the page only, aggregated in the database
+        roles = dict(
+            db.session.query(user_roles.c.user_id, string_agg(Role.name, ', '))
+            .join(Role, Role.id == user_roles.c.role_id)
+            .filter(user_roles.c.user_id.in_([user.id for user in users]))
+            .group_by(user_roles.c.user_id)
+            .all()
+        ) if users else {}
 
         # Compose JSON response
-        result = [
-            {
+        result = []
+        for uid, username, last_login, last_activity in users:
+            last_seen = max(filter(None, (last_login, last_activity)), default=None)
+            result.append({
                 "user_id": uid,
                 "username": username,
-                "role": role_names or "None",
+                "role": roles.get(uid) or "None",
                 "last_seen": last_seen.strftime("%Y-%m-%d %H:%M") if last_seen else "Never"
-            }
-            for uid, username, role_names, last_seen in users
-        ]
+            })
 
         return jsonify({
             "page": page,
             "per_page": per_page,
-            "total": paginated.total,
-            "pages": paginated.pages,
-            "users": result
+            "total": total,
+            "pages": -(-total // per_page),
+            "days": days,
+            "users": result,
+            "next_after": users[-1].username if len(users) == per_page else None
         })
 
-    except Exception as e:
-        current_app.logger.error(f"Error in /inactive-users: {e}\n{traceback.format_exc()}")
+    except Exception:
+        current_app.logger.exception("Error in /inactive-users")
         return jsonify({"error": "Internal Server Error"}), 500
 
 
@@ -108,57 +108,35 @@ def inactive_users():
 # Login Analytics
 # =======================
 
+login_series = TimeSeries('logins', SessionLog.login_time, {'count': func.count(SessionLog.id)})
+audit_series = TimeSeries('audit-actions', AuditLog.timestamp, {'count': func.count(AuditLog.id)})
+
+
 @bp.route("/login-trend")
 @jwt_required()
 def login_trend():
-    today = datetime.utcnow()
-    start = today - timedelta(days=29)
-
-    trend = db.session.query(
-        func.date(SessionLog.login_time), func.count()
-    ).filter(SessionLog.login_time >= start).group_by(
-        func.date(SessionLog.login_time)
-    ).order_by(func.date(SessionLog.login_time)).all()
+    today = utc_now().date()
+    start, end = day_range(today - timedelta(days=29), today)
 
-    date_map = { (start + timedelta(days=i)).date(): 0 for i in range(30) }
-    for date, count in trend:
-        date_map[date] = count
+    trend = login_series.fetch(start, end, 'day')
 
     return jsonify({
-        "labels": [str(d) for d in date_map],
-        "data": list(date_map.values())
+        "labels": [bucket.date().isoformat() for bucket, _ in trend],
+        "data": [values['count'] for _, values in trend]
     })
 
 
 @bp.route("/weekly-activity")
 @jwt_required()
 def weekly_activity():
-    today = datetime.utcnow().date()
-    start = today - timedelta(weeks=5)
-
-    # Week number using %Y-%W (week starts on Monday, not ISO standard but works in SQLite)
-    weekly_counts = db.session.query(
-        func.strftime('%Y-%W', AuditLog.timestamp).label('week'),
-        func.count()
-    ).filter(
-        AuditLog.timestamp >= start
-    ).group_by('week').order_by('week').all()
-
-    results = []
-
-    for week_str, count in weekly_counts:
-        try:
-            # Convert "2025-29" to ISO week start date (Monday of that week)
-            year, week = map(int, week_str.split("-"))
-            week_start = date.fromisocalendar(year, week, 1)  # Monday
-            results.append({
-                "week": week_start.isoformat(),
-                "count": count
-            })
-        except Exception as e:
-            print("Invalid week format:", week_str, "Error:", e)
+    """Audit actions per week (weeks start on Monday) over the last five weeks."""
+    today = utc_now().date()
+    start, end = day_range(today - timedelta(weeks=5), today)
 
-    return jsonify(results)
+    return jsonify([
+        {"week": bucket.date().isoformat(), "count": values['count']}
+        for bucket, values in audit_series.fetch(start, end, 'week')
+    ])
 
 @bp.route("/frequent-actions")
 @jwt_required()
@@ -201,14 +179,29 @@ def geo_logins():
 @bp.route("/device-analytics")
 @jwt_required()
 def device_analytics():
-    def get_distribution(column):
-        results = db.session.query(column, func.count()).group_by(column).all()
-        return [{"label": label or "Unknown", "count": count} for label, count in results]
+    """
+    Login distributions by device, browser and OS, read from the login
+    device counters.
 
+    Query Parameters:
+        start (str): First day to include (YYYY-MM-DD).
+        end (str): Last day to include (YYYY-MM-DD).
+        user_id (int): Only count logins of this user.
+    """
+    try:
+        start = request.args.get('start')
+        end = request.args.get('end')
+        start = date.fromisoformat(start) if start else None
+        end = date.fromisoformat(end) if end else None
+    except ValueError:
+        return jsonify({"error": "start and end must be dates (YYYY-MM-DD)"}), 400
+    user_id = request.args.get('user_id', type=int)
+
+    distributions = device_distributions(start, end, user_id)
     return jsonify({
-        "devices": get_distribution(SessionLog.device),
-        "browsers": get_distribution(SessionLog.browser),
-        "os": get_distribution(SessionLog.os),
+        "devices": distributions["device"],
+        "browsers": distributions["browser"],
+        "os": distributions["os"],
     })
 
 
@@ -1,4 +1,4 @@
-from marshmallow import Schema, fields, validate
+from marshmallow import EXCLUDE, Schema, fields, pre_load, validate
 
 class TopicSchema(Schema):
     id = fields.Int(dump_only=True)
@@ -44,3 +44,52 @@ class QuizSchema(Schema):
         validate=validate.OneOf(['a', 'b', 'c', 'd'], error="Correct answer must be one of 'a', 'b', 'c', 'd'")
     )
     subtopic_id = fields.Int(required=True)
+
+
+class QuizImportSchema(QuizSchema):
+    """
+    QuizSchema for bulk imports (NDJSON/CSV rows): trims values, accepts
+    upper-case answers, treats empty cells as missing and enforces the
+    column lengths so one bad row cannot fail a whole multi-row INSERT.
+    """
+    class Meta:
+        unknown = EXCLUDE
+
+    question = fields.Str(
+        required=True,
+        validate=validate.Length(min=5, max=255, error="Question must be between 5 and 255 characters")
+    )
+    option_a = fields.Str(required=True, validate=validate.Length(min=1, max=100))
+    option_b = fields.Str(required=True, validate=validate.Length(min=1, max=100))
+    option_c = fields.Str(required=True, validate=validate.Length(min=1, max=100))
+    option_d = fields.Str(required=True, validate=validate.Length(min=1, max=100))
+
+    @pre_load
+    def normalize(self, data, **kwargs):
+        if not isinstance(data, dict):
+            return data
+        cleaned = {}
+        for key, value in data.items():
+            if isinstance(value, str):
+                value = value.strip()
+                if not value:
+                    continue
+            cleaned[key] = value
+        if isinstance(cleaned.get('correct_answer'), str):
+            cleaned['correct_answer'] = cleaned['correct_answer'].lower()
+        return cleaned
+
+
+class SubTopicViewSchema(Schema):
+    session_id = fields.Str(required=True, validate=validate.Length(min=1))
+    subtopic_id = fields.Int(required=True)
+    time_spent_seconds = fields.Float(
+        allow_none=True,
+        load_default=None,
+        validate=validate.Range(min=0, error="time_spent_seconds must be non-negative")
+    )
+    scroll_depth_percent = fields.Float(
+        allow_none=True,
+        load_default=None,
+        validate=validate.Range(min=0, max=100, error="scroll_depth_percent must be between 0 and 100")
+    )
@@ -1,12 +1,20 @@
+import hashlib
+import json
 import logging
-from flask import Blueprint, request, jsonify
+from itertools import chain
+from typing import NamedTuple
+from flask import Blueprint, request, jsonify, current_app, stream_with_context
 from marshmallow import ValidationError
 from datetime import datetime, timezone
 from flask_jwt_extended import jwt_required
+from sqlalchemy.orm import defer, selectinload
 
 from app.models.tutorial import db, Topic, SubTopic, Quiz
 from app.routes.schemas import TopicSchema, SubTopicSchema, QuizSchema
 from app.routes.utils import slugify
+from app.utils.content_cache import VersionedCache, bump_content_version
+from app.utils.quiz_import import QuizImport, import_format, iter_records
+from app.utils.search import search_index
 
 bp = Blueprint('tutorials', __name__)
 logger = logging.getLogger(__name__)
@@ -85,24 +93,92 @@ def create_topic():
         logger.error("Database error during Topic creation", exc_info=True)
         return jsonify({"error": f"Database error: {str(e)}"}), 500
 
+    bump_content_version()
+    search_index.update_topic(topic)
+
     return jsonify(schema.dump(topic)), 201
 
 
+# Serialized subtopic keys (e.g. "topicId") mapped to the schema's field names
+SUBTOPIC_DETAIL_FIELDS = {
+    field.data_key or name: name for name, field in SubTopicSchema().fields.items()
+} | {'quizzes': 'quizzes'}
+
+# Subtopics fetched per round-trip when a topic detail response is streamed
+TOPIC_DETAIL_STREAM_CHUNK = 100
+
+
 @bp.route('/<int:topic_id>', methods=['GET'])
 @jwt_required()
 def get_topic_detail(topic_id: int):
-    """Retrieve a Topic with its subtopics and quizzes."""
-    topic = Topic.query.get_or_404(topic_id)
+    """
+    Retrieve a Topic with its subtopics and quizzes using a fixed number of queries.
+    Query parameters:
+      - fields (str, optional): comma-separated subtopic fields to return,
+        e.g. "id,title,status" (add "quizzes" to include quizzes). Omitting
+        "content" skips loading subtopic bodies.
+    Topics with more subtopics than TOPIC_DETAIL_STREAM_THRESHOLD are streamed
+    without loading all of them at once.
+    """
+    fields = set(SUBTOPIC_DETAIL_FIELDS.values())
+    if request.args.get('fields'):
+        requested = {f.strip() for f in request.args['fields'].split(',') if f.strip()}
+        unknown = requested - SUBTOPIC_DETAIL_FIELDS.keys()
+        if unknown:
+            return jsonify({"error": f"Unknown fields: {', '.join(sorted(unknown))}"}), 400
+        fields = {SUBTOPIC_DETAIL_FIELDS[f] for f in requested}
+
+    topic = Topic.query.filter(Topic.id == topic_id).first_or_404()
+
+    options = [] if 'content' in fields else [defer(SubTopic.content)]
+    if 'quizzes' in fields:
+        options.append(selectinload(SubTopic.quizzes))
+    subtopics_query = (
+        SubTopic.query.options(*options)
+        .filter(SubTopic.topic_id == topic.id)
+        .order_by(SubTopic.id.asc())
+    )
+    threshold = current_app.config.get('TOPIC_DETAIL_STREAM_THRESHOLD', 200)
+    first_page = subtopics_query.limit(threshold + 1).all()
+
+    subtopic_schema = SubTopicSchema(only=fields - {'quizzes'})
+    quiz_schema = QuizSchema(many=True)
+
+    def dump_subtopic(subtopic):
+        data = subtopic_schema.dump(subtopic)
+        if 'quizzes' in fields:
+            data['quizzes'] = quiz_schema.dump(sorted(subtopic.quizzes, key=lambda q: q.id))
+        return data
+
     topic_data = TopicSchema().dump(topic)
 
-    subtopics = SubTopic.query.filter_by(topic_id=topic_id).all()
-    topic_data['subtopics'] = SubTopicSchema(many=True).dump(subtopics)
+    if len(first_page) <= threshold:
+        topic_data['subtopics'] = [dump_subtopic(st) for st in first_page]
+        return jsonify(topic_data), 200
+
+    # Same encoder and key order as the jsonify() response above
+    dumps = current_app.json.dumps
+    keys = [*topic_data, 'subtopics']
+    if getattr(current_app.json, 'sort_keys', False):
+        keys.sort()
+    split = keys.index('subtopics')
+
+    def members(names):
+        return ', '.join(f'{dumps(key)}: {dumps(topic_data[key])}' for key in names)
 
-    for sub in topic_data['subtopics']:
-        quizzes = Quiz.query.filter_by(subtopic_id=sub['id']).all()
-        sub['quizzes'] = QuizSchema(many=True).dump(quizzes)
+    def generate():
+        # The topic members up to an open "subtopics" array, the subtopics one at a
+        # time (those past the first page read TOPIC_DETAIL_STREAM_CHUNK rows at a
+        # time), then the remaining topic members.
+        head = members(keys[:split])
+        yield '{' + head + (', ' if head else '') + '"subtopics": ['
+        rest = subtopics_query.filter(SubTopic.id > first_page[-1].id).yield_per(TOPIC_DETAIL_STREAM_CHUNK)
+        for i, subtopic in enumerate(chain(first_page, rest)):
+            yield (', ' if i else '') + dumps(dump_subtopic(subtopic))
+        tail = members(keys[split + 1:])
+        yield ']' + (', ' + tail if tail else '') + '}'
 
-    return jsonify(topic_data), 200
+    return current_app.response_class(stream_with_context(generate()), mimetype='application/json'), 200
 
 
 @bp.route('/<int:topic_id>', methods=['PUT'])
@@ -133,6 +209,9 @@ def update_topic(topic_id: int):
         logger.error("Database error during Topic update", exc_info=True)
         return jsonify({"error": f"Database error: {str(e)}"}), 500
 
+    bump_content_version()
+    search_index.update_topic(topic)
+
     return jsonify({
         "message": "Topic updated successfully",
         "topic": TopicSchema().dump(topic)
@@ -144,6 +223,7 @@ def update_topic(topic_id: int):
 def delete_topic(topic_id: int):
     """Delete a Topic (cascades subtopics and quizzes if configured)."""
     topic = Topic.query.get_or_404(topic_id)
+    subtopic_ids = [st.id for st in topic.subtopics]
     db.session.delete(topic)
     try:
         db.session.commit()
@@ -152,6 +232,9 @@ def delete_topic(topic_id: int):
         logger.error("Database error during Topic deletion", exc_info=True)
         return jsonify({"error": f"Database error: {str(e)}"}), 500
 
+    bump_content_version()
+    search_index.remove_topic(topic_id, subtopic_ids)
+
     return jsonify({"message": "Topic deleted successfully"}), 200
 
 
@@ -191,6 +274,9 @@ def create_content(topic_id: int):
         logger.error("Database error during SubTopic creation", exc_info=True)
         return jsonify({"error": f"Database error: {str(e)}"}), 500
 
+    bump_content_version()
+    search_index.update_subtopic(subtopic)
+
     return jsonify(schema.dump(subtopic)), 201
 
 
@@ -234,6 +320,9 @@ def update_content(subtopic_id: int):
         logger.error("Database error during SubTopic update", exc_info=True)
         return jsonify({"error": f"Database error: {str(e)}"}), 500
 
+    bump_content_version()
+    search_index.update_subtopic(subtopic)
+
     return jsonify({
         "message": "Content updated successfully",
         "subtopic": schema.dump(subtopic)
@@ -254,6 +343,9 @@ def delete_content(subtopic_id: int):
         logger.error("Database error during SubTopic deletion", exc_info=True)
         return jsonify({"error": f"Database error: {str(e)}"}), 500
 
+    bump_content_version()
+    search_index.remove_subtopic(subtopic_id)
+
     return jsonify({"message": "Subtopic deleted successfully"}), 200
 
 
@@ -261,103 +353,194 @@ def delete_content(subtopic_id: int):
 # CLIENT-FACING ENDPOINTS
 # -----------------------
 
+def build_sidebar():
+    """
+    Build the sidebar tree of topics and their published subtopics in one query.
+    Returns the serialized JSON body and its ETag.
+    """
+    rows = (
+        db.session.query(
+            Topic.id.label('topic_id'),
+            Topic.title.label('topic_title'),
+            Topic.slug.label('topic_slug'),
+            SubTopic.id.label('subtopic_id'),
+            SubTopic.title.label('subtopic_title'),
+            SubTopic.slug.label('subtopic_slug'),
+        )
+        .outerjoin(SubTopic, (SubTopic.topic_id == Topic.id) & (SubTopic.status == 'published'))
+        .order_by(Topic.id.asc(), SubTopic.id.asc())
+        .all()
+    )
+
+    result = []
+    for row in rows:
+        if not result or result[-1]["id"] != row.topic_id:
+            result.append({
+                "id": row.topic_id,
+                "title": row.topic_title,
+                "slug": row.topic_slug,
+                "subtopics": []
+            })
+        if row.subtopic_id is not None:
+            result[-1]["subtopics"].append(
+                {"id": row.subtopic_id, "title": row.subtopic_title, "slug": row.subtopic_slug}
+            )
+
+    body = json.dumps(result, separators=(',', ':')).encode('utf-8')
+    return body, hashlib.sha1(body).hexdigest()
+
+
+sidebar_cache = VersionedCache(build_sidebar)
+
+
 @bp.route('/sidebar', methods=['GET'])
 def get_sidebar_topics():
-    """Get all topics with published subtopics for sidebar display."""
-    topics = Topic.query.all()
-    result = []
-    for topic in topics:
-        result.append({
-            "id": topic.id,
-            "title": topic.title,
-            "slug": topic.slug,
-            "subtopics": [
-                {"id": st.id, "title": st.title, "slug": st.slug}
-                for st in topic.subtopics if st.status == 'published'
-            ]
-        })
-    return jsonify(result)
+    """
+    Get all topics with published subtopics for sidebar display.
+    Served from an in-process cache; a matching If-None-Match returns 304.
+    """
+    body, etag = sidebar_cache.get()
+    response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+class NavEntry(NamedTuple):
+    topic_id: int
+    topic_slug: str
+    subtopic_id: int
+    slug: str
+
+
+class NavigationIndex:
+    """
+    Reading order of all published subtopics (by topic id, then subtopic id)
+    with O(1) position lookup by subtopic slug.
+    """
+
+    def __init__(self, entries):
+        self.entries = tuple(entries)
+        self.positions = {entry.slug: i for i, entry in enumerate(self.entries)}
+        # The public API lists slugs in subtopic id order.
+        self.all_slugs = [entry.slug for entry in sorted(self.entries, key=lambda e: e.subtopic_id)]
+
+    def find(self, slug):
+        """Return (entry, previous entry, next entry) for a slug, or None if unpublished."""
+        position = self.positions.get(slug)
+        if position is None:
+            return None
+        previous = self.entries[position - 1] if position > 0 else None
+        following = self.entries[position + 1] if position + 1 < len(self.entries) else None
+        return self.entries[position], previous, following
+
+
+def build_navigation_index():
+    """Load the published reading order with a single query."""
+    rows = (
+        db.session.query(Topic.id, Topic.slug, SubTopic.id, SubTopic.slug)
+        .join(SubTopic, SubTopic.topic_id == Topic.id)
+        .filter(SubTopic.status == 'published')
+        .order_by(Topic.id.asc(), SubTopic.id.asc())
+        .all()
+    )
+    return NavigationIndex(NavEntry(*row) for row in rows)
+
+
+navigation_cache = VersionedCache(build_navigation_index)
 
 
 @bp.route('/<string:topic_slug>/<string:subtopic_slug>', methods=['GET'])
 def get_subtopic_content(topic_slug: str, subtopic_slug: str):
-    """Retrieve content of a published SubTopic by topic and subtopic slugs, and next subtopic slug."""
-    subtopic = get_subtopic_by_slug(topic_slug, subtopic_slug)
-    if not subtopic:
+    """
+    Retrieve content of a published SubTopic by topic and subtopic slugs,
+    with the previous and next subtopic slugs in reading order.
+    """
+    index = navigation_cache.get()
+    found = index.find(subtopic_slug)
+    if not found or found[0].topic_slug != topic_slug:
         return jsonify({"error": "Subtopic not found"}), 404
+    entry, previous, following = found
 
-    topic = subtopic.topic
-    all_subtopics = SubTopic.query.filter_by(status='published').order_by(SubTopic.id.asc()).all()
-    all_subtopic_slugs = [st.slug for st in all_subtopics]
-
-    next_subtopic = (
-        SubTopic.query
-        .filter(SubTopic.topic_id == topic.id, SubTopic.status == 'published', SubTopic.id > subtopic.id)
-        .order_by(SubTopic.id.asc())
+    # The index may lag a write made by another process by up to
+    # CONTENT_VERSION_CACHE_TTL seconds, so re-check the status here.
+    subtopic = (
+        db.session.query(SubTopic.title, SubTopic.content)
+        .filter(SubTopic.id == entry.subtopic_id, SubTopic.status == 'published')
         .first()
     )
-
-    if not next_subtopic:
-        next_topic = Topic.query.filter(Topic.id > topic.id).order_by(Topic.id.asc()).first()
-        if next_topic:
-            next_subtopic = (
-                SubTopic.query
-                .filter_by(topic_id=next_topic.id, status='published')
-                .order_by(SubTopic.id.asc())
-                .first()
-            )
+    if not subtopic:
+        return jsonify({"error": "Subtopic not found"}), 404
 
     return jsonify({
         "title": subtopic.title,
         "content": subtopic.content,
-        "all_subtopics": all_subtopic_slugs,
-        "next_subtopic_slug": next_subtopic.slug if next_subtopic else None
+        "all_subtopics": index.all_slugs,
+        "prev_subtopic_slug": previous.slug if previous else None,
+        "next_subtopic_slug": following.slug if following else None
     }), 200
 
 
 @bp.route('/search')
 def search():
-    """Search topics and subtopics by query string."""
-    query = request.args.get('q', '').strip().lower()
+    """
+    Full-text search over topic titles and published subtopics.
+    Query parameters:
+      - q (str): search words, each matched as a prefix (type-ahead)
+      - page (int, default=1)
+      - limit (int, default=20, max=50)
+    Returns ranked results; the total match count is in the X-Total-Count header.
+    """
+    query = request.args.get('q', '').strip()
     if not query:
         return jsonify([])
 
-    results = []
+    page = max(request.args.get('page', 1, type=int), 1)
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 50)
+
+    hits, total = search_index.search(query, limit=limit, offset=(page - 1) * limit)
+
+    topic_ids = [hit.ref_id for hit in hits if hit.kind == 'topic']
+    subtopic_ids = [hit.ref_id for hit in hits if hit.kind == 'subtopic']
+    topics = {
+        row.id: row for row in
+        db.session.query(Topic.id, Topic.title, Topic.slug).filter(Topic.id.in_(topic_ids))
+    } if topic_ids else {}
+    subtopics = {
+        row.id: row for row in
+        db.session.query(
+            SubTopic.id, SubTopic.title, SubTopic.slug,
+            Topic.id.label('topic_id'), Topic.title.label('topic_title'), Topic.slug.label('topic_slug')
+        )
+        .join(Topic, Topic.id == SubTopic.topic_id)
+        .filter(SubTopic.id.in_(subtopic_ids), SubTopic.status == 'published')
+    } if subtopic_ids else {}
 
-    matched_topics = Topic.query.filter(Topic.title.ilike(f'%{query}%')).all()
-    for topic in matched_topics:
-        results.append({
-            "type": "topic",
-            "id": topic.id,
-            "name": topic.title,
-            "slug": topic.slug
-        })
-        for sub in topic.subtopics:
-            if sub.status == "published":
-                results.append({
-                    "type": "subtopic",
-                    "id": sub.id,
-                    "name": sub.title,
-                    "subtopic_slug": sub.slug,
-                    "topic_id": topic.id,
-                    "topic_name": topic.title,
-                    "topic_slug": topic.slug
-                })
-
-    matched_subtopics = SubTopic.query.filter(SubTopic.title.ilike(f'%{query}%')).all()
-    for sub in matched_subtopics:
-        if sub.status == "published":
+    results = []
+    for hit in hits:
+        if hit.kind == 'topic' and hit.ref_id in topics:
+            topic = topics[hit.ref_id]
+            results.append({
+                "type": "topic",
+                "id": topic.id,
+                "name": topic.title,
+                "slug": topic.slug
+            })
+        elif hit.kind == 'subtopic' and hit.ref_id in subtopics:
+            sub = subtopics[hit.ref_id]
             results.append({
                 "type": "subtopic",
                 "id": sub.id,
                 "name": sub.title,
                 "subtopic_slug": sub.slug,
-                "topic_id": sub.topic.id,
-                "topic_name": sub.topic.title,
-                "topic_slug": sub.topic.slug
+                "topic_id": sub.topic_id,
+                "topic_name": sub.topic_title,
+                "topic_slug": sub.topic_slug
             })
 
-    return jsonify(results), 200
+    response = jsonify(results)
+    response.headers['X-Total-Count'] = str(total)
+    return response, 200
 
 
 @bp.route("/subtopics/<subtopic_slug>/resolve-topic")
@@ -413,3 +596,40 @@ def add_quizzes(subtopic_id: int):
         return jsonify({"error": f"Database error: {str(e)}"}), 500
 
     return jsonify({"message": "Quizzes added successfully"}), 201
+
+
+@bp.route('/quizzes/import', methods=['POST'])
+@jwt_required()
+def import_quizzes():
+    """
+    Bulk import quizzes across subtopics from an NDJSON (application/x-ndjson)
+    or CSV (text/csv, header row required) request body.
+
+    Each record has the QuizSchema fields; ``?subtopic_id=`` supplies a
+    default for records without one. The body is read as a stream and
+    valid rows are inserted in chunks, so the payload is never held in
+    memory. Invalid rows are skipped and reported by row number.
+    """
+    fmt = import_format(request.mimetype)
+    if fmt is None:
+        return jsonify({"error": "Expected an application/x-ndjson or text/csv body"}), 415
+
+    default_subtopic_id = request.args.get('subtopic_id', type=int)
+    quiz_import = QuizImport(
+        default_subtopic_id=default_subtopic_id,
+        chunk_size=current_app.config.get('QUIZ_IMPORT_CHUNK_SIZE', 1000),
+    )
+    try:
+        quiz_import.run(iter_records(request.stream, fmt))
+        db.session.commit()
+    except UnicodeDecodeError:
+        db.session.rollback()
+        return jsonify({"error": "Request body must be UTF-8 encoded"}), 400
+    except Exception:
+        db.session.rollback()
+        logger.error("Database error during quiz import", exc_info=True)
+        return jsonify({"error": "Database error during quiz import"}), 500
+
+    if quiz_import.imported:
+        bump_content_version()
+    return jsonify(quiz_import.summary()), 201 if quiz_import.imported else 400
@@ -0,0 +1,103 @@
+from datetime import datetime
+
+from sqlalchemy import bindparam, select, update
+
+from app.extensions import db
+from app.models.log import SessionLog
+from app.models.tutorial import Session
+from app.utils.batching import CoalescingWriter
+from app.utils.cache import TTLCache
+
+
+def write_last_activity(pending):
+    """
+    Set ``last_activity`` on each user's most recent session log row with a
+    single executemany UPDATE. ``pending`` maps user id -> timestamp.
+    """
+    latest_session = (
+        select(SessionLog.id)
+        .where(SessionLog.user_id == bindparam('uid'))
+        .order_by(SessionLog.login_time.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    stmt = (
+        update(SessionLog.__table__)
+        .where(SessionLog.__table__.c.id == latest_session)
+        .values(last_activity=bindparam('ts'))
+    )
+    db.session.execute(stmt, [{'uid': uid, 'ts': ts} for uid, ts in pending.items()])
+    db.session.commit()
+
+
+def write_session_last_seen(pending):
+    """Set ``Session.last_seen`` for many sessions in one executemany UPDATE (pk -> timestamp)."""
+    table = Session.__table__
+    stmt = update(table).where(table.c.id == bindparam('pk')).values(last_seen=bindparam('ts'))
+    db.session.execute(stmt, [{'pk': pk, 'ts': ts} for pk, ts in pending.items()])
+    db.session.commit()
+
+
+class ActivityTracker:
+    """
+    Records activity heartbeats through ``write(pending)``, which receives a
+    ``{key: timestamp}`` mapping.
+
+    A key's activity is written at most once per ``<PREFIX>_GRANULARITY``
+    seconds. In ``sync`` mode (default) that write happens on the request
+    thread; in ``coalesced`` mode (``<PREFIX>_TRACKING_MODE``) the latest
+    timestamp per key is kept in memory and all of them are flushed together
+    every ``<PREFIX>_FLUSH_INTERVAL`` seconds and at shutdown.
+    """
+
+    def __init__(self, name, write, config_prefix):
+        self.name = name
+        self.write = write
+        self.config_prefix = config_prefix
+        self.mode = "sync"
+        self.recent = TTLCache(maxsize=10000, ttl=60)
+        self._writer = None
+
+    def init_app(self, app):
+        prefix = self.config_prefix
+        self.mode = app.config.get(f"{prefix}_TRACKING_MODE", "sync")
+        self.recent.configure(ttl=app.config.get(f"{prefix}_GRANULARITY", 60))
+        if self.mode == "coalesced":
+            self._writer = CoalescingWriter(
+                self.name,
+                self.write,
+                flush_interval=app.config.get(f"{prefix}_FLUSH_INTERVAL", 5.0),
+            )
+            self._writer.start(app)
+        app.extensions[f"{self.name}_tracker"] = self
+
+    def touch(self, key, at=None):
+        """Record activity for ``key``; returns False if it fell within the granularity window."""
+        if self.recent.ttl and self.recent.get(key) is not None:
+            return False
+        at = at or datetime.utcnow()
+        self.recent.set(key, at)
+        if self._writer is not None:
+            self._writer.update(key, at)
+        else:
+            self.write({key: at})
+        return True
+
+    def flush(self):
+        """Write pending heartbeats now (no-op in sync mode)."""
+        return self._writer.flush() if self._writer is not None else 0
+
+    def stop(self):
+        if self._writer is not None:
+            self._writer.stop()
+
+    def stats(self):
+        if self._writer is None:
+            return {"mode": self.mode}
+        return dict(self._writer.stats, mode=self.mode, pending=self._writer.pending())
+
+
+# Admin users: last_activity of their latest SessionLog row
+activity_tracker = ActivityTracker("activity", write_last_activity, "ACTIVITY")
+# Anonymous analytics sessions: Session.last_seen, keyed by primary key
+session_activity = ActivityTracker("session_activity", write_session_last_seen, "SESSION_ACTIVITY")
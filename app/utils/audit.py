@@ -0,0 +1,299 @@
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import uuid
+from datetime import datetime
+
+from sqlalchemy import bindparam, event, insert, update
+from sqlalchemy.orm import Session as OrmSession
+
+from app.extensions import db
+from app.models.log import AuditLog
+from app.models.user import User
+from app.utils.batching import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+_PENDING_KEY = "pending_audit_rows"
+
+
+def write_audit_rows(rows, session=None):
+    """
+    Insert audit rows with one bulk INSERT, move each actor's
+    ``last_activity_at`` forward and commit (``session`` defaults to db.session).
+
+    Rows may reach the database after the users they reference were deleted;
+    such references are cleared, as deleting a user does for its audit rows.
+    """
+    session = session or db.session
+    user_ids = {row[key] for row in rows for key in ('actor_id', 'target_user_id') if row[key] is not None}
+    existing = {
+        user_id for (user_id,) in session.query(User.id).filter(User.id.in_(list(user_ids)))
+    } if user_ids else set()
+    rows = [
+        dict(row, **{key: None for key in ('actor_id', 'target_user_id')
+                     if row[key] is not None and row[key] not in existing})
+        for row in rows
+    ]
+    session.execute(insert(AuditLog), rows)
+
+    latest = {}
+    for row in rows:
+        if row['actor_id'] is not None:
+            latest[row['actor_id']] = max(row['timestamp'], latest.get(row['actor_id'], row['timestamp']))
+    if latest:
+        table = User.__table__
+        session.execute(
+            update(table)
+            .where(table.c.id == bindparam('uid'))
+            .where((table.c.last_activity_at.is_(None)) | (table.c.last_activity_at < bindparam('ts')))
+            .values(last_activity_at=bindparam('ts')),
+            [{'uid': uid, 'ts': ts} for uid, ts in latest.items()],
+        )
+    session.commit()
+
+
+class AuditSink:
+    """
+    Destination of audit events recorded with ``record``.
+
+    In ``transaction`` mode (default) the audit row and the actor's
+    last_activity_at update join the caller's unit of work and are written
+    by the caller's commit. In ``async`` mode events are handed to a
+    background writer once the caller's transaction commits (and dropped if
+    it rolls back), then bulk-inserted in batches. Each committed batch is
+    first appended to a spool segment, so events still pending at a crash
+    are replayed on the next start (at least once).
+
+    Every process spools to segments of its own
+    (``audit-spool.<pid>.<n>.jsonl`` next to AUDIT_SPOOL_PATH). A new
+    segment is started once the current one holds AUDIT_BATCH_SIZE events,
+    and a segment is deleted once all of its events are written, so spooled
+    files are never rewritten. At startup a process
+    takes over the segments of processes that are no longer running, under
+    a file lock so that each orphaned segment is replayed by one process only.
+    """
+
+    def __init__(self):
+        self.mode = "transaction"
+        self.spool_path = None
+        self.segment_size = 200
+        self._writer = None
+        self._spool_lock = threading.Lock()
+        self._segment = None  # (pid, path, rows appended) of the segment being appended to
+        self._segment_numbers = itertools.count()
+        self._pending = {}  # segment path -> spool_ids not yet written
+        self._spooled_in = {}  # spool_id -> segment path
+
+    def init_app(self, app):
+        self.mode = app.config.get("AUDIT_SINK_MODE", "transaction")
+        if self.mode == "async":
+            self.spool_path = app.config.get("AUDIT_SPOOL_PATH") or os.path.join(
+                app.instance_path, "audit-spool.jsonl"
+            )
+            self.segment_size = app.config.get("AUDIT_BATCH_SIZE", 200)
+            self._writer = BatchWriter(
+                "audit-log",
+                self._flush,
+                maxsize=app.config.get("AUDIT_QUEUE_SIZE", 10000),
+                batch_size=app.config.get("AUDIT_BATCH_SIZE", 200),
+                flush_interval=app.config.get("AUDIT_FLUSH_INTERVAL", 1.0),
+            )
+            leftover = self._claim_spools()
+            self._writer.start(app)
+            if leftover:
+                logger.info("Replaying %d spooled audit events", len(leftover))
+                for row in leftover:
+                    self._enqueue(row)
+        app.extensions["audit_sink"] = self
+
+    def record(self, actor_id, action_type, target_user_id=None, description=""):
+        """Record an audit event as part of the current transaction; the caller commits."""
+        row = {
+            'actor_id': actor_id,
+            'action_type': action_type,
+            'target_user_id': target_user_id,
+            'description': description,
+            'timestamp': datetime.utcnow(),
+        }
+        if self._writer is not None:
+            db.session.info.setdefault(_PENDING_KEY, []).append(row)
+            return
+        db.session.add(AuditLog(**row))
+        if actor_id is not None:
+            db.session.execute(update(User).where(User.id == actor_id).values(last_activity_at=row['timestamp']))
+
+    def submit(self, rows):
+        """Spool and queue committed audit rows, writing them inline on back-pressure."""
+        rows = [dict(row, spool_id=uuid.uuid4().hex) for row in rows]
+        self._append_spool(rows)
+        for row in rows:
+            self._enqueue(row)
+
+    def stop(self):
+        if self._writer is not None:
+            self._writer.stop()
+
+    def stats(self):
+        if self._writer is None:
+            return {"mode": self.mode}
+        return dict(self._writer.stats, mode=self.mode, queued=self._writer.qsize())
+
+    def _enqueue(self, row):
+        if not self._writer.submit(row):
+            # Called from the caller's after_commit hook, so write with a session of our own
+            with OrmSession(db.engine) as session:
+                self._flush([row], session)
+
+    def _flush(self, rows, session=None):
+        session = session or db.session
+        try:
+            write_audit_rows([{k: v for k, v in row.items() if k != 'spool_id'} for row in rows], session)
+        except Exception:
+            session.rollback()
+            logger.error("Failed to write %d audit events; kept in the spool", len(rows), exc_info=True)
+            return
+        self._remove_spooled({row['spool_id'] for row in rows})
+
+    # -- spool segments: one JSON event per line, one series of files per process --
+
+    def _segment_paths(self, pid=None):
+        root, ext = os.path.splitext(self.spool_path)
+        pattern = re.compile(re.escape(os.path.basename(root)) + r'\.(\d+)(?:\.\d+)?' + re.escape(ext))
+        directory = os.path.dirname(root) or '.'
+        if not os.path.isdir(directory):
+            return []
+        return sorted(
+            (int(match.group(1)), os.path.join(directory, name)) for name in os.listdir(directory)
+            if (match := pattern.fullmatch(name)) and (pid is None or int(match.group(1)) == pid)
+        )
+
+    def _append_spool(self, rows):
+        """Append rows to this process's current segment with one write and one fsync."""
+        lines = ''.join(json.dumps(dict(row, timestamp=row['timestamp'].isoformat())) + '\n' for row in rows)
+        pid = os.getpid()
+        with self._spool_lock:
+            # A process forked after init_app starts segments of its own.
+            if self._segment is None or self._segment[0] != pid or self._segment[2] >= self.segment_size:
+                root, ext = os.path.splitext(self.spool_path)
+                path = f"{root}.{pid}.{next(self._segment_numbers)}{ext}"
+                while os.path.exists(path):  # left by an earlier process with this pid
+                    path = f"{root}.{pid}.{next(self._segment_numbers)}{ext}"
+                self._segment = (pid, path, 0)
+            _, path, count = self._segment
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as spool:
+                spool.write(lines)
+                spool.flush()
+                os.fsync(spool.fileno())
+            self._segment = (pid, path, count + len(rows))
+            pending = self._pending.setdefault(path, set())
+            for row in rows:
+                pending.add(row['spool_id'])
+                self._spooled_in[row['spool_id']] = path
+
+    def _read_spool(self, path=None):
+        """Events in ``path``, or in all of this process's segments."""
+        paths = [path] if path else [p for _, p in self._segment_paths(os.getpid())]
+        with self._spool_lock:
+            return [row for p in paths for row in _read_spool_file(p)]
+
+    def _remove_spooled(self, spool_ids):
+        # Delete each segment once all of its events are written; nothing is rewritten.
+        with self._spool_lock:
+            for spool_id in spool_ids:
+                path = self._spooled_in.pop(spool_id, None)
+                pending = self._pending.get(path)
+                if pending is None:
+                    continue
+                pending.discard(spool_id)
+                if pending:
+                    continue
+                del self._pending[path]
+                if self._segment is not None and self._segment[1] == path:
+                    self._segment = None
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _claim_spools(self):
+        """
+        Take over the segments of processes that are no longer running (and
+        the single shared spool of earlier versions) by moving their events
+        into a segment of this process. Returns the events to replay, each
+        spool_id once; these include any left by an earlier process that had
+        the same pid.
+        """
+        import fcntl  # POSIX only; needed in async mode alone
+
+        directory = os.path.dirname(self.spool_path) or '.'
+        root = os.path.splitext(os.path.basename(self.spool_path))[0]
+        os.makedirs(directory, exist_ok=True)
+
+        with open(os.path.join(directory, root + '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)  # released when the file is closed
+            own = os.getpid()
+            orphans = [
+                path for pid, path in self._segment_paths()
+                if path not in self._pending and (pid == own or not _pid_alive(pid))
+            ]
+            if os.path.exists(self.spool_path):
+                orphans.append(self.spool_path)
+
+            claimed = {}
+            for path in orphans:
+                for row in self._read_spool(path):
+                    claimed.setdefault(row['spool_id'], row)
+            if claimed:
+                self._append_spool(list(claimed.values()))
+            # Only removed once their events are safely in our segment
+            for path in orphans:
+                os.remove(path)
+            if orphans:
+                logger.info("Claimed %d audit spool segment(s) of stopped processes", len(orphans))
+        return list(claimed.values())
+
+
+def _read_spool_file(path):
+    if not os.path.exists(path):
+        return []
+    rows = []
+    with open(path, encoding='utf-8') as spool:
+        for line in spool:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                continue  # torn final line from a crash mid-write
+            row['timestamp'] = datetime.fromisoformat(row['timestamp'])
+            rows.append(row)
+    return rows
+
+
+def _pid_alive(pid):
+    """Whether a process with this pid is running (this one included)."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # running, under another user
+    return True
+
+
+audit_sink = AuditSink()
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _submit_committed_audit_rows(session):
+    rows = session.info.pop(_PENDING_KEY, None)
+    if rows:
+        audit_sink.submit(rows)
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _discard_rolled_back_audit_rows(session):
+    session.info.pop(_PENDING_KEY, None)
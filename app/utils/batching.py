@@ -0,0 +1,208 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from contextlib import nullcontext
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BatchWriter:
+    """
+    Bounded in-process queue drained by a background writer thread.
+
+    Items are handed to ``handler(items)`` inside an application context,
+    either once ``batch_size`` items are pending or ``flush_interval`` seconds
+    after the first pending item arrived, whichever comes first.
+    ``submit`` never blocks: when the queue is full it returns False so the
+    caller can apply back-pressure.
+    """
+
+    def __init__(self, name, handler, maxsize=10000, batch_size=500, flush_interval=1.0):
+        self.name = name
+        self.handler = handler
+        self.batch_size = max(int(batch_size), 1)
+        self.flush_interval = float(flush_interval)
+        self._queue = queue.Queue(maxsize=max(int(maxsize), 1))
+        self._thread = None
+        self._app = None
+        self._lock = threading.Lock()
+        self.stats = {"submitted": 0, "rejected": 0, "written": 0, "failed": 0, "batches": 0}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def start(self, app):
+        """Start the writer thread and register a drain on interpreter exit."""
+        with self._lock:
+            if self.running:
+                return
+            self._app = app
+            self._thread = threading.Thread(
+                target=self._run, name=f"batch-writer-{self.name}", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def submit(self, item):
+        """Queue an item; returns False when the queue is full."""
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.stats["rejected"] += 1
+            return False
+        self.stats["submitted"] += 1
+        return True
+
+    def stop(self, timeout=10.0):
+        """Flush everything still queued and stop the writer thread."""
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._thread = None
+        if thread.is_alive():
+            # The sentinel must get in even when the queue is full.
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                item = self._queue.get()
+            except Exception:  # pragma: no cover - interpreter shutdown
+                return
+            if item is _STOP:
+                break
+            batch.append(item)
+            deadline = time.monotonic() + self.flush_interval
+
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._flush(batch)
+
+        # Drain whatever was queued behind the stop sentinel.
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+        for start in range(0, len(leftover), self.batch_size):
+            self._flush(leftover[start:start + self.batch_size])
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        try:
+            with self._app.app_context():
+                self.handler(batch)
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+        except Exception:
+            self.stats["failed"] += len(batch)
+            logger.error("Batch writer '%s' failed to flush %d items", self.name, len(batch), exc_info=True)
+
+
+class CoalescingWriter:
+    """
+    Keeps only the latest pending value per key and hands all pending
+    ``{key: value}`` pairs to ``handler(pending)`` every ``flush_interval``
+    seconds, inside an application context.
+
+    Repeated updates of the same key between flushes cost one write.
+    Pending values are flushed on ``stop`` (also registered with atexit).
+    """
+
+    def __init__(self, name, handler, flush_interval=5.0):
+        self.name = name
+        self.handler = handler
+        self.flush_interval = float(flush_interval)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._app = None
+        self.stats = {"updates": 0, "written": 0, "failed": 0, "flushes": 0}
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def pending(self):
+        return len(self._pending)
+
+    def start(self, app):
+        """Start the flusher thread and register a final flush on interpreter exit."""
+        with self._lock:
+            if self.running:
+                return
+            self._app = app
+            self._wakeup.clear()
+            self._thread = threading.Thread(
+                target=self._run, name=f"coalescing-writer-{self.name}", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def update(self, key, value):
+        """Record the latest value for ``key``; replaces any pending value."""
+        with self._lock:
+            self._pending[key] = value
+            self.stats["updates"] += 1
+
+    def flush(self):
+        """Write all pending values now. Returns the number of keys written."""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            try:
+                # Outside the flusher thread (e.g. a manual flush) the caller's context is used
+                with self._app.app_context() if self._app is not None else nullcontext():
+                    self.handler(pending)
+                self.stats["written"] += len(pending)
+                self.stats["flushes"] += 1
+            except Exception:
+                self.stats["failed"] += len(pending)
+                logger.error("Coalescing writer '%s' failed to flush %d keys", self.name, len(pending), exc_info=True)
+            return len(pending)
+
+    def stop(self, timeout=10.0):
+        """Stop the flusher thread and write whatever is still pending."""
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None and thread.is_alive():
+            self._wakeup.set()
+            thread.join(timeout)
+        if self._app is not None:
+            self.flush()
+
+    def _run(self):
+        while not self._wakeup.wait(self.flush_interval):
+            self.flush()
@@ -0,0 +1,255 @@
+"""
+Content archives are JSON Lines, one record per line, optionally gzipped:
+
+    {"type": "topic", "slug": ..., "title": ..., "created_at": ...}
+    {"type": "subtopic", "topic": <topic slug>, "slug": ..., "title": ..., "content": ..., "status": ...}
+    {"type": "quiz", "subtopic": <subtopic slug>, "question": ..., "option_a": ..., "correct_answer": ...}
+
+Exports list all topics, then all subtopics, then all quizzes, so an import
+only ever refers back to records it has already seen.
+"""
+
+import gzip
+import io
+import json
+from datetime import datetime, timezone
+
+from marshmallow import EXCLUDE, ValidationError
+from sqlalchemy import delete, insert, select
+
+from app.extensions import db
+from app.models.tutorial import Topic, SubTopic, Quiz
+from app.routes.schemas import TopicSchema, SubTopicSchema, QuizImportSchema
+from app.routes.utils import slugify
+from app.utils.db_utils import dialect_insert
+
+
+QUIZ_FIELDS = ('question', 'option_a', 'option_b', 'option_c', 'option_d', 'correct_answer')
+
+# Only the first errors are kept for reporting; the rest are counted.
+MAX_REPORTED_ERRORS = 20
+
+
+def open_archive(path, mode):
+    """Open an archive for text reading ('r') or writing ('w'); gzip for *.gz or gzip content."""
+    if mode == 'w':
+        if path.endswith('.gz'):
+            return gzip.open(path, 'wt', encoding='utf-8')
+        return open(path, 'w', encoding='utf-8')
+    raw = open(path, 'rb')
+    if raw.peek(2)[:2] == b'\x1f\x8b':
+        return io.TextIOWrapper(gzip.GzipFile(fileobj=raw), encoding='utf-8')
+    return io.TextIOWrapper(raw, encoding='utf-8')
+
+
+def _iso(value):
+    return value.isoformat() if value is not None else None
+
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def export_content(out, chunk_size=1000):
+    """
+    Stream every topic, subtopic and quiz to the text file ``out`` as JSON
+    Lines. Rows are fetched ``chunk_size`` at a time. Returns counts per type.
+    """
+    def rows(stmt):
+        return db.session.execute(stmt.execution_options(yield_per=chunk_size))
+
+    def write(record):
+        out.write(json.dumps(record, separators=(',', ':'), ensure_ascii=False) + '\n')
+
+    counts = {'topics': 0, 'subtopics': 0, 'quizzes': 0}
+    for row in rows(select(Topic.slug, Topic.title, Topic.created_at).order_by(Topic.id)):
+        write({'type': 'topic', 'slug': row.slug, 'title': row.title, 'created_at': _iso(row.created_at)})
+        counts['topics'] += 1
+
+    subtopics = (
+        select(SubTopic.slug, SubTopic.title, SubTopic.content, SubTopic.status, SubTopic.created_at,
+               Topic.slug.label('topic'))
+        .join(Topic, Topic.id == SubTopic.topic_id)
+        .order_by(SubTopic.id)
+    )
+    for row in rows(subtopics):
+        write({
+            'type': 'subtopic', 'topic': row.topic, 'slug': row.slug, 'title': row.title,
+            'content': row.content, 'status': row.status, 'created_at': _iso(row.created_at),
+        })
+        counts['subtopics'] += 1
+
+    quizzes = (
+        select(SubTopic.slug.label('subtopic'), *(getattr(Quiz, name) for name in QUIZ_FIELDS))
+        .join(SubTopic, SubTopic.id == Quiz.subtopic_id)
+        .order_by(Quiz.subtopic_id, Quiz.id)
+    )
+    for row in rows(quizzes):
+        write(dict({'type': 'quiz', 'subtopic': row.subtopic}, **{name: getattr(row, name) for name in QUIZ_FIELDS}))
+        counts['quizzes'] += 1
+    return counts
+
+
+class ContentImporter:
+    """
+    Loads a content archive with chunked multi-row upserts keyed on slug, so
+    importing the same archive again updates rows in place instead of
+    duplicating them. Quizzes have no natural key: the archive is
+    authoritative for the subtopics it lists, whose existing quizzes are
+    replaced by the archive's.
+
+    Records are validated with the API schemas. Runs in the caller's
+    transaction; the caller commits (or rolls back for a dry run).
+    """
+
+    def __init__(self, chunk_size=1000):
+        self.chunk_size = max(int(chunk_size), 1)
+        self.counts = {'topics': 0, 'subtopics': 0, 'quizzes': 0}
+        self.errors = []
+        self.error_count = 0
+        self._pending = {'topic': [], 'subtopic': [], 'quiz': []}
+        self._topic_ids = {}
+        self._subtopic_ids = {}
+        self._cleared = set()
+        self._topic_schema = TopicSchema()
+        self._subtopic_schema = SubTopicSchema()
+        self._quiz_schema = QuizImportSchema()
+        self._flushers = {
+            'topic': self._flush_topics, 'subtopic': self._flush_subtopics, 'quiz': self._flush_quizzes,
+        }
+
+    def run(self, lines):
+        for number, line in enumerate(lines, start=1):
+            if line.strip():
+                self.add(number, line)
+        self.flush()
+        return self
+
+    def add(self, number, line):
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            self._reject(number, f"Invalid JSON: {exc}")
+            return
+        try:
+            if not isinstance(record, dict):
+                raise ValidationError("Expected a JSON object")
+            kind = record.get('type')
+            if kind == 'topic':
+                row = self._topic_schema.load({'title': record.get('title')})
+                row['slug'] = record.get('slug') or slugify(row['title'])
+                row['created_at'] = _parse_datetime(record.get('created_at')) or datetime.now(timezone.utc)
+            elif kind == 'subtopic':
+                row = self._subtopic_schema.load(
+                    {key: record[key] for key in ('title', 'content', 'status') if key in record},
+                    partial=('topic_id',), unknown=EXCLUDE,
+                )
+                row['slug'] = record.get('slug') or slugify(row['title'])
+                row['created_at'] = _parse_datetime(record.get('created_at')) or datetime.now(timezone.utc)
+                row['topic'] = self._required_ref(record, 'topic')
+            elif kind == 'quiz':
+                row = self._quiz_schema.load(dict(record, subtopic_id=0))
+                row['subtopic'] = self._required_ref(record, 'subtopic')
+            else:
+                raise ValidationError({'type': ["Must be one of 'topic', 'subtopic', 'quiz'"]})
+        except ValidationError as exc:
+            self._reject(number, exc.messages)
+            return
+        except ValueError as exc:  # malformed created_at
+            self._reject(number, str(exc))
+            return
+        row['_line'] = number
+        pending = self._pending[kind]
+        pending.append(row)
+        if len(pending) >= self.chunk_size:
+            self._flushers[kind]()
+
+    def flush(self):
+        self._flush_topics()
+        self._flush_subtopics()
+        self._flush_quizzes()
+
+    @staticmethod
+    def _required_ref(record, key):
+        if not isinstance(record.get(key), str) or not record[key]:
+            raise ValidationError({key: ["Missing data for required field."]})
+        return record[key]
+
+    def _reject(self, number, messages):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': number, 'errors': messages})
+
+    def _resolve(self, model, ids, slugs):
+        """Map slugs to ids, looking up slugs not seen in this import in the database."""
+        missing = {slug for slug in slugs if slug not in ids}
+        if missing:
+            ids.update(db.session.execute(
+                select(model.slug, model.id).where(model.slug.in_(list(missing)))
+            ).all())
+        return ids
+
+    def _upsert(self, model, rows, updates):
+        table = model.__table__
+        stmt = dialect_insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['slug'],
+            set_={name: stmt.excluded[name] for name in updates},
+        ).returning(table.c.slug, table.c.id)
+        return dict(db.session.execute(stmt).all())
+
+    def _flush_topics(self):
+        chunk, self._pending['topic'] = self._pending['topic'], []
+        if not chunk:
+            return
+        rows = list({row['slug']: {k: v for k, v in row.items() if k != '_line'} for row in chunk}.values())
+        self._topic_ids.update(self._upsert(Topic, rows, ('title',)))
+        self.counts['topics'] += len(rows)
+
+    def _flush_subtopics(self):
+        self._flush_topics()
+        chunk, self._pending['subtopic'] = self._pending['subtopic'], []
+        if not chunk:
+            return
+        topic_ids = self._resolve(Topic, self._topic_ids, {row['topic'] for row in chunk})
+        now = datetime.now(timezone.utc)
+        rows = {}
+        for row in chunk:
+            if row['topic'] not in topic_ids:
+                self._reject(row['_line'], {'topic': [f"Unknown topic '{row['topic']}'"]})
+                continue
+            rows[row['slug']] = {
+                'slug': row['slug'], 'title': row['title'], 'content': row['content'],
+                'status': row['status'], 'topic_id': topic_ids[row['topic']],
+                'created_at': row['created_at'], 'updated_at': now,
+            }
+        if not rows:
+            return
+        ids = self._upsert(SubTopic, list(rows.values()), ('title', 'content', 'status', 'topic_id', 'updated_at'))
+        self._subtopic_ids.update(ids)
+        self._clear_quizzes(ids.values())
+        self.counts['subtopics'] += len(rows)
+
+    def _flush_quizzes(self):
+        self._flush_subtopics()
+        chunk, self._pending['quiz'] = self._pending['quiz'], []
+        if not chunk:
+            return
+        subtopic_ids = self._resolve(SubTopic, self._subtopic_ids, {row['subtopic'] for row in chunk})
+        rows = []
+        for row in chunk:
+            if row['subtopic'] not in subtopic_ids:
+                self._reject(row['_line'], {'subtopic': [f"Unknown subtopic '{row['subtopic']}'"]})
+                continue
+            rows.append(dict({name: row[name] for name in QUIZ_FIELDS}, subtopic_id=subtopic_ids[row['subtopic']]))
+        if not rows:
+            return
+        self._clear_quizzes(row['subtopic_id'] for row in rows)
+        db.session.execute(insert(Quiz).values(rows))
+        self.counts['quizzes'] += len(rows)
+
+    def _clear_quizzes(self, subtopic_ids):
+        new = set(subtopic_ids) - self._cleared
+        if new:
+            db.session.execute(delete(Quiz).where(Quiz.subtopic_id.in_(list(new))))
+            self._cleared.update(new)
@@ -0,0 +1,88 @@
+import logging
+import threading
+
+from sqlalchemy import select
+
+from app.extensions import db
+from app.models.tutorial import ContentVersion
+from app.utils.cache import TTLCache
+from app.utils.db_utils import dialect_insert
+
+logger = logging.getLogger(__name__)
+
+# The content version has two parts: the shared counter in the content_version
+# table, bumped by every topic/subtopic write in any process, and a counter
+# local to this process, so the writing process sees its own writes at once.
+# Other processes notice a write once their copy of the shared counter expires
+# (CONTENT_VERSION_CACHE_TTL seconds, set in create_app).
+content_version_cache = TTLCache(maxsize=1, ttl=1)
+
+_version_lock = threading.Lock()
+_local_version = 0
+
+
+def content_version():
+    """Return the current content version."""
+    shared = content_version_cache.get('shared')
+    if shared is None:
+        shared = db.session.execute(
+            select(ContentVersion.version).where(ContentVersion.id == 1)
+        ).scalar() or 0
+        content_version_cache.set('shared', shared)
+    return shared, _local_version
+
+
+def bump_content_version():
+    """
+    Invalidate every VersionedCache built from published content, in all
+    processes. Call after the content write committed; commits the bump.
+    """
+    table = ContentVersion.__table__
+    stmt = dialect_insert(table).values(id=1, version=1)
+    stmt = stmt.on_conflict_do_update(index_elements=['id'], set_={'version': table.c.version + 1})
+    try:
+        db.session.execute(stmt)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        logger.error("Failed to bump the shared content version", exc_info=True)
+    invalidate_content_caches()
+
+
+def invalidate_content_caches():
+    """Invalidate the VersionedCaches of this process only."""
+    global _local_version
+    with _version_lock:
+        _local_version += 1
+        content_version_cache.clear()
+        return _local_version
+
+
+class VersionedCache:
+    """
+    Holds one value derived from the content tables, rebuilt lazily by
+    ``build()`` the first time it is requested after the content version changed.
+    """
+
+    def __init__(self, build):
+        self._build = build
+        self._lock = threading.Lock()
+        self._version = None
+        self._value = None
+
+    def get(self):
+        version = content_version()
+        if self._version == version:
+            return self._value
+        with self._lock:
+            if self._version != version:
+                # Capture the version before building so a concurrent bump
+                # forces another rebuild rather than being lost.
+                self._value = self._build()
+                self._version = version
+            return self._value
+
+    def clear(self):
+        with self._lock:
+            self._version = None
+            self._value = None
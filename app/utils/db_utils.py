@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from sqlalchemy import func
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.extensions import db
+
+
+def dialect_name():
+    """Return the dialect name ('sqlite', 'postgresql', ...) of the current session bind."""
+    return db.session.get_bind().dialect.name
+
+
+def dialect_insert(table):
+    """
+    Return an INSERT construct supporting ``on_conflict_do_update`` /
+    ``on_conflict_do_nothing`` for the active database.
+
+    Only SQLite and PostgreSQL are supported, matching the databases the app runs on.
+    """
+    name = dialect_name()
+    if name == 'postgresql':
+        return postgresql.insert(table)
+    if name == 'sqlite':
+        return sqlite.insert(table)
+    raise NotImplementedError(f"Upserts are not supported on '{name}'")
+
+
+def add_days(column, days):
+    """SQL expression for a timestamp column shifted by a whole number of days."""
+    if dialect_name() == 'sqlite':
+        # Comparable with the text SQLAlchemy stores DateTime values as (to the millisecond)
+        return func.strftime('%Y-%m-%d %H:%M:%f', column, f'{int(days):+d} days')
+    return column + timedelta(days=int(days))
+
+
+def string_agg(column, separator):
+    """Aggregate text values into one separated string (string_agg / group_concat)."""
+    if dialect_name() == 'postgresql':
+        return func.string_agg(column, separator)
+    return func.group_concat(column, separator)
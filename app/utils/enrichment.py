@@ -0,0 +1,194 @@
+import logging
+from typing import NamedTuple
+
+from sqlalchemy import update
+from user_agents import parse as parse_ua
+
+from app.extensions import db
+from app.models.log import SessionLog
+from app.models.tutorial import Session
+from app.utils.batching import BatchWriter
+from app.utils.cache import TTLCache
+from app.utils.geoip import geo_lookup
+from app.utils.login_stats import apply_login_counters
+
+logger = logging.getLogger(__name__)
+
+TV_KEYWORDS = [
+    'smart-tv', 'hbbtv', 'netcast', 'appletv', 'googletv', 'tizen', 'webos',
+    'roku', 'aquos', 'sonybravia', 'androidtv', 'pov_tv', 'smarttv', 'tv'
+]
+
+
+def get_country_from_ip(ip_address: str) -> str:
+    """Return the country name from an IP address using GeoLite2."""
+    return geo_lookup.country(ip_address)
+
+
+class UserAgentInfo(NamedTuple):
+    """Classification of a User-Agent string."""
+    browser_family: str
+    browser_version: str
+    os_family: str
+    os_version: str
+    device: str  # Mobile, Tablet, Desktop, TV or Other
+
+    @property
+    def browser(self):
+        return f"{self.browser_family} {self.browser_version}"
+
+    @property
+    def os(self):
+        return f"{self.os_family} {self.os_version}"
+
+
+# User-Agent string -> UserAgentInfo. Real traffic has few distinct UA strings,
+# so a bounded LRU spares almost every parse; resized from config in create_app.
+user_agent_cache = TTLCache(maxsize=2048, ttl=None)
+
+
+def _device_type(ua) -> str:
+    if ua.is_mobile:
+        return 'Mobile'
+    if ua.is_tablet:
+        return 'Tablet'
+    if ua.is_pc:
+        return 'Desktop'
+    if any(keyword in ua.ua_string for keyword in TV_KEYWORDS):
+        return 'TV'
+    return 'Other'
+
+
+def classify_user_agent(user_agent_string: str) -> UserAgentInfo:
+    """Parse a User-Agent string once and memoize the result."""
+    user_agent_string = user_agent_string or ''
+    info = user_agent_cache.get(user_agent_string)
+    if info is None:
+        ua = parse_ua(user_agent_string)
+        info = UserAgentInfo(
+            ua.browser.family, ua.browser.version_string,
+            ua.os.family, ua.os.version_string,
+            _device_type(ua),
+        )
+        user_agent_cache.set(user_agent_string, info)
+    return info
+
+
+def get_device_type(user_agent_string: str) -> str:
+    """Return the device type (Mobile, Tablet, Desktop, TV, Other)."""
+    return classify_user_agent(user_agent_string).device
+
+
+class EnrichmentJob(NamedTuple):
+    """A row whose country/browser/os/device columns are derived from its raw IP and UA."""
+    kind: str  # 'session' or 'session_log'
+    pk: int
+    ip_address: str
+    user_agent: str
+    fill_device: bool = True
+
+
+def enrichment_fields(kind, ip_address, user_agent, fill_device=True):
+    """
+    Column values derived from a raw IP address and User-Agent string,
+    in the format stored by each target table.
+    """
+    ua = classify_user_agent(user_agent)
+    country = get_country_from_ip(ip_address or '')
+    if kind == 'session_log':
+        return {'browser': ua.browser, 'os': ua.os, 'device': ua.device, 'country': country}
+    fields = {'browser': ua.browser_family, 'os': ua.os_family, 'country': country}
+    if fill_device:
+        fields['device_type'] = ua.device
+    return fields
+
+
+_MODELS = {'session': Session, 'session_log': SessionLog}
+
+
+def write_enrichment(jobs):
+    """Apply enrichment jobs with one bulk UPDATE per target table and commit."""
+    by_model = {}
+    for job in jobs:
+        fields = enrichment_fields(job.kind, job.ip_address, job.user_agent, job.fill_device)
+        by_model.setdefault(_MODELS[job.kind], []).append(dict(fields, id=job.pk))
+    # Bulk UPDATE by primary key needs the same keys in every parameter set.
+    for model, rows in by_model.items():
+        for keys in {frozenset(row) for row in rows}:
+            db.session.execute(update(model), [row for row in rows if frozenset(row) == keys])
+
+    # Logins stored raw were not counted yet; count them now that the device is known.
+    log_rows = {row['id']: row for row in by_model.get(SessionLog, [])}
+    if log_rows:
+        apply_login_counters([
+            dict(log_rows[log_id], user_id=user_id, login_time=login_time)
+            for log_id, user_id, login_time in db.session.query(
+                SessionLog.id, SessionLog.user_id, SessionLog.login_time
+            ).filter(SessionLog.id.in_(list(log_rows)))
+        ])
+    db.session.commit()
+
+
+def _flush_enrichment(jobs):
+    try:
+        write_enrichment(jobs)
+    except Exception:
+        db.session.rollback()
+        logger.error("Failed to enrich %d session rows", len(jobs), exc_info=True)
+
+
+class ClientEnricher:
+    """
+    Fills in country, browser, OS and device columns from the raw IP and
+    User-Agent stored on Session and SessionLog rows.
+
+    In ``sync`` mode (default) the fields are computed on the request thread
+    and written with the row itself. In ``async`` mode rows are stored with
+    the raw values only and enriched in batches by a background writer; when
+    its queue is full the job is applied synchronously instead.
+
+    The writer is a single-thread BatchWriter of its own ("client-enrichment"),
+    separate from the view ingestion writer, with its own queue and
+    ENRICHMENT_* settings. One thread is enough: User-Agent parsing is pure
+    Python and holds the GIL, so more threads would not add throughput.
+    """
+
+    def __init__(self):
+        self.mode = "sync"
+        self._writer = None
+
+    def init_app(self, app):
+        self.mode = app.config.get("ENRICHMENT_MODE", "sync")
+        if self.mode == "async":
+            self._writer = BatchWriter(
+                "client-enrichment",
+                _flush_enrichment,
+                maxsize=app.config.get("ENRICHMENT_QUEUE_SIZE", 10000),
+                batch_size=app.config.get("ENRICHMENT_BATCH_SIZE", 200),
+                flush_interval=app.config.get("ENRICHMENT_FLUSH_INTERVAL", 0.5),
+            )
+            self._writer.start(app)
+        app.extensions["client_enricher"] = self
+
+    @property
+    def deferred(self):
+        """True if rows should be stored raw and enriched later via ``submit``."""
+        return self._writer is not None
+
+    def submit(self, job):
+        """Queue a committed row for enrichment, enriching it inline on back-pressure."""
+        if self._writer is not None and self._writer.submit(job):
+            return
+        write_enrichment([job])
+
+    def stop(self):
+        if self._writer is not None:
+            self._writer.stop()
+
+    def stats(self):
+        if self._writer is None:
+            return {"mode": self.mode}
+        return dict(self._writer.stats, mode=self.mode, queued=self._writer.qsize())
+
+
+client_enricher = ClientEnricher()
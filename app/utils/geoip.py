@@ -0,0 +1,127 @@
+import ipaddress
+import logging
+import os
+import threading
+
+import geoip2.database
+from maxminddb import MODE_MMAP
+
+from app.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN = "Unknown"
+LOCALHOST = "Localhost"
+
+# Addresses in the same /24 (IPv4) or /48 (IPv6) share a cache entry.
+IPV4_PREFIX = 24
+IPV6_PREFIX = 48
+
+
+class GeoLookup:
+    """
+    Country lookup backed by a MaxMind database, opened lazily on first use.
+
+    The GeoLite2 Country database is preferred when present (it is smaller
+    than City and holds everything we read); otherwise the City database is
+    used. Both are memory-mapped. Results are cached per network prefix.
+    When no database is available every lookup returns "Unknown"; startup
+    never depends on the file being present.
+    """
+
+    def __init__(self, country_db=None, city_db=None, cache_size=4096):
+        self.country_db = country_db
+        self.city_db = city_db
+        self.cache = TTLCache(maxsize=cache_size, ttl=None)
+        self._lock = threading.Lock()
+        self._reader = None
+        self._lookup = None
+        self._opened = False
+
+    def init_app(self, app):
+        data_dir = os.path.join(app.root_path, 'data')
+        self.country_db = app.config.get('GEOIP_COUNTRY_DB') or os.path.join(data_dir, 'GeoLite2-Country.mmdb')
+        self.city_db = app.config.get('GEOIP_CITY_DB') or os.path.join(data_dir, 'GeoLite2-City.mmdb')
+        self.cache.configure(maxsize=app.config.get('GEOIP_CACHE_SIZE', 4096))
+        self.reset()
+        app.extensions['geo_lookup'] = self
+
+    def use_reader(self, reader):
+        """Plug in an already opened reader (anything with ``country()`` or ``city()``)."""
+        with self._lock:
+            self._set_reader(reader)
+            self._opened = True
+        self.cache.clear()
+
+    def reset(self):
+        """Close the reader; the database is reopened on the next lookup."""
+        with self._lock:
+            if self._reader is not None and hasattr(self._reader, 'close'):
+                self._reader.close()
+            self._reader = None
+            self._lookup = None
+            self._opened = False
+        self.cache.clear()
+
+    @property
+    def available(self):
+        return self._ensure_open() is not None
+
+    def country(self, ip_address):
+        """Country name for an IP address, "Localhost" for loopback, "Unknown" otherwise."""
+        if not ip_address:
+            return UNKNOWN
+        if ip_address.startswith("127.") or ip_address == "localhost":
+            return LOCALHOST
+        try:
+            ip = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return UNKNOWN
+        if ip.is_loopback:
+            return LOCALHOST
+
+        prefix = IPV4_PREFIX if ip.version == 4 else IPV6_PREFIX
+        key = ipaddress.ip_network(f"{ip}/{prefix}", strict=False)
+        name = self.cache.get(key)
+        if name is None:
+            name = self._resolve(ip_address)
+            self.cache.set(key, name)
+        return name
+
+    def stats(self):
+        return dict(self.cache.stats(), available=self._reader is not None)
+
+    def _resolve(self, ip_address):
+        lookup = self._ensure_open()
+        if lookup is None:
+            return UNKNOWN
+        try:
+            return lookup(ip_address).country.name or UNKNOWN
+        except Exception:
+            return UNKNOWN
+
+    def _ensure_open(self):
+        if self._opened:
+            return self._lookup
+        with self._lock:
+            if not self._opened:
+                paths = [path for path in (self.country_db, self.city_db) if path and os.path.exists(path)]
+                for path in paths:
+                    try:
+                        self._set_reader(geoip2.database.Reader(path, mode=MODE_MMAP))
+                        break
+                    except Exception as e:
+                        logger.error("Could not open GeoIP database %s: %s", path, e, exc_info=True)
+                if not paths:
+                    logger.warning("No GeoIP database found; countries will be reported as Unknown")
+                self._opened = True
+        return self._lookup
+
+    def _set_reader(self, reader):
+        self._reader = reader
+        metadata = getattr(reader, 'metadata', None)
+        database_type = metadata().database_type if callable(metadata) else ''
+        self._lookup = reader.city if 'City' in database_type else reader.country
+
+
+geo_lookup = GeoLookup()
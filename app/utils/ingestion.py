@@ -0,0 +1,95 @@
+import logging
+
+from sqlalchemy import insert
+
+from app.extensions import db
+from app.models.tutorial import SubTopicView
+from app.utils.batching import BatchWriter
+from app.utils.metrics import apply_view_metrics
+from app.utils.rollups import apply_view_rollups
+
+logger = logging.getLogger(__name__)
+
+
+def write_views(rows):
+    """
+    Insert SubTopicView rows with a single multi-row INSERT, fold them into
+    the analytics rollups and daily metrics in the same transaction and commit.
+
+    Raises on database errors; the caller decides how to report them.
+    """
+    if not rows:
+        return
+    db.session.execute(insert(SubTopicView), rows)
+    apply_view_rollups(rows)
+    apply_view_metrics(rows)
+    db.session.commit()
+
+
+def _flush_views(rows):
+    """Background flush: one bulk INSERT, falling back to row-by-row on failure."""
+    try:
+        write_views(rows)
+        return
+    except Exception:
+        db.session.rollback()
+        logger.warning("Bulk insert of %d views failed, retrying row by row", len(rows), exc_info=True)
+
+    for row in rows:
+        try:
+            write_views([row])
+        except Exception:
+            db.session.rollback()
+            logger.error("Dropping subtopic view %r", row, exc_info=True)
+
+
+class ViewIngestor:
+    """
+    Entry point for subtopic view events.
+
+    In ``sync`` mode (default) every view is written and committed on the
+    request thread. In ``buffered`` mode views are queued and flushed in
+    batches by a background writer; ``submit`` returns False when the queue
+    is full.
+    """
+
+    def __init__(self):
+        self.mode = "sync"
+        self._writer = None
+
+    def init_app(self, app):
+        self.mode = app.config.get("ANALYTICS_INGEST_MODE", "sync")
+        if self.mode == "buffered":
+            self._writer = BatchWriter(
+                "subtopic-views",
+                _flush_views,
+                maxsize=app.config.get("ANALYTICS_INGEST_QUEUE_SIZE", 10000),
+                batch_size=app.config.get("ANALYTICS_INGEST_BATCH_SIZE", 500),
+                flush_interval=app.config.get("ANALYTICS_INGEST_FLUSH_INTERVAL", 1.0),
+            )
+            self._writer.start(app)
+        app.extensions["view_ingestor"] = self
+
+    @property
+    def buffered(self):
+        return self._writer is not None
+
+    def submit(self, row):
+        """Record a view row; returns False if it was rejected by back-pressure."""
+        if self._writer is not None:
+            return self._writer.submit(row)
+        write_views([row])
+        return True
+
+    def stop(self):
+        """Drain pending views (no-op in sync mode)."""
+        if self._writer is not None:
+            self._writer.stop()
+
+    def stats(self):
+        if self._writer is None:
+            return {"mode": self.mode}
+        return dict(self._writer.stats, mode=self.mode, queued=self._writer.qsize())
+
+
+view_ingestor = ViewIngestor()
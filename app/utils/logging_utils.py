@@ -1,57 +1,36 @@
+import logging
 from datetime import datetime, timezone
 from flask import request
 from dateutil import tz
-from user_agents import parse as parse_ua
 
-from app.models.log import SessionLog, AuditLog
+from app.models.log import SessionLog
 from app.models.tutorial import Session
 from app.extensions import db
-import geoip2.database
-
-# Load database once for performance
-GEOIP_DB_PATH = 'app/data/GeoLite2-City.mmdb'
-geoip_reader = geoip2.database.Reader(GEOIP_DB_PATH)
-
-
-def get_country_from_ip(ip_address: str) -> str:
-    """Return the country name from an IP address using GeoLite2."""
-    try:
-        if ip_address.startswith("127.") or ip_address == "localhost":
-            return "Localhost"
-        response = geoip_reader.city(ip_address)
-        return response.country.name or "Unknown"
-    except Exception:
-        return "Unknown"
-
-def get_device_type(user_agent_string: str) -> str:
-    tv_keywords = ['smart-tv', 'hbbtv', 'netcast',
-     'appletv', 'googletv', 'tizen', 'webos',
-     'roku', 'aquos', 'sonybravia',
-    'androidtv', 'pov_tv', 'smarttv', 'tv']
-
-    """Return the device type (Mobile, Tablet, Desktop, TV, Other)."""
-    ua = parse_ua(user_agent_string)
-    if ua.is_mobile:
-        return 'Mobile'
-    if ua.is_tablet:
-        return 'Tablet'
-    if ua.is_pc:
-        return 'Desktop'
-    if any(keyword in ua.ua_string for keyword in tv_keywords):
-        return 'TV'
-
-    return 'Other'
-
+from app.utils.activity import activity_tracker, session_activity
+from app.utils.audit import audit_sink
+from app.utils.cache import TTLCache
+from app.utils.db_utils import dialect_insert
+from app.utils.login_stats import apply_login_counters
+from app.utils.metrics import apply_new_sessions
+from app.utils.enrichment import (  # noqa: F401 (re-exported)
+    EnrichmentJob, classify_user_agent, client_enricher, enrichment_fields, get_country_from_ip,
+    get_device_type
+)
+
+logger = logging.getLogger(__name__)
+
+# External session id -> Session.id; resized from config in create_app.
+session_id_cache = TTLCache(maxsize=10000, ttl=3600)
 
 def parse_user_agent_info() -> dict:
     """Parse User-Agent string and return browser, OS, and device info."""
     ua_string = request.headers.get('User-Agent', '')
-    ua = parse_ua(ua_string)
+    ua = classify_user_agent(ua_string)
     return {
         'user_agent': ua_string,
-        'browser': f"{ua.browser.family} {ua.browser.version_string}",
-        'os': f"{ua.os.family} {ua.os.version_string}",
-        'device': get_device_type(ua_string)
+        'browser': ua.browser,
+        'os': ua.os,
+        'device': ua.device
     }
 
 
@@ -62,74 +41,122 @@ def get_client_ip(req) -> str:
     return req.remote_addr or '0.0.0.0'
 
 
+def resolve_session_pk(session_id):
+    """
+    Resolve a client session id to its Session primary key.
+    Consults the in-memory cache first and only queries the database on a miss.
+    Returns None if the session does not exist.
+    """
+    if not session_id:
+        return None
+    pk = session_id_cache.get(session_id)
+    if pk is None:
+        row = db.session.query(Session.id).filter_by(session_id=session_id).first()
+        if row is None:
+            return None
+        pk = row.id
+        session_id_cache.set(session_id, pk)
+    return pk
+
+
 def get_or_create_session(session_id, **env_data):
+    """
+    Return ``(session, created)`` for a client session id, or ``(None, None)``
+    on a database error.
+
+    Creation is an INSERT ... ON CONFLICT DO NOTHING, so two tabs starting the
+    same session concurrently both end up with the single row. On revisits
+    only environment fields whose value changed are written; the last_seen
+    heartbeat goes through ``session_activity`` (throttled and optionally
+    coalesced across sessions).
+    """
     session = Session.query.filter_by(session_id=session_id).first()
-    if session:
-        # Update environment data on revisit
-        session.last_seen = datetime.now(timezone.utc)
-        for key, value in env_data.items():
-            if value is not None:
-                setattr(session, key, value)
-        try:
-            db.session.commit()
-        except Exception as e:
-            db.session.rollback()
-            logger.error("Database error updating session", exc_info=True)
-        return session, False  # False means session existed
-    else:
-        session = Session(
-            session_id=session_id,
-            started_at=datetime.now(timezone.utc),
-            **env_data
+    if session is None:
+        started_at = datetime.now(timezone.utc)
+        table = Session.__table__
+        stmt = (
+            dialect_insert(table)
+            .values(session_id=session_id, started_at=started_at, **env_data)
+            .on_conflict_do_nothing(index_elements=['session_id'])
+            .returning(table.c.id)
         )
-        db.session.add(session)
         try:
+            pk = db.session.execute(stmt).scalar()
+            if pk is not None:
+                apply_new_sessions([started_at])
             db.session.commit()
-            return session, True  # True means session created now
-        except Exception as e:
+        except Exception:
             db.session.rollback()
             logger.error("Database error creating session", exc_info=True)
             return None, None
+        if pk is not None:
+            session_id_cache.set(session_id, pk)
+            return db.session.get(Session, pk), True  # True means session created now
+        # Lost the race: another request created it in the meantime
+        session = Session.query.filter_by(session_id=session_id).first()
+
+    session_id_cache.set(session_id, session.id)
+    changed = {
+        key: value for key, value in env_data.items()
+        if value is not None and getattr(session, key) != value
+    }
+    if changed:
+        for key, value in changed.items():
+            setattr(session, key, value)
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.error("Database error updating session", exc_info=True)
+    try:
+        session_activity.touch(session.id)
+    except Exception:
+        db.session.rollback()
+        logger.error("Database error updating session", exc_info=True)
+    return session, False  # False means session existed
 
 def log_session(user):
-    """Log a new user session."""
-    ua_info = parse_user_agent_info()
+    """
+    Log a new user session. Browser, OS, device and country are derived from
+    the raw User-Agent and IP inline, or later by the enrichment stage.
+    """
+    ua_string = request.headers.get('User-Agent', '')
     ip_address = get_client_ip(request)
+    now = datetime.utcnow()
 
+    fields = {} if client_enricher.deferred else enrichment_fields('session_log', ip_address, ua_string)
     session = SessionLog(
         user_id=user.id,
         ip_address=ip_address,
-        login_time=datetime.utcnow(),
-        last_activity=datetime.utcnow(),
-        user_agent=ua_info['user_agent'],
-        browser=ua_info['browser'],
-        os=ua_info['os'],
-        device=ua_info['device'],
-        country=get_country_from_ip(ip_address)
+        login_time=now,
+        last_activity=now,
+        user_agent=ua_string,
+        **fields
     )
     db.session.add(session)
+    user.last_login_at = now
+    if not client_enricher.deferred:
+        apply_login_counters([dict(fields, user_id=user.id, login_time=now)])
     db.session.commit()
 
+    if client_enricher.deferred:
+        client_enricher.submit(EnrichmentJob('session_log', session.id, ip_address, ua_string))
+
 
 def update_last_activity(user):
-    """Update the last_activity timestamp for the user's most recent session."""
-    latest_session = SessionLog.query.filter_by(user_id=user.id)\
-        .order_by(SessionLog.login_time.desc()).first()
-    if latest_session:
-        latest_session.last_activity = datetime.utcnow()
-        db.session.commit()
+    """
+    Record activity on the user's most recent session. Written at most once
+    per ACTIVITY_GRANULARITY, inline or coalesced depending on ACTIVITY_TRACKING_MODE.
+    """
+    activity_tracker.touch(user.id)
 
 
 def log_audit_action(actor_id, action_type, target_user_id=None, description=""):
-    """Log an audit event for tracking user actions."""
-    audit = AuditLog(
-        actor_id=actor_id,
-        action_type=action_type,
-        target_user_id=target_user_id,
-        description=description
-    )
-    db.session.add(audit)
-    db.session.commit()
+    """
+    Log an audit event as part of the caller's transaction; the caller commits.
+    Depending on AUDIT_SINK_MODE the row is written by that commit or queued once it succeeds.
+    """
+    audit_sink.record(actor_id, action_type, target_user_id=target_user_id, description=description)
 
 
 def format_last_login(dt_iso_str: str) -> str:
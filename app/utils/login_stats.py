@@ -0,0 +1,108 @@
+from collections import Counter
+
+from sqlalchemy import delete, func, select, update
+
+from app.extensions import db
+from app.models.log import AuditLog, LoginDeviceCounter, SessionLog
+from app.models.user import User
+from app.utils.db_utils import dialect_insert
+
+DEVICE_DIMENSIONS = ('device', 'browser', 'os')
+
+
+def apply_login_counters(rows):
+    """
+    Count logins (dicts with user_id, login_time, device, browser, os) in
+    the device counters. Runs in the caller's transaction; the caller commits.
+    """
+    counts = Counter(
+        (row['login_time'].date(), row['user_id'],
+         row.get('device') or '', row.get('browser') or '', row.get('os') or '')
+        for row in rows
+        if row.get('login_time') is not None
+    )
+    if not counts:
+        return
+    table = LoginDeviceCounter.__table__
+    stmt = dialect_insert(table).values([
+        {'day': day, 'user_id': user_id, 'device': device, 'browser': browser, 'os': os, 'logins': logins}
+        for (day, user_id, device, browser, os), logins in counts.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['day', 'user_id', 'device', 'browser', 'os'],
+        set_={'logins': table.c.logins + stmt.excluded.logins},
+    )
+    db.session.execute(stmt)
+
+
+def rebuild_login_counters(chunk_size=5000):
+    """Recompute the device counters from the session log. Returns the number of logins processed."""
+    db.session.execute(delete(LoginDeviceCounter))
+    processed = 0
+    last_id = 0
+    while True:
+        chunk = (
+            db.session.query(
+                SessionLog.id, SessionLog.user_id, SessionLog.login_time,
+                SessionLog.device, SessionLog.browser, SessionLog.os,
+            )
+            .filter(SessionLog.id > last_id)
+            .order_by(SessionLog.id.asc())
+            .limit(chunk_size)
+            .all()
+        )
+        if not chunk:
+            break
+        apply_login_counters([row._asdict() for row in chunk])
+        processed += len(chunk)
+        last_id = chunk[-1].id
+    db.session.commit()
+    return processed
+
+
+def device_distributions(start_day=None, end_day=None, user_id=None):
+    """
+    Login counts by device, browser and OS from one grouped query over the
+    counters. ``start_day``/``end_day`` are inclusive dates.
+    """
+    columns = [getattr(LoginDeviceCounter, name) for name in DEVICE_DIMENSIONS]
+    query = db.session.query(*columns, func.sum(LoginDeviceCounter.logins).label('logins'))
+    if start_day is not None:
+        query = query.filter(LoginDeviceCounter.day >= start_day)
+    if end_day is not None:
+        query = query.filter(LoginDeviceCounter.day <= end_day)
+    if user_id is not None:
+        query = query.filter(LoginDeviceCounter.user_id == user_id)
+
+    totals = {name: Counter() for name in DEVICE_DIMENSIONS}
+    for row in query.group_by(*columns):
+        for name in DEVICE_DIMENSIONS:
+            totals[name][getattr(row, name) or "Unknown"] += int(row.logins)
+
+    return {
+        name: [
+            {"label": label, "count": count}
+            for label, count in sorted(counter.items(), key=lambda item: (-item[1], item[0]))
+        ]
+        for name, counter in totals.items()
+    }
+
+
+def rebuild_user_activity():
+    """Recompute User.last_login_at / last_activity_at from the session and audit logs."""
+    last_login = (
+        select(func.max(SessionLog.login_time))
+        .where(SessionLog.user_id == User.id)
+        .scalar_subquery()
+    )
+    last_activity = (
+        select(func.max(AuditLog.timestamp))
+        .where(AuditLog.actor_id == User.id)
+        .scalar_subquery()
+    )
+    result = db.session.execute(
+        update(User).values(last_login_at=last_login, last_activity_at=last_activity)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,276 @@
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, delete, exists, func
+
+from app.extensions import db
+from app.models.tutorial import (
+    Session, SubTopicView, DailyMetrics, HourlyMetrics, DailySessionActivity
+)
+from app.utils.cache import TTLCache
+from app.utils.db_utils import add_days, dialect_insert
+from app.utils.rollups import bucket_start, to_naive_utc
+
+logger = logging.getLogger(__name__)
+
+DAY_NAMES = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
+
+_DAILY_COUNTERS = ('views', 'unique_sessions', 'new_sessions', 'time_spent_total', 'time_spent_samples')
+_HOURLY_COUNTERS = ('views', 'new_sessions')
+
+# Computed dashboard payloads; TTL set from METRICS_CACHE_TTL in create_app.
+metrics_cache = TTLCache(maxsize=64, ttl=5)
+
+# View breakdowns per (range, top); TTL set from VIEW_STATS_CACHE_TTL in create_app.
+breakdown_cache = TTLCache(maxsize=64, ttl=60)
+
+BREAKDOWN_DIMENSIONS = ('device_type', 'os', 'browser', 'country')
+
+
+def _upsert_counters(model, key, rows, counters):
+    table = model.__table__
+    stmt = dialect_insert(table).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[key],
+        set_={name: table.c[name] + stmt.excluded[name] for name in counters},
+    )
+    db.session.execute(stmt)
+
+
+def _apply(daily, hourly):
+    if daily:
+        _upsert_counters(DailyMetrics, 'day', [
+            dict(dict.fromkeys(_DAILY_COUNTERS, 0), day=day, **counters)
+            for day, counters in daily.items()
+        ], _DAILY_COUNTERS)
+    if hourly:
+        _upsert_counters(HourlyMetrics, 'hour_start', [
+            dict(dict.fromkeys(_HOURLY_COUNTERS, 0), hour_start=hour, **counters)
+            for hour, counters in hourly.items()
+        ], _HOURLY_COUNTERS)
+
+
+def apply_view_metrics(rows):
+    """
+    Add a batch of freshly inserted views (dicts with session_id, viewed_at
+    and time_spent_seconds) to the daily and hourly metrics.
+
+    Runs in the caller's transaction; the caller commits.
+    """
+    daily = defaultdict(Counter)
+    hourly = defaultdict(Counter)
+    active = set()
+    for row in rows:
+        viewed_at = row.get('viewed_at')
+        if viewed_at is None:
+            continue
+        day = bucket_start(viewed_at, 'day').date()
+        daily[day]['views'] += 1
+        hourly[bucket_start(viewed_at, 'hour')]['views'] += 1
+        if row.get('time_spent_seconds') is not None:
+            daily[day]['time_spent_total'] += row['time_spent_seconds']
+            daily[day]['time_spent_samples'] += 1
+        if row.get('session_id') is not None:
+            active.add((day, row['session_id']))
+
+    if active:
+        # Only pairs not seen before today come back, so each session counts once per day.
+        stmt = (
+            dialect_insert(DailySessionActivity.__table__)
+            .values([{'day': day, 'session_id': session_id} for day, session_id in active])
+            .on_conflict_do_nothing(index_elements=['day', 'session_id'])
+            .returning(DailySessionActivity.__table__.c.day)
+        )
+        for (day,) in db.session.execute(stmt):
+            daily[day]['unique_sessions'] += 1
+
+    _apply(daily, hourly)
+
+
+def apply_new_sessions(started_at_values):
+    """Count newly created sessions. Runs in the caller's transaction."""
+    daily = defaultdict(Counter)
+    hourly = defaultdict(Counter)
+    for started_at in started_at_values:
+        if started_at is None:
+            continue
+        daily[bucket_start(started_at, 'day').date()]['new_sessions'] += 1
+        hourly[bucket_start(started_at, 'hour')]['new_sessions'] += 1
+    _apply(daily, hourly)
+
+
+def rebuild_daily_metrics(chunk_size=5000):
+    """
+    Recompute the daily/hourly metrics from the raw Session and SubTopicView
+    tables, in id-ordered chunks. Returns ``(sessions, views)`` processed.
+    """
+    db.session.execute(delete(DailySessionActivity))
+    db.session.execute(delete(DailyMetrics))
+    db.session.execute(delete(HourlyMetrics))
+
+    def chunks(model, *columns):
+        last_id = 0
+        while True:
+            chunk = (
+                db.session.query(model.id, *columns)
+                .filter(model.id > last_id)
+                .order_by(model.id.asc())
+                .limit(chunk_size)
+                .all()
+            )
+            if not chunk:
+                return
+            yield chunk
+            last_id = chunk[-1].id
+
+    sessions = 0
+    for chunk in chunks(Session, Session.started_at):
+        apply_new_sessions([row.started_at for row in chunk])
+        sessions += len(chunk)
+
+    views = 0
+    for chunk in chunks(SubTopicView, SubTopicView.session_id, SubTopicView.viewed_at,
+                        SubTopicView.time_spent_seconds):
+        apply_view_metrics([row._asdict() for row in chunk])
+        views += len(chunk)
+
+    db.session.commit()
+    return sessions, views
+
+
+def summary_metrics(today=None):
+    """Lifetime sessions plus today's views and new sessions, from the daily metrics."""
+    today = today or datetime.utcnow().date()
+    key = ('summary', today)
+    result = metrics_cache.get(key)
+    if result is None:
+        day = db.session.get(DailyMetrics, today)
+        total_sessions = db.session.query(func.coalesce(func.sum(DailyMetrics.new_sessions), 0)).scalar()
+        result = {
+            "users": int(total_sessions),
+            "views_today": day.views if day else 0,
+            "new_users_today": day.new_sessions if day else 0,
+        }
+        metrics_cache.set(key, result)
+    return result
+
+
+def engagement_metrics(now=None, days=7):
+    """
+    Sessions started, peak hour of day and peak weekday over the last ``days``
+    days, from the hourly metrics (the window starts at the top of the hour).
+    """
+    since = bucket_start(to_naive_utc(now or datetime.utcnow()) - timedelta(days=days), 'hour')
+    key = ('engagement', since, days)
+    result = metrics_cache.get(key)
+    if result is None:
+        rows = HourlyMetrics.query.filter(HourlyMetrics.hour_start >= since).all()
+        by_hour = Counter()
+        by_weekday = Counter()
+        for row in rows:
+            if row.views:
+                by_hour[row.hour_start.hour] += row.views
+                # isoweekday: Monday=1 .. Sunday=7 -> Sunday=0 as in DAY_NAMES
+                by_weekday[row.hour_start.isoweekday() % 7] += row.views
+
+        peak_hour = max(by_hour, key=by_hour.get) if by_hour else None
+        peak_day = max(by_weekday, key=by_weekday.get) if by_weekday else None
+        result = {
+            "unique_visitors": sum(row.new_sessions for row in rows),
+            "peak_hour_range": f"{peak_hour}:00 - {peak_hour + 1}:00" if peak_hour is not None else "N/A",
+            "peak_day": DAY_NAMES[peak_day] if peak_day is not None else "N/A",
+        }
+        metrics_cache.set(key, result)
+    return result
+
+
+def _rate(engaged, total):
+    return round(engaged / total * 100, 1) if total else 0
+
+
+def engagement_rates(since, cohort_days=None, by_day=False):
+    """
+    Share of sessions started since ``since`` that viewed at least one subtopic.
+
+    A session counts as engaged if it has a view since ``since`` or, with
+    ``cohort_days``, within that many days of its own start. Computed with one
+    EXISTS semi-join in the database; ``by_day`` adds a breakdown by the UTC
+    day the sessions started on.
+    """
+    view_filter = [SubTopicView.session_id == Session.id]
+    if cohort_days is None:
+        view_filter.append(SubTopicView.viewed_at >= since)
+    else:
+        view_filter += [
+            SubTopicView.viewed_at >= Session.started_at,
+            SubTopicView.viewed_at < add_days(Session.started_at, cohort_days),
+        ]
+    engaged = func.coalesce(func.sum(case((exists().where(*view_filter), 1), else_=0)), 0)
+
+    def query(*group_by):
+        return (
+            db.session.query(*group_by, func.count(Session.id).label('total'), engaged.label('engaged'))
+            .filter(Session.started_at >= since)
+        )
+
+    totals = query().one()
+    result = {
+        "engagement_rate_percent": _rate(totals.engaged, totals.total),
+        "engaged_visitors": int(totals.engaged),
+        "total_visitors": totals.total,
+    }
+    if by_day:
+        day = func.date(Session.started_at).label('day')
+        result["daily"] = [
+            {
+                "date": str(row.day),
+                "engagement_rate_percent": _rate(row.engaged, row.total),
+                "engaged_visitors": int(row.engaged),
+                "total_visitors": row.total,
+            }
+            for row in query(day).group_by(day).order_by(day)
+        ]
+    return result
+
+
+def view_breakdown(start, end, top=None):
+    """
+    Views in ``[start, end)`` broken down by the viewing session's device
+    type, OS, browser and country.
+
+    One grouped query returns the view count of every distinct combination
+    (a small set); the four per-dimension distributions are summed from it
+    in Python. With ``top``, each distribution keeps its ``top`` largest
+    keys and folds the remainder into a final "Other" entry, together with
+    the views the User-Agent parser itself reported as "Other".
+    """
+    key = ('breakdown', start, end, top)
+    result = breakdown_cache.get(key)
+    if result is not None:
+        return result
+
+    columns = [getattr(Session, name) for name in BREAKDOWN_DIMENSIONS]
+    rows = (
+        db.session.query(*columns, func.count(SubTopicView.id).label('views'))
+        .join(SubTopicView, SubTopicView.session_id == Session.id)
+        .filter(SubTopicView.viewed_at >= start, SubTopicView.viewed_at < end)
+        .group_by(*columns)
+        .all()
+    )
+
+    totals = {name: Counter() for name in BREAKDOWN_DIMENSIONS}
+    for row in rows:
+        for name in BREAKDOWN_DIMENSIONS:
+            totals[name][getattr(row, name) or "Unknown"] += row.views
+
+    result = {}
+    for name, counter in totals.items():
+        ranked = sorted(counter.items(), key=lambda item: (-item[1], item[0]))
+        if top is not None:
+            named = [item for item in ranked if item[0] != "Other"]
+            other = counter.get("Other", 0) + sum(views for _, views in named[top:])
+            ranked = named[:top] + ([("Other", other)] if other else [])
+        result[name] = [{"key": k, "views": v} for k, v in ranked]
+    breakdown_cache.set(key, result)
+    return result
@@ -0,0 +1,132 @@
+import codecs
+import csv
+import json
+import logging
+
+from marshmallow import ValidationError
+from sqlalchemy import insert
+
+from app.extensions import db
+from app.models.tutorial import Quiz, SubTopic
+from app.routes.schemas import QuizImportSchema
+
+logger = logging.getLogger(__name__)
+
+NDJSON_TYPES = ('application/x-ndjson', 'application/jsonl', 'application/json-seq', 'application/ndjson')
+CSV_TYPES = ('text/csv', 'application/csv')
+
+# Only the first errors are returned in full; the rest are counted.
+MAX_REPORTED_ERRORS = 100
+
+
+def import_format(mimetype):
+    """'ndjson', 'csv' or None for a request Content-Type."""
+    if mimetype in NDJSON_TYPES:
+        return 'ndjson'
+    if mimetype in CSV_TYPES:
+        return 'csv'
+    return None
+
+
+def _lines(stream):
+    """Decode a binary stream into text lines without reading it all at once."""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    pending = ''
+    for chunk in iter(lambda: stream.read(64 * 1024), b''):
+        pending += decoder.decode(chunk)
+        *complete, pending = pending.split('\n')
+        for line in complete:
+            yield line + '\n'
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def iter_records(stream, fmt):
+    """
+    Yield ``(row_number, record)`` from an NDJSON or CSV body. Row numbers
+    are 1-based data rows (blank NDJSON lines and the CSV header excluded).
+    A record that cannot be parsed is yielded as a ValidationError.
+    """
+    if fmt == 'csv':
+        for number, record in enumerate(csv.DictReader(_lines(stream)), start=1):
+            yield number, record
+        return
+    number = 0
+    for line in _lines(stream):
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            yield number, json.loads(line)
+        except ValueError as exc:
+            yield number, ValidationError({'_schema': [f"Invalid JSON: {exc.msg}"]})
+
+
+class QuizImport:
+    """
+    Validates quiz records one at a time and inserts the valid ones in
+    chunks of ``chunk_size`` rows with a single multi-row INSERT each, so
+    memory stays bounded by one chunk. Rows referencing a missing subtopic
+    are rejected. Runs in the caller's transaction; the caller commits.
+    """
+
+    def __init__(self, default_subtopic_id=None, chunk_size=1000):
+        self.default_subtopic_id = default_subtopic_id
+        self.chunk_size = max(int(chunk_size), 1)
+        self.schema = QuizImportSchema()
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self._chunk = []
+        self._known_subtopics = set()
+
+    def add(self, number, record):
+        if isinstance(record, ValidationError):
+            self._reject(number, record.messages)
+            return
+        if self.default_subtopic_id is not None and isinstance(record, dict):
+            record.setdefault('subtopic_id', self.default_subtopic_id)
+        try:
+            row = self.schema.load(record)
+        except ValidationError as exc:
+            self._reject(number, exc.messages)
+            return
+        self._chunk.append((number, row))
+        if len(self._chunk) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """Insert the pending chunk."""
+        chunk, self._chunk = self._chunk, []
+        if not chunk:
+            return
+        wanted = {row['subtopic_id'] for _, row in chunk} - self._known_subtopics
+        if wanted:
+            self._known_subtopics.update(
+                subtopic_id for (subtopic_id,) in
+                db.session.query(SubTopic.id).filter(SubTopic.id.in_(list(wanted)))
+            )
+        rows = []
+        for number, row in chunk:
+            if row['subtopic_id'] in self._known_subtopics:
+                rows.append(row)
+            else:
+                self._reject(number, {'subtopic_id': ["Subtopic not found"]})
+        if rows:
+            db.session.execute(insert(Quiz).values(rows))
+            self.imported += len(rows)
+
+    def run(self, records):
+        for number, record in records:
+            self.add(number, record)
+        self.flush()
+        return self
+
+    def _reject(self, number, messages):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": number, "errors": messages})
+
+    def summary(self):
+        return {"imported": self.imported, "failed": self.failed, "errors": self.errors}
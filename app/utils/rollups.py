@@ -0,0 +1,238 @@
+import logging
+import math
+from collections import defaultdict
+from datetime import timezone
+
+from sqlalchemy import case, delete, func
+
+from app.extensions import db
+from app.models.tutorial import SubTopicView, SubTopicAnalytics, SubTopicAnalyticsBucket
+from app.utils.db_utils import dialect_insert
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = ('hour', 'day')
+
+# Same inclusive bounds as the original ``between`` filters: 25% counts in both 0-25 and 25-50.
+SCROLL_BANDS = (
+    ('scroll_0_25', 0, 25),
+    ('scroll_25_50', 25, 50),
+    ('scroll_50_75', 50, 75),
+    ('scroll_75_100', 75, 100),
+)
+
+_BUCKET_COUNTERS = (
+    'views', 'time_spent_total', 'time_spent_samples',
+    'scroll_depth_total', 'scroll_depth_samples',
+) + tuple(name for name, _, _ in SCROLL_BANDS)
+
+
+def to_naive_utc(dt):
+    """Normalize a datetime to naive UTC, the convention used by the analytics tables."""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def bucket_start(dt, granularity):
+    """Truncate a datetime to the start of its hour or day bucket."""
+    dt = to_naive_utc(dt)
+    if granularity == 'hour':
+        return dt.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown granularity '{granularity}'")
+
+
+def _empty_counters():
+    return dict.fromkeys(_BUCKET_COUNTERS, 0)
+
+
+def aggregate_views(rows):
+    """
+    Fold view rows (dicts with subtopic_id, viewed_at, time_spent_seconds,
+    scroll_depth_percent) into per-bucket counter deltas.
+
+    Returns ``{(subtopic_id, granularity, bucket_start): counters}``.
+    """
+    buckets = defaultdict(_empty_counters)
+    for row in rows:
+        viewed_at = row.get('viewed_at')
+        if viewed_at is None:
+            continue
+        time_spent = row.get('time_spent_seconds')
+        scroll = row.get('scroll_depth_percent')
+
+        for granularity in GRANULARITIES:
+            counters = buckets[(row['subtopic_id'], granularity, bucket_start(viewed_at, granularity))]
+            counters['views'] += 1
+            if time_spent is not None:
+                counters['time_spent_total'] += time_spent
+                counters['time_spent_samples'] += 1
+            if scroll is not None:
+                counters['scroll_depth_total'] += scroll
+                counters['scroll_depth_samples'] += 1
+                for name, low, high in SCROLL_BANDS:
+                    if low <= scroll <= high:
+                        counters[name] += 1
+    return buckets
+
+
+def apply_view_rollups(rows):
+    """
+    Add a batch of freshly inserted views to the rollup tables.
+
+    Runs in the caller's transaction; the caller commits.
+    """
+    buckets = aggregate_views(rows)
+    if not buckets:
+        return
+
+    bucket_rows = [
+        dict(counters, subtopic_id=subtopic_id, granularity=granularity, bucket_start=start)
+        for (subtopic_id, granularity, start), counters in buckets.items()
+    ]
+    table = SubTopicAnalyticsBucket.__table__
+    stmt = dialect_insert(table).values(bucket_rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['subtopic_id', 'granularity', 'bucket_start'],
+        set_={name: table.c[name] + stmt.excluded[name] for name in _BUCKET_COUNTERS},
+    )
+    db.session.execute(stmt)
+
+    # Lifetime totals are the sum of the daily buckets of this batch.
+    totals = [
+        {
+            'subtopic_id': subtopic_id,
+            'total_views': counters['views'],
+            'total_time_spent': counters['time_spent_total'],
+            'time_spent_samples': counters['time_spent_samples'],
+            'scroll_depth_samples': counters['scroll_depth_samples'],
+            'average_scroll_depth': (
+                counters['scroll_depth_total'] / counters['scroll_depth_samples']
+                if counters['scroll_depth_samples'] else 0.0
+            ),
+        }
+        for subtopic_id, counters in _merge_days(buckets).items()
+    ]
+    table = SubTopicAnalytics.__table__
+    stmt = dialect_insert(table).values(totals)
+    old_samples = func.coalesce(table.c.scroll_depth_samples, 0)
+    new_samples = old_samples + stmt.excluded.scroll_depth_samples
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['subtopic_id'],
+        set_={
+            'total_views': func.coalesce(table.c.total_views, 0) + stmt.excluded.total_views,
+            'total_time_spent': func.coalesce(table.c.total_time_spent, 0) + stmt.excluded.total_time_spent,
+            'time_spent_samples': func.coalesce(table.c.time_spent_samples, 0) + stmt.excluded.time_spent_samples,
+            'scroll_depth_samples': new_samples,
+            'average_scroll_depth': case(
+                (new_samples > 0,
+                 (func.coalesce(table.c.average_scroll_depth, 0) * old_samples
+                  + stmt.excluded.average_scroll_depth * stmt.excluded.scroll_depth_samples) / new_samples),
+                else_=0.0,
+            ),
+        },
+    )
+    db.session.execute(stmt)
+
+
+def _merge_days(buckets):
+    """Collapse daily buckets into one counter set per subtopic."""
+    merged = defaultdict(_empty_counters)
+    for (subtopic_id, granularity, _), counters in buckets.items():
+        if granularity != 'day':
+            continue
+        target = merged[subtopic_id]
+        for name, value in counters.items():
+            target[name] += value
+    return merged
+
+
+def rebuild_rollups(chunk_size=5000):
+    """
+    Recompute all rollups from the raw SubTopicView table, in id-ordered chunks.
+    Returns the number of views processed.
+    """
+    db.session.execute(delete(SubTopicAnalyticsBucket))
+    db.session.execute(delete(SubTopicAnalytics))
+
+    processed = 0
+    last_id = 0
+    while True:
+        chunk = (
+            db.session.query(
+                SubTopicView.id,
+                SubTopicView.subtopic_id,
+                SubTopicView.viewed_at,
+                SubTopicView.time_spent_seconds,
+                SubTopicView.scroll_depth_percent,
+            )
+            .filter(SubTopicView.id > last_id)
+            .order_by(SubTopicView.id.asc())
+            .limit(chunk_size)
+            .all()
+        )
+        if not chunk:
+            break
+        apply_view_rollups([row._asdict() for row in chunk])
+        processed += len(chunk)
+        last_id = chunk[-1].id
+
+    db.session.commit()
+    return processed
+
+
+def verify_rollups(tolerance=1e-6):
+    """
+    Compare rollups against raw views per subtopic.
+    Returns a list of human-readable mismatch descriptions (empty when consistent).
+    """
+    raw = {
+        row.subtopic_id: row
+        for row in db.session.query(
+            SubTopicView.subtopic_id,
+            func.count(SubTopicView.id).label('views'),
+            func.coalesce(func.sum(SubTopicView.time_spent_seconds), 0).label('time_spent_total'),
+            func.count(SubTopicView.time_spent_seconds).label('time_spent_samples'),
+            func.count(SubTopicView.scroll_depth_percent).label('scroll_depth_samples'),
+            func.avg(SubTopicView.scroll_depth_percent).label('average_scroll_depth'),
+        )
+        .filter(SubTopicView.viewed_at.isnot(None))
+        .group_by(SubTopicView.subtopic_id)
+    }
+    totals = {row.subtopic_id: row for row in SubTopicAnalytics.query.all()}
+    bucket_sums = {
+        (row.subtopic_id, row.granularity): row
+        for row in db.session.query(
+            SubTopicAnalyticsBucket.subtopic_id,
+            SubTopicAnalyticsBucket.granularity,
+            func.sum(SubTopicAnalyticsBucket.views).label('views'),
+            func.sum(SubTopicAnalyticsBucket.time_spent_total).label('time_spent_total'),
+        ).group_by(SubTopicAnalyticsBucket.subtopic_id, SubTopicAnalyticsBucket.granularity)
+    }
+
+    def differs(a, b):
+        return not math.isclose(float(a or 0), float(b or 0), rel_tol=tolerance, abs_tol=tolerance)
+
+    problems = []
+    for subtopic_id in sorted(set(raw) | set(totals)):
+        expected = raw.get(subtopic_id)
+        actual = totals.get(subtopic_id)
+        if expected is None or actual is None:
+            problems.append(f"subtopic {subtopic_id}: present in {'raw views' if actual is None else 'rollups'} only")
+            continue
+        for field in ('total_views', 'total_time_spent', 'time_spent_samples',
+                      'scroll_depth_samples', 'average_scroll_depth'):
+            raw_field = {'total_views': 'views', 'total_time_spent': 'time_spent_total'}.get(field, field)
+            if differs(getattr(expected, raw_field), getattr(actual, field)):
+                problems.append(
+                    f"subtopic {subtopic_id}: {field} is {getattr(actual, field)}, "
+                    f"raw data gives {getattr(expected, raw_field)}"
+                )
+        for granularity in GRANULARITIES:
+            bucket = bucket_sums.get((subtopic_id, granularity))
+            if bucket is None or differs(bucket.views, expected.views) \
+                    or differs(bucket.time_spent_total, expected.time_spent_total):
+                problems.append(f"subtopic {subtopic_id}: {granularity} buckets do not add up to raw views")
+    return problems
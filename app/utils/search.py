@@ -0,0 +1,395 @@
+import html
+import logging
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from typing import NamedTuple
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+
+from app.extensions import db
+from app.models.tutorial import Topic, SubTopic
+from app.utils.content_cache import content_version
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_TAG_RE = re.compile(r"<[^>]+>")
+
+# Relative weight of a match in each indexed field.
+FIELD_WEIGHTS = (('title', 10.0), ('topic', 4.0), ('body', 1.0))
+
+
+class SearchDocument(NamedTuple):
+    kind: str  # 'topic' or 'subtopic'
+    ref_id: int
+    title: str
+    topic: str
+    body: str
+
+
+class SearchHit(NamedTuple):
+    kind: str
+    ref_id: int
+    score: float
+
+
+def tokenize(value):
+    """Lower-cased word tokens of a string."""
+    return _TOKEN_RE.findall((value or '').lower())
+
+
+def strip_html(value):
+    """Plain text of a Quill HTML body."""
+    return html.unescape(_TAG_RE.sub(' ', value or ''))
+
+
+def topic_document(topic):
+    return SearchDocument('topic', topic.id, topic.title, '', '')
+
+
+def subtopic_document(subtopic, topic_title):
+    return SearchDocument('subtopic', subtopic.id, subtopic.title, topic_title, strip_html(subtopic.content))
+
+
+def iter_documents(chunk_size=500):
+    """Yield the documents of every topic and every published subtopic."""
+    for topic in Topic.query.order_by(Topic.id).yield_per(chunk_size):
+        yield topic_document(topic)
+    rows = (
+        db.session.query(SubTopic, Topic.title)
+        .join(Topic, Topic.id == SubTopic.topic_id)
+        .filter(SubTopic.status == 'published')
+        .order_by(SubTopic.id)
+        .yield_per(chunk_size)
+    )
+    for subtopic, topic_title in rows:
+        yield subtopic_document(subtopic, topic_title)
+
+
+# ----------------------------
+# Backends
+# ----------------------------
+
+class MemorySearchBackend:
+    """
+    Pure-Python inverted index, used when the database has no full-text support.
+    Built from the database on first use and kept current by incremental updates;
+    each worker process holds its own copy, rebuilt when another process
+    changes the content (see SearchIndex.search).
+    """
+    name = 'memory'
+    persistent = False
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._documents = {}  # (kind, ref_id) -> {term: weight}
+        self._postings = defaultdict(dict)  # term -> {(kind, ref_id): weight}
+        self._vocabulary = []
+        self._vocabulary_dirty = False
+
+    def available(self):
+        return True
+
+    def upsert(self, documents):
+        with self._lock:
+            for doc in documents:
+                key = (doc.kind, doc.ref_id)
+                self._remove(key)
+                weights = defaultdict(float)
+                for field, weight in FIELD_WEIGHTS:
+                    for token in tokenize(getattr(doc, field)):
+                        weights[token] += weight
+                self._documents[key] = weights
+                for term, weight in weights.items():
+                    if term not in self._postings:
+                        self._vocabulary_dirty = True
+                    self._postings[term][key] = weight
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+            self._postings.clear()
+            self._vocabulary = []
+            self._vocabulary_dirty = False
+
+    def _remove(self, key):
+        for term in self._documents.pop(key, ()):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[term]
+                    self._vocabulary_dirty = True
+
+    def _expand(self, prefix):
+        """All indexed terms starting with ``prefix``."""
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_dirty = False
+        start = bisect_left(self._vocabulary, prefix)
+        terms = []
+        for term in self._vocabulary[start:]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def search(self, terms, limit, offset):
+        with self._lock:
+            total_docs = len(self._documents) or 1
+            scores = None
+            for prefix in terms:
+                term_scores = {}
+                for term in self._expand(prefix):
+                    postings = self._postings[term]
+                    idf = math.log(1 + total_docs / len(postings))
+                    for key, weight in postings.items():
+                        term_scores[key] = max(term_scores.get(key, 0.0), weight * idf)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {key: score + term_scores[key] for key, score in scores.items() if key in term_scores}
+                if not scores:
+                    return [], 0
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        hits = [SearchHit(kind, ref_id, score) for (kind, ref_id), score in ranked[offset:offset + limit]]
+        return hits, len(ranked)
+
+
+class SQLiteSearchBackend:
+    """SQLite FTS5 virtual table ranked with bm25."""
+    name = 'sqlite'
+    persistent = True
+    table = 'search_documents'
+
+    def available(self):
+        """Whether the FTS5 table exists (created by the migrations)."""
+        return inspect(db.engine).has_table(self.table)
+
+    def is_empty(self):
+        return db.session.execute(text(f"SELECT 1 FROM {self.table} LIMIT 1")).first() is None
+
+    @staticmethod
+    def _rowid(kind, ref_id):
+        # Deterministic rowid so updates and deletes are rowid lookups.
+        return ref_id * 2 + (1 if kind == 'subtopic' else 0)
+
+    def upsert(self, documents):
+        documents = list(documents)
+        if not documents:
+            return
+        self.delete([(doc.kind, doc.ref_id) for doc in documents])
+        db.session.execute(
+            text(f"INSERT INTO {self.table} (rowid, kind, ref_id, title, topic, body) "
+                 "VALUES (:rowid, :kind, :ref_id, :title, :topic, :body)"),
+            [dict(doc._asdict(), rowid=self._rowid(doc.kind, doc.ref_id)) for doc in documents],
+        )
+
+    def delete(self, keys):
+        keys = list(keys)
+        if keys:
+            db.session.execute(
+                text(f"DELETE FROM {self.table} WHERE rowid = :rowid"),
+                [{"rowid": self._rowid(kind, ref_id)} for kind, ref_id in keys],
+            )
+
+    def clear(self):
+        db.session.execute(text(f"DELETE FROM {self.table}"))
+
+    def search(self, terms, limit, offset):
+        match = ' '.join(f'"{term}"*' for term in terms)
+        weights = ', '.join(['0', '0'] + [str(weight) for _, weight in FIELD_WEIGHTS])
+        rows = db.session.execute(
+            text(f"SELECT kind, ref_id, bm25({self.table}, {weights}) AS rank FROM {self.table} "
+                 f"WHERE {self.table} MATCH :match ORDER BY rank, rowid LIMIT :limit OFFSET :offset"),
+            {"match": match, "limit": limit, "offset": offset},
+        ).all()
+        total = db.session.execute(
+            text(f"SELECT count(*) FROM {self.table} WHERE {self.table} MATCH :match"),
+            {"match": match},
+        ).scalar()
+        return [SearchHit(kind, int(ref_id), -rank) for kind, ref_id, rank in rows], total
+
+
+class PostgresSearchBackend:
+    """Weighted tsvector column with a GIN index, ranked with ts_rank."""
+    name = 'postgresql'
+    persistent = True
+    table = 'search_documents'
+
+    def available(self):
+        """Whether the documents table exists (created by the migrations)."""
+        return inspect(db.engine).has_table(self.table)
+
+    def is_empty(self):
+        return db.session.execute(text(f"SELECT 1 FROM {self.table} LIMIT 1")).first() is None
+
+    def upsert(self, documents):
+        documents = [doc._asdict() for doc in documents]
+        if documents:
+            db.session.execute(
+                text(f"INSERT INTO {self.table} (kind, ref_id, title, topic, body) "
+                     "VALUES (:kind, :ref_id, :title, :topic, :body) "
+                     "ON CONFLICT (kind, ref_id) DO UPDATE SET "
+                     "title = EXCLUDED.title, topic = EXCLUDED.topic, body = EXCLUDED.body"),
+                documents,
+            )
+
+    def delete(self, keys):
+        keys = [{"kind": kind, "ref_id": ref_id} for kind, ref_id in keys]
+        if keys:
+            db.session.execute(
+                text(f"DELETE FROM {self.table} WHERE kind = :kind AND ref_id = :ref_id"), keys
+            )
+
+    def clear(self):
+        db.session.execute(text(f"DELETE FROM {self.table}"))
+
+    def search(self, terms, limit, offset):
+        query = ' & '.join(f"{term}:*" for term in terms)
+        rows = db.session.execute(
+            text(f"SELECT kind, ref_id, ts_rank(document, q) AS rank "
+                 f"FROM {self.table}, to_tsquery('english', :query) AS q "
+                 "WHERE document @@ q ORDER BY rank DESC, kind, ref_id LIMIT :limit OFFSET :offset"),
+            {"query": query, "limit": limit, "offset": offset},
+        ).all()
+        total = db.session.execute(
+            text(f"SELECT count(*) FROM {self.table} WHERE document @@ to_tsquery('english', :query)"),
+            {"query": query},
+        ).scalar()
+        return [SearchHit(kind, ref_id, float(rank)) for kind, ref_id, rank in rows], total
+
+
+# ----------------------------
+# Facade
+# ----------------------------
+
+class SearchIndex:
+    """
+    Full-text index over topic titles and published subtopics.
+
+    The backend is picked from SEARCH_BACKEND ('auto', 'sqlite', 'postgresql'
+    or 'memory'); 'auto' uses the database's native full-text search and falls
+    back to the in-memory index. Update failures are logged rather than raised
+    so that content writes never fail because of search.
+    """
+
+    def __init__(self):
+        self.backend = MemorySearchBackend()
+        self._ready = False
+        self._version = None  # shared content version the in-memory index was built at
+
+    def init_app(self, app):
+        choice = app.config.get('SEARCH_BACKEND', 'auto')
+        with app.app_context():
+            dialect = db.engine.dialect.name
+            if choice == 'auto':
+                choice = dialect if dialect in ('sqlite', 'postgresql') else 'memory'
+            backend = {
+                'sqlite': SQLiteSearchBackend,
+                'postgresql': PostgresSearchBackend,
+            }.get(choice, MemorySearchBackend)()
+
+            try:
+                available = backend.available()
+            except OperationalError:
+                available = False
+            if not available:
+                logger.warning("No full-text search table on %s (run `flask db upgrade`), using in-memory index",
+                               dialect)
+                backend = MemorySearchBackend()
+
+            self.backend = backend
+            self._ready = backend.persistent
+            # The migrations create the table empty; fill it from the existing content.
+            if backend.persistent and backend.is_empty():
+                if inspect(db.engine).has_table(Topic.__tablename__):
+                    self.rebuild()
+                else:
+                    self._ready = False  # Not migrated yet; built on first search.
+        app.extensions['search_index'] = self
+
+    def rebuild(self, chunk_size=500):
+        """Re-index all content from scratch. Returns the number of documents indexed."""
+        # Read before indexing so that a write made meanwhile triggers another rebuild.
+        version = content_version()[0]
+        self.backend.clear()
+        count = 0
+        chunk = []
+        for document in iter_documents(chunk_size):
+            chunk.append(document)
+            if len(chunk) >= chunk_size:
+                self.backend.upsert(chunk)
+                count += len(chunk)
+                chunk = []
+        self.backend.upsert(chunk)
+        count += len(chunk)
+        if self.backend.persistent:
+            db.session.commit()
+        self._ready = True
+        self._version = version
+        return count
+
+    def _apply(self, upserts=(), deletes=()):
+        if not self._ready:
+            return  # The in-memory index picks these up when it is first built.
+        try:
+            self.backend.delete(deletes)
+            self.backend.upsert(upserts)
+            if self.backend.persistent:
+                db.session.commit()
+        except Exception:
+            if self.backend.persistent:
+                db.session.rollback()
+            logger.error("Failed to update the search index", exc_info=True)
+
+    def update_topic(self, topic):
+        """Re-index a topic and its published subtopics (they carry the topic title)."""
+        subtopics = [st for st in topic.subtopics if st.status == 'published']
+        self._apply(upserts=[topic_document(topic)] + [subtopic_document(st, topic.title) for st in subtopics])
+
+    def update_subtopic(self, subtopic):
+        """Index a published subtopic, or drop it from the index if it is a draft."""
+        if subtopic.status == 'published':
+            self._apply(upserts=[subtopic_document(subtopic, subtopic.topic.title)])
+        else:
+            self._apply(deletes=[('subtopic', subtopic.id)])
+
+    def remove_topic(self, topic_id, subtopic_ids=()):
+        self._apply(deletes=[('topic', topic_id)] + [('subtopic', sid) for sid in subtopic_ids])
+
+    def remove_subtopic(self, subtopic_id):
+        self._apply(deletes=[('subtopic', subtopic_id)])
+
+    def search(self, query, limit=20, offset=0):
+        """
+        Ranked search; every word of ``query`` must match, as a prefix.
+        Returns (hits, total number of matches).
+        """
+        terms = tokenize(query)
+        if not terms:
+            return [], 0
+        if not self._ready or self._stale():
+            self.rebuild()
+        return self.backend.search(terms, limit, offset)
+
+    def _stale(self):
+        """
+        Whether the in-memory index misses content written by another process:
+        incremental updates only reach the process that made the write, so it
+        is rebuilt once the shared content version moved on.
+        """
+        return not self.backend.persistent and content_version()[0] != self._version
+
+
+search_index = SearchIndex()
@@ -0,0 +1,30 @@
+from datetime import datetime, time, timedelta
+
+
+def utc_now():
+    """Current time as naive UTC, the convention used by the timestamp columns."""
+    return datetime.utcnow()
+
+
+def start_of_day(day):
+    """Midnight at the start of a date (or of the date part of a datetime)."""
+    if isinstance(day, datetime):
+        day = day.date()
+    return datetime.combine(day, time.min)
+
+
+def day_range(first_day, last_day):
+    """
+    Half-open ``[start, end)`` timestamp range covering whole days from
+    ``first_day`` to ``last_day`` inclusive.
+
+    Filtering with ``column >= start, column < end`` keeps the column bare so
+    an index on it can be used, unlike ``func.date(column) == day``.
+    """
+    return start_of_day(first_day), start_of_day(last_day) + timedelta(days=1)
+
+
+def last_days(days, today=None):
+    """Half-open range from ``days`` days before today up to the end of today."""
+    today = today or utc_now().date()
+    return day_range(today - timedelta(days=days), today)
@@ -0,0 +1,139 @@
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, literal_column
+
+from app.extensions import db
+from app.utils.cache import TTLCache
+from app.utils.db_utils import dialect_name
+from app.utils.rollups import to_naive_utc
+from app.utils.time_ranges import utc_now
+
+GRANULARITIES = ('hour', 'day', 'week', 'month')
+
+# (series name, granularity, bucket start) -> measures of a closed bucket.
+# TTL set from TIMESERIES_CACHE_TTL in create_app.
+closed_bucket_cache = TTLCache(maxsize=20000, ttl=3600)
+
+
+def truncate(dt, granularity):
+    """Start of the hour/day/week (Monday)/month bucket containing ``dt``."""
+    if isinstance(dt, date) and not isinstance(dt, datetime):
+        dt = datetime.combine(dt, datetime.min.time())
+    dt = to_naive_utc(dt)
+    if granularity == 'hour':
+        return dt.replace(minute=0, second=0, microsecond=0)
+    day = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        return day
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    raise ValueError(f"Unknown granularity '{granularity}'")
+
+
+def next_bucket(start, granularity):
+    """Start of the bucket following the one starting at ``start``."""
+    if granularity == 'hour':
+        return start + timedelta(hours=1)
+    if granularity == 'day':
+        return start + timedelta(days=1)
+    if granularity == 'week':
+        return start + timedelta(weeks=1)
+    if granularity == 'month':
+        return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    raise ValueError(f"Unknown granularity '{granularity}'")
+
+
+def bucket_starts(start, end, granularity):
+    """Every bucket start in ``[truncate(start), end)``."""
+    buckets = []
+    current = truncate(start, granularity)
+    while current < end:
+        buckets.append(current)
+        current = next_bucket(current, granularity)
+    return buckets
+
+
+def bucket_expression(column, granularity):
+    """SQL expression truncating a timestamp column to its bucket start."""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity '{granularity}'")
+    if dialect_name() == 'postgresql':
+        return func.date_trunc(literal_column(f"'{granularity}'"), column)
+    # SQLite: text in the same 'YYYY-MM-DD HH:MM:SS' shape for every granularity
+    if granularity == 'hour':
+        return func.strftime('%Y-%m-%d %H:00:00', column)
+    if granularity == 'day':
+        return func.strftime('%Y-%m-%d 00:00:00', column)
+    if granularity == 'week':
+        # Next Sunday (or today if Sunday), then back to its Monday
+        return func.strftime('%Y-%m-%d 00:00:00', column, 'weekday 0', '-6 days')
+    return func.strftime('%Y-%m-01 00:00:00', column)
+
+
+def _parse_bucket(value):
+    if isinstance(value, datetime):
+        return to_naive_utc(value)
+    if isinstance(value, date):
+        return datetime.combine(value, datetime.min.time())
+    return datetime.fromisoformat(value)
+
+
+class TimeSeries:
+    """
+    Dense, gap-filled aggregates of a timestamp column.
+
+    ``measures`` maps output names to SQL aggregate expressions. ``fetch``
+    runs one grouped query over a half-open range and returns a value for
+    every bucket, with zeros where there is no data. Buckets that ended
+    before now are cached, so repeated calls only query the open bucket.
+    """
+
+    def __init__(self, name, column, measures, filters=()):
+        self.name = name
+        self.column = column
+        self.measures = measures
+        self.filters = tuple(filters)
+
+    def fetch(self, start, end, granularity='day', now=None):
+        """
+        Return ``[(bucket_start, {measure: value})]`` for every bucket from
+        the one containing ``start`` up to ``end`` (exclusive).
+        """
+        now = now or utc_now()
+        buckets = bucket_starts(start, end, granularity)
+        values = {}
+        missing_from = None
+        for bucket in buckets:
+            cached = closed_bucket_cache.get((self.name, granularity, bucket))
+            if cached is None:
+                missing_from = bucket
+                break
+            values[bucket] = cached
+
+        if missing_from is not None:
+            fetched = self._query(missing_from, end, granularity)
+            zero = dict.fromkeys(self.measures, 0)
+            for bucket in buckets:
+                if bucket < missing_from:
+                    continue
+                values[bucket] = fetched.get(bucket, zero)
+                # Only whole buckets that can no longer change are cached
+                if next_bucket(bucket, granularity) <= min(now, end):
+                    closed_bucket_cache.set((self.name, granularity, bucket), values[bucket])
+
+        return [(bucket, values[bucket]) for bucket in buckets]
+
+    def _query(self, start, end, granularity):
+        bucket = bucket_expression(self.column, granularity).label('bucket')
+        rows = (
+            db.session.query(bucket, *(expr.label(name) for name, expr in self.measures.items()))
+            .filter(self.column >= start, self.column < end, *self.filters)
+            .group_by(bucket)
+            .all()
+        )
+        return {
+            _parse_bucket(row.bucket): {name: getattr(row, name) or 0 for name in self.measures}
+            for row in rows
+        }
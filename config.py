@@ -18,6 +18,87 @@ class Config:
     JWT_COOKIE_CSRF_PROTECT = False
     WTF_CSRF_ENABLED = False
 
+    # Seconds a user's role set may be reused across requests; 0 disables the cache.
+    # Changes are only invalidated in the process that made them, so keep this short.
+    AUTH_IDENTITY_CACHE_TTL = int(os.getenv('AUTH_IDENTITY_CACHE_TTL', 0))
+
+    # Embed user id, role names and token version in JWTs so authorization needs no database hit.
+    JWT_EMBED_ROLES = os.getenv('JWT_EMBED_ROLES', 'false').lower() == 'true'
+    # Seconds a user's token version is trusted from memory before re-reading it.
+    JWT_TOKEN_VERSION_CACHE_TTL = int(os.getenv('JWT_TOKEN_VERSION_CACHE_TTL', 60))
+
+    # Subtopic view ingestion: "sync" writes each view on the request thread,
+    # "buffered" queues views and flushes them in batches from a background thread.
+    ANALYTICS_INGEST_MODE = os.getenv('ANALYTICS_INGEST_MODE', 'sync')
+    ANALYTICS_INGEST_QUEUE_SIZE = int(os.getenv('ANALYTICS_INGEST_QUEUE_SIZE', 10000))
+    ANALYTICS_INGEST_BATCH_SIZE = int(os.getenv('ANALYTICS_INGEST_BATCH_SIZE', 500))
+    ANALYTICS_INGEST_FLUSH_INTERVAL = float(os.getenv('ANALYTICS_INGEST_FLUSH_INTERVAL', 1.0))
+
+    # GeoIP/User-Agent enrichment of sessions: "sync" parses on the request thread,
+    # "async" stores the raw IP/UA and fills country/browser/os/device in background batches.
+    ENRICHMENT_MODE = os.getenv('ENRICHMENT_MODE', 'sync')
+    ENRICHMENT_QUEUE_SIZE = int(os.getenv('ENRICHMENT_QUEUE_SIZE', 10000))
+    ENRICHMENT_BATCH_SIZE = int(os.getenv('ENRICHMENT_BATCH_SIZE', 200))
+    ENRICHMENT_FLUSH_INTERVAL = float(os.getenv('ENRICHMENT_FLUSH_INTERVAL', 0.5))
+    # Distinct User-Agent strings whose parsed classification is kept in memory
+    USER_AGENT_CACHE_SIZE = int(os.getenv('USER_AGENT_CACHE_SIZE', 2048))
+
+    # GeoLite2 databases (default: app/data). Country is preferred when present; the
+    # database is opened lazily and lookups degrade to "Unknown" if neither exists.
+    GEOIP_COUNTRY_DB = os.getenv('GEOIP_COUNTRY_DB')
+    GEOIP_CITY_DB = os.getenv('GEOIP_CITY_DB')
+    GEOIP_CACHE_SIZE = int(os.getenv('GEOIP_CACHE_SIZE', 4096))
+
+    # Seconds the dashboard metrics (/analytics/metrics, /engagement-summary) are cached per process
+    METRICS_CACHE_TTL = int(os.getenv('METRICS_CACHE_TTL', 5))
+    # Seconds a device/OS/browser/country breakdown (/analytics/views/stats) is cached per range
+    VIEW_STATS_CACHE_TTL = int(os.getenv('VIEW_STATS_CACHE_TTL', 60))
+
+    # Users without audit activity for this many days are listed by /audit/inactive-users
+    INACTIVE_USER_DAYS = int(os.getenv('INACTIVE_USER_DAYS', 14))
+
+    # Seconds a closed (past) time-series bucket is reused before being recomputed
+    TIMESERIES_CACHE_TTL = int(os.getenv('TIMESERIES_CACHE_TTL', 3600))
+
+    # Admin last-activity heartbeats are written at most once per ACTIVITY_GRANULARITY seconds per user.
+    # "sync" writes on the request thread; "coalesced" keeps the latest timestamp per user in memory
+    # and writes them all in one UPDATE every ACTIVITY_FLUSH_INTERVAL seconds and at shutdown.
+    ACTIVITY_TRACKING_MODE = os.getenv('ACTIVITY_TRACKING_MODE', 'sync')
+    ACTIVITY_FLUSH_INTERVAL = float(os.getenv('ACTIVITY_FLUSH_INTERVAL', 5.0))
+    ACTIVITY_GRANULARITY = int(os.getenv('ACTIVITY_GRANULARITY', 60))
+    # Same for the last_seen heartbeat of analytics sessions (/analytics/session/start revisits)
+    SESSION_ACTIVITY_TRACKING_MODE = os.getenv('SESSION_ACTIVITY_TRACKING_MODE', 'sync')
+    SESSION_ACTIVITY_FLUSH_INTERVAL = float(os.getenv('SESSION_ACTIVITY_FLUSH_INTERVAL', 5.0))
+    SESSION_ACTIVITY_GRANULARITY = int(os.getenv('SESSION_ACTIVITY_GRANULARITY', 60))
+
+    # Audit events: "transaction" writes them with the caller's commit; "async" spools them and
+    # bulk-inserts them in the background. Each process spools to <name>.<pid>.<n>.jsonl segments, rotated every
+    # AUDIT_BATCH_SIZE events, next to AUDIT_SPOOL_PATH (default: instance/audit-spool.jsonl), deleted
+    # once written; segments of stopped processes are replayed at startup.
+    AUDIT_SINK_MODE = os.getenv('AUDIT_SINK_MODE', 'transaction')
+    AUDIT_SPOOL_PATH = os.getenv('AUDIT_SPOOL_PATH')
+    AUDIT_QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', 10000))
+    AUDIT_BATCH_SIZE = int(os.getenv('AUDIT_BATCH_SIZE', 200))
+    AUDIT_FLUSH_INTERVAL = float(os.getenv('AUDIT_FLUSH_INTERVAL', 1.0))
+
+    # In-memory cache mapping client session ids to Session primary keys
+    SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', 10000))
+    SESSION_CACHE_TTL = int(os.getenv('SESSION_CACHE_TTL', 3600))
+
+    # Full-text search backend: "auto" (SQLite FTS5 / PostgreSQL tsvector), "memory", "sqlite" or "postgresql".
+    # "memory" keeps an index per process and rebuilds it after content changes made by other processes.
+    SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'auto')
+
+    # Rows per multi-row INSERT in the bulk quiz import (/topics/quizzes/import)
+    QUIZ_IMPORT_CHUNK_SIZE = int(os.getenv('QUIZ_IMPORT_CHUNK_SIZE', 1000))
+
+    # Seconds a process trusts its copy of the shared content version before re-reading it;
+    # content written by another process shows up in the sidebar/navigation caches within this delay.
+    CONTENT_VERSION_CACHE_TTL = float(os.getenv('CONTENT_VERSION_CACHE_TTL', 1.0))
+
+    # Topic detail responses with more subtopics than this are streamed
+    TOPIC_DETAIL_STREAM_THRESHOLD = int(os.getenv('TOPIC_DETAIL_STREAM_THRESHOLD', 200))
+
 class DevelopmentConfig(Config):
     DEBUG = True
 
@@ -26,3 +107,8 @@ class TestingConfig(Config):
     DEBUG = False
     SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'  # In-memory DB for tests
     JWT_COOKIE_SECURE = False  # Testing usually runs without HTTPS
+    ANALYTICS_INGEST_MODE = 'sync'
+    ENRICHMENT_MODE = 'sync'
+    ACTIVITY_TRACKING_MODE = 'sync'
+    SESSION_ACTIVITY_TRACKING_MODE = 'sync'
+    AUDIT_SINK_MODE = 'transaction'
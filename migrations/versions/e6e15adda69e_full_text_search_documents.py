@@ -0,0 +1,55 @@
+"""full-text search documents
+
+Revision ID: e6e15adda69e
+Revises: 79ad888681af
+Create Date: 2026-10-18 17:02:41.318204
+
+"""
+import logging
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6e15adda69e'
+down_revision = '79ad888681af'
+branch_labels = None
+depends_on = None
+
+logger = logging.getLogger('alembic.runtime.migration')
+
+
+def upgrade():
+    # Dialect-specific, so written by hand and left out of autogenerate (see env.py).
+    # The table starts empty; app.utils.search fills it when the app starts.
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        try:
+            op.execute(
+                "CREATE VIRTUAL TABLE search_documents USING fts5("
+                "kind UNINDEXED, ref_id UNINDEXED, title, topic, body, "
+                "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+        except sa.exc.OperationalError:
+            logger.warning("SQLite has no FTS5; search will use the in-memory index")
+    elif dialect == 'postgresql':
+        op.execute(
+            "CREATE TABLE search_documents ("
+            "kind VARCHAR(16) NOT NULL, ref_id INTEGER NOT NULL, "
+            "title TEXT NOT NULL DEFAULT '', topic TEXT NOT NULL DEFAULT '', body TEXT NOT NULL DEFAULT '', "
+            "document tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('english', title), 'A') || "
+            "setweight(to_tsvector('english', topic), 'B') || "
+            "setweight(to_tsvector('english', body), 'C')) STORED, "
+            "PRIMARY KEY (kind, ref_id))"
+        )
+        op.execute("CREATE INDEX ix_search_documents_document ON search_documents USING GIN (document)")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_search_documents_document")
+    if dialect in ('sqlite', 'postgresql'):
+        op.execute("DROP TABLE IF EXISTS search_documents")
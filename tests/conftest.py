@@ -2,6 +2,12 @@ import pytest
 from app import create_app, db as _db
 from sqlalchemy.orm import scoped_session, sessionmaker
 from app.models.user import Role
+from app.utils.activity import activity_tracker, session_activity
+from app.auth.utils import identity_cache, token_version_cache
+from app.utils.content_cache import invalidate_content_caches
+from app.utils.logging_utils import session_id_cache
+from app.utils.metrics import breakdown_cache, metrics_cache
+from app.utils.timeseries import closed_bucket_cache
 
 @pytest.fixture(scope='session')
 def app():
@@ -37,6 +43,21 @@ def session(db):
     connection.close()
     session.remove()
 
+@pytest.fixture(autouse=True)
+def reset_caches():
+    # Each test rolls its data back, so nothing cached by a previous test is valid.
+    invalidate_content_caches()
+    session_id_cache.clear()
+    identity_cache.clear()
+    token_version_cache.clear()
+    metrics_cache.clear()
+    breakdown_cache.clear()
+    closed_bucket_cache.clear()
+    activity_tracker.recent.clear()
+    session_activity.recent.clear()
+    yield
+
+
 @pytest.fixture
 def client(app):
     return app.test_client()
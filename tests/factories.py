@@ -7,7 +7,7 @@ from app.extensions import db
 class RoleFactory(factory.alchemy.SQLAlchemyModelFactory):
     class Meta:
         model = Role
-        sqlalchemy_session = db.session
+        sqlalchemy_session_factory = lambda: db.session
         sqlalchemy_session_persistence = 'commit'
 
     name = factory.Sequence(lambda n: f"role{n}")
@@ -16,7 +16,7 @@ class RoleFactory(factory.alchemy.SQLAlchemyModelFactory):
 class UserFactory(factory.alchemy.SQLAlchemyModelFactory):
     class Meta:
         model = User
-        sqlalchemy_session = db.session
+        sqlalchemy_session_factory = lambda: db.session
         sqlalchemy_session_persistence = 'commit'
 
     username = factory.Sequence(lambda n: f"user{n}")
@@ -39,7 +39,7 @@ class UserFactory(factory.alchemy.SQLAlchemyModelFactory):
 class TopicFactory(factory.alchemy.SQLAlchemyModelFactory):
     class Meta:
         model = Topic
-        sqlalchemy_session = db.session
+        sqlalchemy_session_factory = lambda: db.session
         sqlalchemy_session_persistence = 'commit'
 
     title = factory.Sequence(lambda n: f"Topic {n}")
@@ -48,7 +48,7 @@ class TopicFactory(factory.alchemy.SQLAlchemyModelFactory):
 class SubTopicFactory(factory.alchemy.SQLAlchemyModelFactory):
     class Meta:
         model = SubTopic
-        sqlalchemy_session = db.session
+        sqlalchemy_session_factory = lambda: db.session
         sqlalchemy_session_persistence = 'commit'
 
     title = factory.Sequence(lambda n: f"SubTopic {n}")
@@ -59,7 +59,7 @@ class SubTopicFactory(factory.alchemy.SQLAlchemyModelFactory):
 class QuizFactory(factory.alchemy.SQLAlchemyModelFactory):
     class Meta:
         model = Quiz
-        sqlalchemy_session = db.session
+        sqlalchemy_session_factory = lambda: db.session
         sqlalchemy_session_persistence = 'commit'
 
     question = factory.Sequence(lambda n: f"Question {n+1}")
@@ -0,0 +1,538 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event, func
+
+from app.cli import analytics_cli
+from app.models.log import AuditLog, LoginDeviceCounter, SessionLog
+from app.models.tutorial import DailyMetrics, Session, SubTopicView, SubTopicAnalytics
+from app.utils.activity import write_session_last_seen
+from app.utils.batching import BatchWriter, CoalescingWriter
+from app.utils.enrichment import EnrichmentJob, classify_user_agent, user_agent_cache, write_enrichment
+from app.utils.geoip import GeoLookup
+from app.utils.ingestion import view_ingestor, write_views
+from app.utils.metrics import metrics_cache
+from app.utils.time_ranges import last_days
+from app.utils.timeseries import TimeSeries
+from tests.factories import SubTopicFactory
+
+
+def start_session(client, session_id):
+    resp = client.post('/api/v1/analytics/session/start', json={'session_id': session_id})
+    assert resp.status_code in (200, 201)
+
+
+def test_record_subtopic_view(client, db):
+    subtopic = SubTopicFactory(status='published')
+    start_session(client, 'sess-view-1')
+
+    resp = client.post('/api/v1/analytics/subtopic/view', json={
+        'session_id': 'sess-view-1',
+        'subtopic_id': subtopic.id,
+        'time_spent_seconds': 42.5,
+        'scroll_depth_percent': 80,
+    })
+    assert resp.status_code == 201
+    view = SubTopicView.query.filter_by(subtopic_id=subtopic.id).one()
+    assert view.time_spent_seconds == 42.5
+    assert view.scroll_depth_percent == 80
+
+
+def test_record_subtopic_view_validation(client, db):
+    resp = client.post('/api/v1/analytics/subtopic/view', json={'session_id': 'x'})
+    assert resp.status_code == 400
+    assert resp.get_json()['error'] == 'subtopic_id: Missing data for required field.'
+
+    resp = client.post('/api/v1/analytics/subtopic/view', json={
+        'session_id': 'unknown-session', 'subtopic_id': 1
+    })
+    assert resp.status_code == 404
+
+
+def test_record_subtopic_view_buffered_back_pressure(client, db, monkeypatch):
+    subtopic = SubTopicFactory(status='published')
+    start_session(client, 'sess-buffered-1')
+    writer = BatchWriter('test-views', lambda rows: None, maxsize=1)  # never started: nothing drains
+    monkeypatch.setattr(view_ingestor, '_writer', writer)
+    view = {'session_id': 'sess-buffered-1', 'subtopic_id': subtopic.id, 'time_spent_seconds': 5}
+
+    resp = client.post('/api/v1/analytics/subtopic/view', json=view)
+    assert resp.status_code == 202
+    assert writer.qsize() == 1
+    assert SubTopicView.query.filter_by(subtopic_id=subtopic.id).count() == 0
+
+    resp = client.post('/api/v1/analytics/subtopic/view', json=view)
+    assert resp.status_code == 503
+    assert resp.headers['Retry-After'] == '1'
+    assert 'error' in resp.get_json()
+    assert writer.stats['rejected'] == 1
+
+
+def test_top_contents_served_from_rollups(client, db, auth_headers):
+    subtopic = SubTopicFactory(status='published')
+    start_session(client, 'sess-rollup-1')
+    for time_spent, scroll in [(30, 10), (90, 60), (None, None)]:
+        resp = client.post('/api/v1/analytics/subtopic/view', json={
+            'session_id': 'sess-rollup-1',
+            'subtopic_id': subtopic.id,
+            'time_spent_seconds': time_spent,
+            'scroll_depth_percent': scroll,
+        })
+        assert resp.status_code == 201
+
+    totals = SubTopicAnalytics.query.filter_by(subtopic_id=subtopic.id).one()
+    assert totals.total_views == 3
+    assert totals.total_time_spent == 120
+    assert totals.average_scroll_depth == 35
+
+    resp = client.get('/api/v1/analytics/top-contents?range=daily', headers=auth_headers)
+    assert resp.status_code == 200
+    row = next(v for v in resp.get_json()['views'] if v['subtopic_title'] == subtopic.title)
+    assert row['views'] == 3
+    assert row['avg_time_spent_seconds'] == 60
+    assert row['scroll_distribution'] == {'0-25%': 1, '25-50%': 0, '50-75%': 1, '75-100%': 0}
+
+
+def test_top_contents_window_is_exact(client, db, auth_headers):
+    subtopic = SubTopicFactory(status='published')
+    session = Session(session_id='sess-window-1')
+    db.session.add(session)
+    db.session.flush()
+    now = datetime.utcnow()
+    week_ago = now - timedelta(weeks=1)
+    write_views([
+        {'subtopic_id': subtopic.id, 'session_id': session.id, 'viewed_at': viewed_at,
+         'time_spent_seconds': time_spent, 'scroll_depth_percent': 30}
+        for viewed_at, time_spent in [
+            (week_ago - timedelta(minutes=5), 1000),  # before the window, maybe in its first day bucket
+            (week_ago + timedelta(minutes=5), 10),    # in the window's partial first bucket
+            (now - timedelta(minutes=1), 20),
+        ]
+    ])
+
+    resp = client.get('/api/v1/analytics/top-contents?range=weekly', headers=auth_headers)
+    row = next(v for v in resp.get_json()['views'] if v['subtopic_title'] == subtopic.title)
+    assert row['views'] == 2
+    assert row['avg_time_spent_seconds'] == 15
+    assert row['scroll_distribution']['25-50%'] == 2
+
+
+def test_rollup_cli_verify_and_rebuild(app, client, db):
+    subtopic = SubTopicFactory(status='published')
+    start_session(client, 'sess-rollup-2')
+    client.post('/api/v1/analytics/subtopic/view', json={
+        'session_id': 'sess-rollup-2', 'subtopic_id': subtopic.id, 'time_spent_seconds': 5,
+    })
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(analytics_cli, ['verify-rollups'])
+    assert result.exit_code == 0, result.output
+
+    SubTopicAnalytics.query.filter_by(subtopic_id=subtopic.id).one().total_views = 7
+    db.session.commit()
+    result = runner.invoke(analytics_cli, ['verify-rollups'])
+    assert result.exit_code == 1
+    assert 'total_views' in result.output
+
+    result = runner.invoke(analytics_cli, ['rebuild-rollups'])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(analytics_cli, ['verify-rollups'])
+    assert result.exit_code == 0, result.output
+
+
+def test_trend_endpoints_are_gap_filled(client, db, auth_headers):
+    subtopic = SubTopicFactory(status='published')
+    start_session(client, 'sess-trend-1')
+    client.post('/api/v1/analytics/subtopic/view', json={
+        'session_id': 'sess-trend-1', 'subtopic_id': subtopic.id, 'time_spent_seconds': 12,
+    })
+
+    data = client.get('/api/v1/analytics/daily-trends?range=7d', headers=auth_headers).get_json()
+    assert len(data['labels']) == 8
+    assert data['views'][-1] == 1 and sum(data['views']) == 1
+    assert data['users'][-1] == 1 and data['time_spent'][-1] == 12
+
+    data = client.get('/api/v1/audit/login-trend', headers=auth_headers).get_json()
+    assert len(data['labels']) == len(data['data']) == 30
+    assert data['data'][-1] >= 1  # the login behind auth_headers
+
+
+def test_view_stats_single_pass_with_range_and_top(client, db):
+    subtopic = SubTopicFactory(status='published')
+    sessions = [
+        Session(session_id=f'sess-stats-{i}', browser=browser, os='Linux', device_type='Desktop', country=None)
+        for i, browser in enumerate(['Firefox', 'Firefox', 'Chrome', 'Safari', 'Edge'])
+    ]
+    db.session.add_all(sessions)
+    db.session.flush()
+    now = datetime.utcnow()
+    for session in sessions:
+        db.session.add(SubTopicView(subtopic_id=subtopic.id, session_id=session.id, viewed_at=now))
+    # Outside the 7 day range
+    db.session.add(SubTopicView(subtopic_id=subtopic.id, session_id=sessions[2].id,
+                                viewed_at=now - timedelta(days=30)))
+    db.session.commit()
+
+    data = client.get('/api/v1/analytics/views/stats?range=7d&top=2').get_json()
+    assert data['browser'] == [
+        {'key': 'Firefox', 'views': 2}, {'key': 'Chrome', 'views': 1}, {'key': 'Other', 'views': 2}
+    ]
+    assert data['os'] == [{'key': 'Linux', 'views': 5}]
+    assert data['country'] == [{'key': 'Unknown', 'views': 5}]
+
+    data = client.get('/api/v1/analytics/views/stats?range=90d').get_json()
+    assert {'key': 'Chrome', 'views': 2} in data['browser']
+    assert client.get('/api/v1/analytics/views/stats?top=0').status_code == 400
+
+
+def test_view_stats_top_merges_parser_other(client, db):
+    # user_agents reports unrecognised browser families as "Other"
+    subtopic = SubTopicFactory(status='published')
+    browsers = ['Other', 'Other', 'Other', 'Firefox', 'Firefox', 'Chrome', 'Safari']
+    sessions = [Session(session_id=f'sess-other-{i}', browser=browser) for i, browser in enumerate(browsers)]
+    db.session.add_all(sessions)
+    db.session.flush()
+    now = datetime.utcnow()
+    db.session.add_all(SubTopicView(subtopic_id=subtopic.id, session_id=s.id, viewed_at=now) for s in sessions)
+    db.session.commit()
+
+    data = client.get('/api/v1/analytics/views/stats?range=7d&top=1').get_json()
+    assert data['browser'] == [{'key': 'Firefox', 'views': 2}, {'key': 'Other', 'views': 5}]
+
+    data = client.get('/api/v1/analytics/views/stats?range=7d&top=3').get_json()
+    assert data['browser'] == [
+        {'key': 'Firefox', 'views': 2}, {'key': 'Chrome', 'views': 1}, {'key': 'Safari', 'views': 1},
+        {'key': 'Other', 'views': 3},
+    ]
+
+
+def test_dashboard_metrics_served_from_daily_metrics(app, client, db, auth_headers):
+    subtopic = SubTopicFactory(status='published')
+    start_session(client, 'sess-metrics-1')
+    start_session(client, 'sess-metrics-2')
+    start_session(client, 'sess-metrics-1')  # revisit, not a new session
+    for session_id in ('sess-metrics-1', 'sess-metrics-1', 'sess-metrics-2'):
+        client.post('/api/v1/analytics/subtopic/view', json={
+            'session_id': session_id, 'subtopic_id': subtopic.id, 'time_spent_seconds': 10,
+        })
+
+    metrics = client.get('/api/v1/analytics/metrics', headers=auth_headers).get_json()
+    assert metrics['users'] == 2
+    assert metrics['new_users_today'] == 2
+    assert metrics['views_today'] == 3
+    today = DailyMetrics.query.one()
+    assert (today.unique_sessions, today.time_spent_total) == (2, 30)
+
+    summary = client.get('/api/v1/analytics/engagement-summary', headers=auth_headers).get_json()
+    assert summary['unique_visitors'] == 2
+    assert summary['peak_hour_range'] != 'N/A' and summary['peak_day'] != 'N/A'
+
+    result = app.test_cli_runner().invoke(analytics_cli, ['rebuild-daily-metrics'])
+    assert result.exit_code == 0, result.output
+    metrics_cache.clear()
+    assert client.get('/api/v1/analytics/metrics', headers=auth_headers).get_json() == metrics
+    assert DailyMetrics.query.one().unique_sessions == 2
+
+
+def test_engagement_rate_window_breakdown_and_cohorts(client, db, auth_headers):
+    subtopic = SubTopicFactory(status='published')
+    now = datetime.utcnow()
+    day1 = (now - timedelta(days=4)).replace(hour=10, minute=0, second=0, microsecond=0)
+    day2 = day1 + timedelta(days=1)
+    sessions = [
+        Session(session_id=f'sess-rate-{i}', started_at=started)
+        for i, started in enumerate([day1, day1, day1, day2, now - timedelta(days=30)])
+    ]
+    db.session.add_all(sessions)
+    db.session.flush()
+    db.session.add_all([
+        SubTopicView(subtopic_id=subtopic.id, session_id=sessions[0].id, viewed_at=day1 + timedelta(hours=1)),
+        SubTopicView(subtopic_id=subtopic.id, session_id=sessions[0].id, viewed_at=day1 + timedelta(hours=2)),
+        SubTopicView(subtopic_id=subtopic.id, session_id=sessions[1].id, viewed_at=day1 + timedelta(days=2)),
+        SubTopicView(subtopic_id=subtopic.id, session_id=sessions[3].id, viewed_at=day2 + timedelta(hours=3)),
+    ])
+    db.session.commit()
+
+    data = client.get('/api/v1/analytics/engagement-rate', headers=auth_headers).get_json()
+    assert (data['engaged_visitors'], data['total_visitors']) == (3, 4)
+    assert data['engagement_rate_percent'] == 75.0
+
+    data = client.get('/api/v1/analytics/engagement-rate?breakdown=day&cohort_days=1',
+                      headers=auth_headers).get_json()
+    assert (data['engaged_visitors'], data['total_visitors']) == (2, 4)
+    assert [(d['date'], d['engaged_visitors'], d['total_visitors']) for d in data['daily']] == [
+        (str(day1.date()), 1, 3), (str(day2.date()), 1, 1)
+    ]
+
+    data = client.get('/api/v1/analytics/engagement-rate?days=60', headers=auth_headers).get_json()
+    assert data['total_visitors'] == 5
+    assert client.get('/api/v1/analytics/engagement-rate?days=0', headers=auth_headers).status_code == 400
+
+
+def test_time_series_is_dense_and_caches_closed_buckets(db):
+    subtopic = SubTopicFactory(status='published')
+    session = Session(session_id='sess-series-1')
+    db.session.add(session)
+    db.session.flush()
+    # Wednesday 2024-01-03 and Monday 2024-01-15
+    for viewed_at in (datetime(2024, 1, 3, 9), datetime(2024, 1, 3, 17), datetime(2024, 1, 15, 8)):
+        db.session.add(SubTopicView(subtopic_id=subtopic.id, session_id=session.id, viewed_at=viewed_at))
+    db.session.commit()
+
+    series = TimeSeries('test-views', SubTopicView.viewed_at, {'views': func.count(SubTopicView.id)})
+    now = datetime(2024, 1, 16, 12)
+
+    daily = series.fetch(datetime(2024, 1, 2), datetime(2024, 1, 5), 'day', now=now)
+    assert [(b.day, v['views']) for b, v in daily] == [(2, 0), (3, 2), (4, 0)]
+
+    weekly = series.fetch(datetime(2024, 1, 3), datetime(2024, 1, 17), 'week', now=now)
+    assert [(b.date().isoformat(), v['views']) for b, v in weekly] == [
+        ('2024-01-01', 2), ('2024-01-08', 0), ('2024-01-15', 1)
+    ]
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        assert series.fetch(datetime(2024, 1, 3), datetime(2024, 1, 17), 'week', now=now) == weekly
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+    # Only the open (current) week is queried again
+    assert len(statements) == 1
+
+
+def explain(db, query):
+    """Query plan text on SQLite or PostgreSQL (sequential scans disabled so small tables still use indexes)."""
+    connection = db.session.connection()
+    compiled = query.statement.compile(dialect=connection.dialect)
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    if connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        rows = connection.exec_driver_sql(f'EXPLAIN {compiled}', params).all()
+    else:
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params).all()
+    return '\n'.join(str(value) for row in rows for value in row)
+
+
+@pytest.mark.parametrize('build, index', [
+    (lambda start, end: SubTopicView.query.filter(
+        SubTopicView.viewed_at >= start, SubTopicView.viewed_at < end),
+     'ix_subtopic_views_viewed_at_subtopic'),
+    (lambda start, end: SessionLog.query.filter(
+        SessionLog.login_time >= start, SessionLog.login_time < end),
+     'ix_session_log_login_time'),
+    (lambda start, end: AuditLog.query.filter(
+        AuditLog.timestamp >= start, AuditLog.timestamp < end),
+     'ix_audit_log_timestamp'),
+    (lambda start, end: AuditLog.query.filter(
+        AuditLog.actor_id == 1, AuditLog.timestamp >= start),
+     'ix_audit_log_actor_timestamp'),
+])
+def test_time_range_filters_use_indexes(db, build, index):
+    start, end = last_days(7)
+    assert index in explain(db, build(start, end))
+
+
+def test_beacons_resolve_sessions_from_cache(client, db, auth_headers):
+    subtopic = SubTopicFactory(status='published')
+    start_session(client, 'sess-cache-1')
+    before = client.get('/api/v1/analytics/cache-stats', headers=auth_headers).get_json()['session_ids']
+
+    client.post('/api/v1/analytics/subtopic/view', json={'session_id': 'sess-cache-1', 'subtopic_id': subtopic.id})
+    client.post('/api/v1/analytics/search', json={'session_id': 'sess-cache-1', 'query_text': 'loops'})
+    client.post('/api/v1/analytics/error', json={'session_id': 'sess-cache-1', 'error_message': 'boom'})
+
+    after = client.get('/api/v1/analytics/cache-stats', headers=auth_headers).get_json()['session_ids']
+    assert after['hits'] - before['hits'] == 3
+    assert after['misses'] == before['misses']
+
+
+CHROME_UA = (
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+    '(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+)
+
+
+def test_start_session_enriches_inline_in_sync_mode(client, db):
+    resp = client.post('/api/v1/analytics/session/start', json={'session_id': 'sess-enrich-1'},
+                       headers={'User-Agent': CHROME_UA})
+    assert resp.status_code == 201
+    session = Session.query.filter_by(session_id='sess-enrich-1').one()
+    assert session.user_agent == CHROME_UA
+    assert (session.browser, session.os, session.device_type) == ('Chrome', 'Windows', 'Desktop')
+    assert session.country == 'Localhost'
+
+
+def test_user_agent_classification_is_memoized(client, db, auth_headers):
+    user_agent_cache.clear()
+    before = client.get('/api/v1/analytics/cache-stats', headers=auth_headers).get_json()['user_agents']
+    first = classify_user_agent(CHROME_UA)
+    assert classify_user_agent(CHROME_UA) is first
+    assert first.browser_family == 'Chrome' and first.device == 'Desktop'
+    assert classify_user_agent(
+        'Mozilla/5.0 (Web0S; Linux/SmartTV) AppleWebKit/537.36 (KHTML, like Gecko) webos'
+    ).device == 'TV'
+
+    after = client.get('/api/v1/analytics/cache-stats', headers=auth_headers).get_json()['user_agents']
+    assert after['hits'] - before['hits'] >= 1
+    assert after['size'] == 2
+
+
+def test_geo_lookup_is_lazy_and_cached_per_prefix(tmp_path):
+    missing = GeoLookup(country_db=str(tmp_path / 'none.mmdb'), city_db=None)
+    assert missing.country('8.8.8.8') == 'Unknown'
+    assert missing.country('127.0.0.1') == 'Localhost'
+    assert missing.country('not-an-ip') == 'Unknown'
+    assert not missing.available
+
+    class FakeCountryReader:
+        calls = 0
+
+        def country(self, ip):
+            FakeCountryReader.calls += 1
+            return type('Response', (), {'country': type('Country', (), {'name': 'Iceland'})})()
+
+    geo = GeoLookup()
+    geo.use_reader(FakeCountryReader())
+    assert geo.country('31.209.1.10') == 'Iceland'
+    assert geo.country('31.209.1.200') == 'Iceland'  # same /24
+    assert FakeCountryReader.calls == 1
+    assert geo.country('31.209.2.1') == 'Iceland'
+    assert FakeCountryReader.calls == 2
+
+
+def test_geo_lookup_logs_unreadable_database(tmp_path, caplog):
+    corrupt = tmp_path / 'corrupt.mmdb'
+    corrupt.write_bytes(b'not a maxmind database')
+    geo = GeoLookup(country_db=str(corrupt), city_db=None)
+    assert geo.country('8.8.8.8') == 'Unknown'
+    assert f"Could not open GeoIP database {corrupt}" in caplog.text
+    assert "No GeoIP database found" not in caplog.text
+
+
+def test_write_enrichment_fills_raw_rows(db, root_user):
+    session = Session(session_id='sess-enrich-2', ip_address='127.0.0.1', user_agent=CHROME_UA,
+                      device_type='Kiosk')
+    log = SessionLog(user_id=root_user.id, ip_address='127.0.0.1', user_agent=CHROME_UA)
+    db.session.add_all([session, log])
+    db.session.commit()
+
+    write_enrichment([
+        EnrichmentJob('session', session.id, '127.0.0.1', CHROME_UA, fill_device=False),
+        EnrichmentJob('session_log', log.id, '127.0.0.1', CHROME_UA),
+    ])
+    db.session.expire_all()
+
+    assert (session.browser, session.os, session.country) == ('Chrome', 'Windows', 'Localhost')
+    assert session.device_type == 'Kiosk'  # client-reported device type is kept
+    assert log.browser.startswith('Chrome 120') and log.os.startswith('Windows')
+    assert log.device == 'Desktop'
+    counter = LoginDeviceCounter.query.filter_by(user_id=root_user.id).one()
+    assert (counter.device, counter.browser, counter.logins) == ('Desktop', log.browser, 1)
+
+
+def test_device_analytics_served_from_login_counters(app, client, db, auth_headers, root_user):
+    for _ in range(2):
+        resp = client.post('/api/v1/auth/login', json={'username': 'rootuser', 'password': 'rootpass'},
+                           headers={'User-Agent': CHROME_UA})
+        assert resp.status_code == 200
+
+    data = client.get(f'/api/v1/audit/device-analytics?user_id={root_user.id}', headers=auth_headers).get_json()
+    # Two Chrome logins plus the test client login behind auth_headers
+    assert sum(item['count'] for item in data['devices']) == 3
+    assert {'label': 'Desktop', 'count': 2} in data['devices']
+    assert data['os'][0]['label'].startswith('Windows')
+
+    today = datetime.utcnow().date()
+    tomorrow = (today + timedelta(days=1)).isoformat()
+    data = client.get(f'/api/v1/audit/device-analytics?start={tomorrow}', headers=auth_headers).get_json()
+    assert data == {'devices': [], 'browsers': [], 'os': []}
+    assert client.get('/api/v1/audit/device-analytics?start=bad', headers=auth_headers).status_code == 400
+
+    LoginDeviceCounter.query.delete()
+    result = app.test_cli_runner().invoke(analytics_cli, ['rebuild-login-counters'])
+    assert result.exit_code == 0, result.output
+    assert db.session.query(func.sum(LoginDeviceCounter.logins)).scalar() == 3
+
+
+def test_batch_writer_flushes_in_batches_and_drains(app):
+    flushed = []
+    gate = threading.Event()
+
+    def handler(items):
+        gate.wait(5)
+        flushed.append(list(items))
+
+    writer = BatchWriter('test', handler, maxsize=3, batch_size=2, flush_interval=0.05)
+    writer.start(app)
+
+    # The first item is picked up by the (blocked) writer, three more fill the queue.
+    accepted = [writer.submit(i) for i in range(6)]
+    assert accepted.count(False) >= 1
+    assert writer.stats['rejected'] == accepted.count(False)
+
+    gate.set()
+    writer.stop()
+
+    written = [item for batch in flushed for item in batch]
+    assert sorted(written) == [i for i, ok in enumerate(accepted) if ok]
+    assert all(len(batch) <= 2 for batch in flushed)
+
+
+def test_session_revisit_writes_only_changes(client, db):
+    def start(user_agent):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            if statement.lstrip().upper().startswith(('UPDATE', 'INSERT')):
+                statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            resp = client.post('/api/v1/analytics/session/start', json={'session_id': 'sess-touch-1'},
+                               headers={'User-Agent': user_agent})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        return resp.status_code, statements
+
+    status, _ = start(CHROME_UA)
+    assert status == 201
+
+    # Same environment: only the last_seen heartbeat is written, then throttled.
+    status, statements = start(CHROME_UA)
+    assert status == 200
+    assert len(statements) == 1 and 'last_seen' in statements[0]
+    session = Session.query.filter_by(session_id='sess-touch-1').one()
+    assert session.last_seen is not None
+    assert start(CHROME_UA) == (200, [])
+
+    # A different User-Agent updates just the fields that changed.
+    status, statements = start('Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0')
+    assert status == 200
+    assert len(statements) == 1
+    assert 'user_agent' in statements[0] and 'browser' in statements[0] and 'country' not in statements[0]
+    assert Session.query.filter_by(session_id='sess-touch-1').count() == 1
+
+
+def test_session_last_seen_coalesced_across_sessions(db):
+    sessions = [Session(session_id=f'sess-coalesce-{i}') for i in range(3)]
+    db.session.add_all(sessions)
+    db.session.commit()
+
+    writer = CoalescingWriter('test-sessions', write_session_last_seen)
+    seen = datetime(2024, 5, 1, 12)
+    for minute in range(3):
+        for session in sessions:
+            writer.update(session.id, seen + timedelta(minutes=minute))
+    assert writer.flush() == 3
+
+    db.session.expire_all()
+    assert {s.last_seen for s in Session.query.filter(Session.session_id.like('sess-coalesce-%'))} == {
+        seen + timedelta(minutes=2)
+    }
@@ -1,4 +1,22 @@
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime, timedelta
+
 import pytest
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+from flask_jwt_extended import decode_token
+from app.auth.utils import (
+    identity_cache, invalidate_identity, load_user_with_roles, reset_request_identity, roles_required
+)
+from app.cli import analytics_cli
+from app.models.log import AuditLog, SessionLog
+import app.utils.audit as audit_module
+from app.utils.activity import write_last_activity
+from app.utils.audit import AuditSink
+from app.utils.batching import BatchWriter, CoalescingWriter
 from app.models.user import User, Role
 
 
@@ -83,6 +101,53 @@ def test_get_users_list(client, db, auth_headers, root_user):
     assert any(u['username'].startswith('user') for u in data['users'])
 
 
+def test_get_users_constant_queries_and_keyset(client, db, auth_headers):
+    viewer_role = Role.query.filter_by(name='viewer').one()
+    for i in range(6):
+        user = User(username=f'pageuser{i}', email=f'pageuser{i}@example.com')
+        user.set_password('pass123')
+        user.roles.append(viewer_role)
+        db.session.add(user)
+        db.session.flush()
+        for day in (1, 3, 2):
+            db.session.add(SessionLog(user_id=user.id, login_time=datetime(2024, 1, day, 12)))
+    db.session.commit()
+
+    def list_users(query):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            resp = client.get(f'/api/v1/auth/users?search=pageuser&{query}', headers=auth_headers)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        assert resp.status_code == 200
+        return resp.get_json(), len(statements)
+
+    list_users('limit=1')  # records the admin's activity heartbeat, skipped on the next calls
+    small, small_queries = list_users('limit=2')
+    large, large_queries = list_users('limit=6')
+    assert small_queries == large_queries
+    assert large['total'] == 6
+    assert all(u['roles'] == ['viewer'] for u in large['users'])
+    assert all(u['last_login'].startswith('Jan 03, 2024') for u in large['users'])
+
+    names = [u['username'] for u in small['users']]
+    next_page, _ = list_users(f"limit=2&after_id={small['next_after_id']}")
+    names += [u['username'] for u in next_page['users']]
+    assert names == [f'pageuser{i}' for i in range(4)]
+
+
+def test_get_users_rejects_non_positive_limit(client, auth_headers):
+    for limit in (0, -1):
+        resp = client.get(f'/api/v1/auth/users?limit={limit}', headers=auth_headers)
+        assert resp.status_code == 400
+        assert resp.get_json()['msg'] == "limit must be a positive integer."
+
+
 def test_update_user_roles_permission(client, db, auth_headers):
     # Create a user with viewer role
     viewer_role = Role.query.filter_by(name='viewer').one()
@@ -116,6 +181,198 @@ def test_delete_user_permission(client, db, auth_headers):
     assert b'User deleted successfully' in resp.data
 
 
+def test_load_user_with_roles_single_query(db, root_user):
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        user, identity = load_user_with_roles('rootuser')
+        assert user.has_role('root')
+        assert not user.has_role('admin')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+
+    assert len(statements) == 1
+    assert identity.roles == {'root'}
+    assert load_user_with_roles('nobody') == (None, None)
+
+
+def test_roles_required_identity_cache_invalidation(app, db, auth_headers, root_user):
+    @roles_required('admin')
+    def admin_only():
+        return 'ok'
+
+    identity_cache.configure(ttl=30)
+    try:
+        with app.test_request_context(headers=auth_headers):
+            reset_request_identity()
+            assert admin_only()[1] == 403
+
+        root_user.roles.append(Role.query.filter_by(name='admin').one())
+        db.session.commit()
+        with app.test_request_context(headers=auth_headers):
+            reset_request_identity()
+            assert admin_only()[1] == 403  # stale cached identity
+
+        invalidate_identity('rootuser')
+        with app.test_request_context(headers=auth_headers):
+            reset_request_identity()
+            assert admin_only() == 'ok'
+    finally:
+        identity_cache.configure(ttl=0)
+        identity_cache.clear()
+
+
+def test_embedded_role_claims_and_revocation(app, client, db, auth_headers, monkeypatch):
+    monkeypatch.setitem(app.config, 'JWT_EMBED_ROLES', True)
+    user = User(username='claimsuser', email='claims@example.com')
+    user.set_password('pass')
+    user.roles.append(Role.query.filter_by(name='viewer').one())
+    db.session.add(user)
+    db.session.commit()
+
+    # Separate client so the login cookies don't replace the root user's.
+    user_client = app.test_client()
+    resp = user_client.post('/api/v1/auth/login', json={'username': 'claimsuser', 'password': 'pass'})
+    assert resp.status_code == 200
+    cookie = resp.headers.get('Set-Cookie')
+    token = cookie.split('=', 1)[1].split(';', 1)[0]
+    claims = decode_token(token)
+    assert claims['uid'] == user.id and claims['roles'] == ['viewer'] and claims['tv'] == 0
+
+    @roles_required('viewer')
+    def viewer_only():
+        return 'ok'
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    # Prime the token version cache, then authorize from the claims alone.
+    with app.test_request_context(headers={'Cookie': cookie}):
+        reset_request_identity()
+        assert viewer_only() == 'ok'
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        with app.test_request_context(headers={'Cookie': cookie}):
+            reset_request_identity()
+            assert viewer_only() == 'ok'
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+    assert statements == []
+
+    # A role change bumps the token version and revokes the outstanding token.
+    resp = client.put(f'/api/v1/auth/users/{user.id}', json={'roles': ['admin']}, headers=auth_headers)
+    assert resp.status_code == 200
+    assert User.query.get(user.id).token_version == 1
+    resp = user_client.get(f'/api/v1/auth/users/{user.id}')
+    assert resp.status_code == 401
+    assert resp.get_json()['msg'] == 'Token has been revoked'
+
+
+def test_inactive_users_report(app, client, db, auth_headers, root_user):
+    viewer_role = Role.query.filter_by(name='viewer').one()
+    users = {}
+    for name in ('idle-a', 'idle-b', 'idle-c', 'busy'):
+        user = User(username=name, email=f'{name}@example.com')
+        user.set_password('pass')
+        user.roles.append(viewer_role)
+        db.session.add(user)
+        users[name] = user
+    db.session.flush()
+    db.session.add(AuditLog(actor_id=users['busy'].id, action_type='update',
+                            timestamp=datetime.utcnow() - timedelta(days=1)))
+    db.session.add(AuditLog(actor_id=users['idle-b'].id, action_type='update',
+                            timestamp=datetime.utcnow() - timedelta(days=20)))
+    db.session.commit()
+    result = app.test_cli_runner().invoke(analytics_cli, ['rebuild-user-activity'])
+    assert result.exit_code == 0, result.output
+
+    # Registering a user writes an audit row for root, which makes root active.
+    resp = client.post('/api/v1/auth/users/create', json={
+        'username': 'newcomer', 'email': 'newcomer@example.com', 'password': 'pass1234', 'role': 'viewer'
+    }, headers=auth_headers)
+    assert resp.status_code == 201
+
+    data = client.get('/api/v1/audit/inactive-users?per_page=2', headers=auth_headers).get_json()
+    assert [u['username'] for u in data['users']] == ['idle-a', 'idle-b']
+    assert data['users'][0]['role'] == 'viewer' and data['users'][0]['last_seen'] == 'Never'
+    assert data['total'] == 4  # idle-a, idle-b, idle-c, newcomer
+
+    data = client.get(f"/api/v1/audit/inactive-users?per_page=2&after={data['next_after']}",
+                      headers=auth_headers).get_json()
+    assert [u['username'] for u in data['users']] == ['idle-c', 'newcomer']
+
+    data = client.get('/api/v1/audit/inactive-users?days=30&per_page=10', headers=auth_headers).get_json()
+    assert 'idle-b' not in [u['username'] for u in data['users']]
+
+
+def test_last_activity_written_once_per_granularity(client, db, auth_headers, root_user):
+    def latest_activity():
+        db.session.expire_all()
+        return SessionLog.query.filter_by(user_id=root_user.id)\
+            .order_by(SessionLog.login_time.desc()).first().last_activity
+
+    client.get('/api/v1/auth/users', headers=auth_headers)
+    first = latest_activity()
+    assert first is not None
+
+    updates = []
+    def count(conn, cursor, statement, *args):
+        if statement.lstrip().upper().startswith('UPDATE SESSION_LOG'):
+            updates.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        client.get('/api/v1/auth/users', headers=auth_headers)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+    assert updates == []
+    assert latest_activity() == first
+
+
+def test_coalescing_writer_flushes_latest_value_per_key(db):
+    users = []
+    for name in ('heartbeat-a', 'heartbeat-b'):
+        user = User(username=name, email=f'{name}@example.com')
+        user.set_password('pass')
+        db.session.add(user)
+        users.append(user)
+    db.session.flush()
+    old = datetime(2024, 1, 1)
+    for user in users:
+        db.session.add(SessionLog(user_id=user.id, login_time=old, last_activity=old))
+        db.session.add(SessionLog(user_id=user.id, login_time=old + timedelta(hours=1)))
+    db.session.commit()
+
+    writer = CoalescingWriter('test-activity', write_last_activity)
+    for minute in range(5):
+        for user in users:
+            writer.update(user.id, old + timedelta(hours=2, minutes=minute))
+    assert writer.pending() == 2
+
+    updates = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('UPDATE SESSION_LOG'):
+            updates.append(executemany)
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        assert writer.flush() == 2
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+    assert updates == [True]
+    assert writer.pending() == 0 and writer.stats['written'] == 2
+
+    db.session.expire_all()
+    for user in users:
+        logs = SessionLog.query.filter_by(user_id=user.id).order_by(SessionLog.login_time).all()
+        assert logs[0].last_activity == old
+        assert logs[1].last_activity == old + timedelta(hours=2, minutes=4)
+
+
 # def test_audit_logs_access_control(client, auth_headers):
 #     # Access audit logs with root user (allowed)
 #     resp = client.get('/api/v1/auth/audit/logs', headers=auth_headers)
@@ -132,3 +389,106 @@ def test_logout(client, auth_headers):
     assert resp.status_code == 200
     data = resp.get_json()
     assert data['msg'] == 'Logout successful'
+
+
+def test_audit_row_committed_with_caller_transaction(client, db, auth_headers, root_user):
+    commits = []
+    def count(session):
+        commits.append(session)
+    event.listen(OrmSession, 'after_commit', count)
+    try:
+        resp = client.post('/api/v1/auth/users/create', json={
+            'username': 'audited', 'email': 'audited@example.com', 'password': 'pass1234', 'role': 'viewer'
+        }, headers=auth_headers)
+    finally:
+        event.remove(OrmSession, 'after_commit', count)
+    assert resp.status_code == 201
+    assert len(commits) == 1
+
+    audit = AuditLog.query.filter_by(action_type='create').one()
+    assert audit.target_user_id == resp.get_json()['user']['id']
+    assert db.session.get(User, root_user.id).last_activity_at == audit.timestamp
+
+
+def test_async_audit_sink_spools_until_written(db, root_user, tmp_path, monkeypatch):
+    sink = AuditSink()
+    sink.spool_path = str(tmp_path / 'audit-spool.jsonl')
+    sink._writer = BatchWriter('test-audit', sink._flush)  # not started: events stay queued
+    monkeypatch.setattr(audit_module, 'audit_sink', sink)
+
+    sink.record(root_user.id, 'update', target_user_id=root_user.id, description='queued')
+    assert AuditLog.query.filter_by(description='queued').count() == 0
+    db.session.commit()
+    assert sink._writer.qsize() == 1
+    assert AuditLog.query.filter_by(description='queued').count() == 0
+
+    # After a crash the spool still holds the event; replaying it writes it once.
+    spooled = sink._read_spool()
+    assert [row['description'] for row in spooled] == ['queued']
+    sink._flush(spooled)
+    assert sink._read_spool() == []
+    audit = AuditLog.query.filter_by(description='queued').one()
+    assert audit.actor_id == root_user.id
+    db.session.expire_all()
+    assert db.session.get(User, root_user.id).last_activity_at == audit.timestamp
+
+
+def test_async_audit_sink_claims_spools_of_stopped_processes(tmp_path):
+    sink = AuditSink()
+    sink.spool_path = str(tmp_path / 'audit-spool.jsonl')
+    stopped = subprocess.Popen([sys.executable, '-c', 'pass'])
+    stopped.wait()
+
+    def spool(path, *spool_ids):
+        with open(path, 'w', encoding='utf-8') as f:
+            for spool_id in spool_ids:
+                f.write(json.dumps({'spool_id': spool_id, 'actor_id': None, 'action_type': 'test',
+                                    'target_user_id': None, 'description': spool_id,
+                                    'timestamp': '2024-01-01T00:00:00'}) + '\n')
+            f.write('{"torn')
+
+    spool(tmp_path / f'audit-spool.{stopped.pid}.0.jsonl', 'dead-1')
+    spool(tmp_path / f'audit-spool.{stopped.pid}.1.jsonl', 'dead-2')
+    spool(tmp_path / 'audit-spool.jsonl', 'legacy', 'dead-2')  # shared spool of earlier versions
+    spool(tmp_path / f'audit-spool.{os.getppid()}.0.jsonl', 'running')  # still queued by a live worker
+
+    rows = sink._claim_spools()
+    assert sorted(row['spool_id'] for row in rows) == ['dead-1', 'dead-2', 'legacy']
+    assert sorted(row['spool_id'] for row in sink._read_spool()) == ['dead-1', 'dead-2', 'legacy']
+    assert sorted(os.listdir(tmp_path)) == sorted([
+        'audit-spool.lock', f'audit-spool.{os.getpid()}.0.jsonl', f'audit-spool.{os.getppid()}.0.jsonl',
+    ])
+    assert sink._claim_spools() == []  # segments this process is still writing are its own
+
+    # A restart that reuses this pid replays its segments once, without duplicates.
+    restarted = AuditSink()
+    restarted.spool_path = sink.spool_path
+    assert sorted(row['spool_id'] for row in restarted._claim_spools()) == ['dead-1', 'dead-2', 'legacy']
+    assert len(restarted._read_spool()) == 3
+
+
+def test_async_audit_sink_rotates_and_deletes_written_segments(db, tmp_path, monkeypatch):
+    sink = AuditSink()
+    sink.spool_path = str(tmp_path / 'audit-spool.jsonl')
+    sink.segment_size = 2
+    fsyncs = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(audit_module.os, 'fsync', lambda fd: fsyncs.append(fd) or real_fsync(fd))
+
+    def rows(*descriptions):
+        return [{'actor_id': None, 'action_type': 'test', 'target_user_id': None,
+                 'description': d, 'timestamp': datetime(2024, 1, 1)} for d in descriptions]
+
+    queued = []
+    sink._enqueue = queued.append
+    sink.submit(rows('a', 'b'))
+    assert len(fsyncs) == 1  # one write per committed batch
+    sink.submit(rows('c'))  # the first segment is full: a new one starts
+    segments = sorted(os.listdir(tmp_path))
+    assert segments == [f'audit-spool.{os.getpid()}.0.jsonl', f'audit-spool.{os.getpid()}.1.jsonl']
+
+    sink._flush(queued[:1])
+    assert sorted(os.listdir(tmp_path)) == segments  # "b" is still pending
+    sink._flush(queued[1:])
+    assert os.listdir(tmp_path) == []
+    assert AuditLog.query.filter_by(action_type='test').count() == 3
@@ -0,0 +1,128 @@
+import os
+
+import pytest
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from flask_migrate import upgrade
+from sqlalchemy import text
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from app import create_app, db as _db
+from app.utils.login_stats import rebuild_login_counters, rebuild_user_activity
+from app.utils.metrics import rebuild_daily_metrics
+from app.utils.rollups import rebuild_rollups
+from app.utils.search import SearchIndex, search_index
+from config import TestingConfig
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'migrations')
+BASELINE = '1241fa7f1daa'
+
+DERIVED_TABLES = (
+    'subtopic_analytics_buckets', 'subtopic_analytics', 'daily_metrics', 'hourly_metrics',
+    'daily_session_activity', 'login_device_counters',
+)
+
+
+@pytest.fixture
+def migration_app(tmp_path, monkeypatch):
+    class MigrationConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'migrate.sqlite3'}"
+
+    # The search index is process-wide; keep it on the test database.
+    monkeypatch.setattr(search_index, 'init_app', lambda app: None)
+    app = create_app(MigrationConfig)
+    with app.app_context():
+        yield app
+        _db.engine.dispose()
+
+
+def snapshot(connection):
+    """Rows of the derived tables (and users), without surrogate ids."""
+    return {
+        table: sorted(
+            tuple(value for key, value in row.items() if key != 'id')
+            for row in connection.execute(text(f"SELECT * FROM {table}")).mappings()
+        )
+        for table in DERIVED_TABLES + ('users',)
+    }
+
+
+def test_migrations_match_models_and_backfill_existing_data(migration_app):
+    upgrade(directory=MIGRATIONS, revision=BASELINE)
+    with _db.engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO users (id, username, email, password_hash, created_at, is_active) VALUES "
+            "(1, 'ann', 'ann@example.com', 'x', '2024-01-01 00:00:00.000000', 1), "
+            "(2, 'bob', 'bob@example.com', 'x', '2024-01-01 00:00:00.000000', 1)"
+        ))
+        connection.execute(text(
+            "INSERT INTO session_log (user_id, login_time, browser, os, device) VALUES "
+            "(1, '2024-03-01 09:15:00.000000', 'Firefox', 'Linux', 'Desktop'), "
+            "(1, '2024-03-02 10:00:00.000000', 'Firefox', 'Linux', 'Desktop'), "
+            "(2, '2024-03-02 11:30:00.000000', NULL, NULL, NULL)"
+        ))
+        connection.execute(text(
+            "INSERT INTO audit_log (actor_id, action_type, timestamp) VALUES "
+            "(1, 'login', '2024-03-02 10:05:00.000000')"
+        ))
+        connection.execute(text(
+            "INSERT INTO topic (id, title, slug) VALUES (1, 'Python', 'python')"
+        ))
+        connection.execute(text(
+            "INSERT INTO sub_topic (id, title, content, slug, status, topic_id) VALUES "
+            "(1, 'Basics', '', 'basics', 'published', 1), (2, 'Loops', '', 'loops', 'published', 1)"
+        ))
+        connection.execute(text(
+            "INSERT INTO sessions (id, session_id, started_at) VALUES "
+            "(1, 's1', '2024-03-01 08:59:00.000000'), (2, 's2', '2024-03-02 12:00:00.000000')"
+        ))
+        connection.execute(text(
+            "INSERT INTO subtopic_views (subtopic_id, session_id, viewed_at, time_spent_seconds, "
+            "scroll_depth_percent) VALUES "
+            "(1, 1, '2024-03-01 09:10:00.000000', 30, 25), "
+            "(1, 1, '2024-03-01 09:50:00.000000', NULL, 90), "
+            "(2, 2, '2024-03-02 12:01:00.000000', 12.5, NULL)"
+        ))
+
+    upgrade(directory=MIGRATIONS)
+
+    with _db.engine.connect() as connection:
+        context = MigrationContext.configure(connection, opts={
+            'include_object': lambda obj, name, type_, *args: not name.startswith('search_documents'),
+        })
+        assert compare_metadata(context, _db.metadata) == []
+        migrated = snapshot(connection)
+        assert len(migrated['subtopic_analytics_buckets']) == 4
+        assert connection.execute(text(
+            "SELECT last_login_at, last_activity_at FROM users WHERE id = 1"
+        )).one() == ('2024-03-02 10:00:00.000000', '2024-03-02 10:05:00.000000')
+
+    # The backfill must agree with the rebuild commands.
+    connection = _db.engine.connect()
+    _db.session = scoped_session(sessionmaker(bind=connection))
+    try:
+        rebuild_rollups()
+        rebuild_daily_metrics()
+        rebuild_login_counters()
+        rebuild_user_activity()
+        assert snapshot(connection) == migrated
+    finally:
+        _db.session.remove()
+        connection.close()
+
+
+def test_search_table_is_created_by_migrations_and_filled_at_startup(migration_app):
+    upgrade(directory=MIGRATIONS, revision=BASELINE)
+    with _db.engine.begin() as connection:
+        connection.execute(text("INSERT INTO topic (id, title, slug) VALUES (1, 'Generators', 'generators')"))
+    upgrade(directory=MIGRATIONS)
+
+    _db.session = scoped_session(sessionmaker(bind=_db.engine))
+    try:
+        index = SearchIndex()
+        index.init_app(migration_app)
+        assert index.backend.name == 'sqlite'
+        assert index._ready
+        assert index.search('gener')[1] == 1
+    finally:
+        _db.session.remove()
@@ -1,5 +1,14 @@
+import gzip
+import json
 import pytest
-from app.models.tutorial import Topic
+from sqlalchemy import event
+from app.cli import content_cli
+from app.models.tutorial import ContentVersion, Topic, SubTopic, Quiz
+from app.extensions import db
+import app.routes.tutorials as tutorials_module
+from app.utils.content_cache import content_version_cache
+from app.utils.search import MemorySearchBackend, SearchDocument, SearchIndex
+from tests.factories import QuizFactory
 
 @pytest.mark.usefixtures('client', 'auth_headers')
 class TestTutorialsApi:
@@ -103,3 +112,335 @@ class TestTutorialsApi:
         resp = client.post(f'/api/v1/topics/subtopics/{sub_id}/quizzes', json=invalid_quizzes, headers=auth_headers)
         assert resp.status_code == 400
         assert 'error' in resp.get_json()
+
+    def test_import_quizzes_ndjson_and_csv(self, client, auth_headers):
+        topic_id = client.post('/api/v1/topics/', json={"title": "Import Topic"}, headers=auth_headers).get_json()['id']
+        sub_ids = [
+            client.post(f'/api/v1/topics/{topic_id}/subtopics', json={
+                "title": f"Import Sub {i}", "content": "Imported quiz content"
+            }, headers=auth_headers).get_json()['id']
+            for i in range(2)
+        ]
+
+        lines = [json.dumps({
+            "question": f"Question {i}?", "option_a": "A", "option_b": "B", "option_c": "C", "option_d": "D",
+            "correct_answer": "B", "subtopic_id": sub_ids[i % 2]
+        }) for i in range(2500)]
+        lines[10] = '{"question": "broken'
+        lines[20] = json.dumps({"question": "Missing options?", "correct_answer": "a", "subtopic_id": sub_ids[0]})
+        lines[30] = json.dumps({"question": "Unknown subtopic?", "option_a": "A", "option_b": "B",
+                                "option_c": "C", "option_d": "D", "correct_answer": "a", "subtopic_id": 999999})
+        body = '\n'.join(lines[:1000]) + '\n\n' + '\n'.join(lines[1000:]) + '\n'
+
+        inserts = []
+        def count(conn, cursor, statement, *args):
+            if statement.lstrip().upper().startswith('INSERT INTO QUIZ'):
+                inserts.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            resp = client.post('/api/v1/topics/quizzes/import', data=body.encode(),
+                               content_type='application/x-ndjson', headers=auth_headers)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        assert resp.status_code == 201
+        result = resp.get_json()
+        assert (result['imported'], result['failed']) == (2497, 3)
+        assert [e['row'] for e in result['errors']] == [11, 21, 31]
+        assert 'option_a' in result['errors'][1]['errors']
+        assert result['errors'][2]['errors'] == {'subtopic_id': ['Subtopic not found']}
+        assert len(inserts) == 3
+
+        csv_body = (
+            "question,option_a,option_b,option_c,option_d,correct_answer\n"
+            "What is 2+2?,3,4,5,\"6, or more\",B\n"
+            "Bad answer row,1,2,3,4,E\n"
+        )
+        resp = client.post(f'/api/v1/topics/quizzes/import?subtopic_id={sub_ids[0]}', data=csv_body,
+                           content_type='text/csv', headers=auth_headers)
+        assert resp.status_code == 201
+        result = resp.get_json()
+        assert (result['imported'], result['failed']) == (1, 1)
+        assert result['errors'][0]['row'] == 2 and 'correct_answer' in result['errors'][0]['errors']
+
+        detail = client.get(f'/api/v1/topics/{topic_id}?fields=quizzes', headers=auth_headers).get_json()
+        quizzes = [q for st in detail['subtopics'] for q in st['quizzes']]
+        assert len(quizzes) == 2498
+        imported = next(q for q in quizzes if q['question'] == 'What is 2+2?')
+        assert imported['option_d'] == '6, or more' and imported['correct_answer'] == 'b'
+
+        resp = client.post('/api/v1/topics/quizzes/import', data='x', content_type='text/plain', headers=auth_headers)
+        assert resp.status_code == 415
+
+    def test_sidebar_etag_and_invalidation(self, client, auth_headers):
+        topic_id = client.post('/api/v1/topics/', json={"title": "Sidebar Topic"}, headers=auth_headers).get_json()['id']
+        client.post(f'/api/v1/topics/{topic_id}/subtopics', json={
+            "title": "Draft Page", "content": "Not visible yet"
+        }, headers=auth_headers)
+        client.post(f'/api/v1/topics/{topic_id}/subtopics', json={
+            "title": "Published Page", "content": "Visible in sidebar", "status": "published"
+        }, headers=auth_headers)
+
+        resp = client.get('/api/v1/topics/sidebar')
+        assert resp.status_code == 200
+        etag = resp.headers['ETag']
+        topic = next(t for t in resp.get_json() if t['id'] == topic_id)
+        assert [st['title'] for st in topic['subtopics']] == ["Published Page"]
+
+        resp = client.get('/api/v1/topics/sidebar', headers={'If-None-Match': etag})
+        assert resp.status_code == 304
+
+        client.put(f'/api/v1/topics/{topic_id}', json={"title": "Renamed Topic"}, headers=auth_headers)
+        resp = client.get('/api/v1/topics/sidebar', headers={'If-None-Match': etag})
+        assert resp.status_code == 200
+        assert resp.headers['ETag'] != etag
+        assert any(t['title'] == "Renamed Topic" for t in resp.get_json())
+
+    def test_sidebar_follows_shared_content_version(self, client):
+        # Another worker process writes content and bumps the shared version.
+        db.session.add(ContentVersion(id=1, version=5))
+        db.session.commit()
+        etag = client.get('/api/v1/topics/sidebar').headers['ETag']
+
+        db.session.add(Topic(title="Other Worker Topic", slug="other-worker-topic"))
+        db.session.commit()
+        content_version_cache.clear()  # CONTENT_VERSION_CACHE_TTL elapsed
+        assert client.get('/api/v1/topics/sidebar', headers={'If-None-Match': etag}).status_code == 304
+
+        db.session.get(ContentVersion, 1).version += 1
+        db.session.commit()
+        resp = client.get('/api/v1/topics/sidebar', headers={'If-None-Match': etag})
+        assert resp.status_code == 304  # the version is re-read only once the TTL elapsed
+        content_version_cache.clear()
+        resp = client.get('/api/v1/topics/sidebar', headers={'If-None-Match': etag})
+        assert resp.status_code == 200
+        assert any(t['slug'] == "other-worker-topic" for t in resp.get_json())
+
+    def test_subtopic_content_navigation(self, client, auth_headers):
+        def publish(topic_id, title):
+            resp = client.post(f'/api/v1/topics/{topic_id}/subtopics', json={
+                "title": title, "content": f"{title} content body", "status": "published"
+            }, headers=auth_headers)
+            return resp.get_json()
+
+        first_topic = client.post('/api/v1/topics/', json={"title": "Nav One"}, headers=auth_headers).get_json()
+        second_topic = client.post('/api/v1/topics/', json={"title": "Nav Two"}, headers=auth_headers).get_json()
+        intro = publish(first_topic['id'], "Nav Intro")
+        basics = publish(first_topic['id'], "Nav Basics")
+        advanced = publish(second_topic['id'], "Nav Advanced")
+
+        resp = client.get(f"/api/v1/topics/{first_topic['slug']}/{basics['slug']}")
+        assert resp.status_code == 200
+        data = resp.get_json()
+        assert data['title'] == "Nav Basics"
+        assert data['prev_subtopic_slug'] == intro['slug']
+        assert data['next_subtopic_slug'] == advanced['slug']
+        assert {intro['slug'], basics['slug'], advanced['slug']} <= set(data['all_subtopics'])
+
+        # Wrong topic slug for an existing subtopic
+        resp = client.get(f"/api/v1/topics/{second_topic['slug']}/{basics['slug']}")
+        assert resp.status_code == 404
+
+        # Unpublishing removes the page from the reading order
+        client.put(f"/api/v1/topics/subtopic/{basics['id']}", json={"status": "draft"}, headers=auth_headers)
+        assert client.get(f"/api/v1/topics/{first_topic['slug']}/{basics['slug']}").status_code == 404
+        data = client.get(f"/api/v1/topics/{first_topic['slug']}/{intro['slug']}").get_json()
+        assert data['next_subtopic_slug'] == advanced['slug']
+
+        # Unpublished by another worker process: not served while this process's index lags,
+        # and gone from the reading order once the shared content version is re-read.
+        SubTopic.query.get(advanced['id']).status = 'draft'
+        version = db.session.get(ContentVersion, 1) or ContentVersion(id=1, version=0)
+        version.version += 1
+        db.session.add(version)
+        db.session.commit()
+        assert client.get(f"/api/v1/topics/{second_topic['slug']}/{advanced['slug']}").status_code == 404
+        content_version_cache.clear()  # CONTENT_VERSION_CACHE_TTL elapsed
+        data = client.get(f"/api/v1/topics/{first_topic['slug']}/{intro['slug']}").get_json()
+        assert advanced['slug'] not in data['all_subtopics']
+        assert data['next_subtopic_slug'] != advanced['slug']
+
+    def test_search_ranked_prefix_and_incremental(self, client, auth_headers):
+        topic = client.post('/api/v1/topics/', json={"title": "Iteration Guide"}, headers=auth_headers).get_json()
+        loops = client.post(f"/api/v1/topics/{topic['id']}/subtopics", json={
+            "title": "Python Loops",
+            "content": "<p>The <b>while</b> statement repeats a block</p>",
+            "status": "published"
+        }, headers=auth_headers).get_json()
+        client.post(f"/api/v1/topics/{topic['id']}/subtopics", json={
+            "title": "Loops Draft", "content": "Unfinished while notes"
+        }, headers=auth_headers)
+
+        def search(q):
+            resp = client.get('/api/v1/topics/search', query_string={'q': q})
+            assert resp.status_code == 200
+            return resp
+
+        results = search('loo').get_json()
+        assert [(r['type'], r['name']) for r in results] == [('subtopic', 'Python Loops')]
+        assert results[0]['topic_slug'] == topic['slug']
+
+        # Content bodies are indexed, drafts are not
+        assert [r['id'] for r in search('whil stat').get_json()] == [loops['id']]
+
+        # Topic title matches rank the topic itself above its subtopics
+        resp = search('iterat')
+        assert [r['type'] for r in resp.get_json()] == ['topic', 'subtopic']
+        assert resp.headers['X-Total-Count'] == '2'
+        paged = client.get('/api/v1/topics/search', query_string={'q': 'iterat', 'limit': 1, 'page': 2})
+        assert [r['type'] for r in paged.get_json()] == ['subtopic']
+
+        client.delete(f"/api/v1/topics/subtopic/{loops['id']}", headers=auth_headers)
+        assert search('loo').get_json() == []
+
+    def test_topic_detail_fixed_queries_and_projection(self, app, client, auth_headers, monkeypatch):
+        topic = client.post('/api/v1/topics/', json={"title": "Detail Topic"}, headers=auth_headers).get_json()
+        for i in range(4):
+            sub = client.post(f"/api/v1/topics/{topic['id']}/subtopics", json={
+                "title": f"Detail Page {i}", "content": f"Body of page number {i}"
+            }, headers=auth_headers).get_json()
+            client.post(f"/api/v1/topics/subtopics/{sub['id']}/quizzes", json=[{
+                "question": f"Question {i}?", "option_a": "A", "option_b": "B",
+                "option_c": "C", "option_d": "D", "correct_answer": "A"
+            }], headers=auth_headers)
+
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            resp = client.get(f"/api/v1/topics/{topic['id']}", headers=auth_headers)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        assert resp.status_code == 200
+        assert len(statements) <= 3
+        full = resp.get_json()
+        full_text = resp.get_data(as_text=True)
+        assert [len(st['quizzes']) for st in full['subtopics']] == [1, 1, 1, 1]
+
+        resp = client.get(f"/api/v1/topics/{topic['id']}?fields=id,title", headers=auth_headers)
+        assert resp.get_json()['subtopics'][0].keys() == {'id', 'title'}
+
+        resp = client.get(f"/api/v1/topics/{topic['id']}?fields=id,topicId", headers=auth_headers)
+        assert resp.get_json()['subtopics'][0].keys() == {'id', 'topicId'}
+
+        for bogus in ('bogus', 'topic_id'):
+            resp = client.get(f"/api/v1/topics/{topic['id']}?fields=id,{bogus}", headers=auth_headers)
+            assert resp.status_code == 400
+
+        # Past the first page the subtopics are fetched one chunk at a time
+        monkeypatch.setattr(tutorials_module, 'TOPIC_DETAIL_STREAM_CHUNK', 1)
+        app.config['TOPIC_DETAIL_STREAM_THRESHOLD'] = 1
+        try:
+            resp = client.get(f"/api/v1/topics/{topic['id']}", headers=auth_headers)
+            assert resp.is_streamed
+            streamed = json.loads(resp.get_data(as_text=True))
+            assert streamed == full
+            assert list(streamed) == list(json.loads(full_text))
+            assert list(streamed['subtopics'][0]) == list(json.loads(full_text)['subtopics'][0])
+            resp = client.get(f"/api/v1/topics/{topic['id']}?fields=id,title", headers=auth_headers)
+            assert [st['id'] for st in json.loads(resp.get_data(as_text=True))['subtopics']] == \
+                [st['id'] for st in full['subtopics']]
+        finally:
+            app.config['TOPIC_DETAIL_STREAM_THRESHOLD'] = 200
+
+
+def test_memory_search_backend():
+    backend = MemorySearchBackend()
+    backend.upsert([
+        SearchDocument('topic', 1, 'Functions', '', ''),
+        SearchDocument('subtopic', 2, 'Lambda expressions', 'Functions', 'anonymous functions in python'),
+        SearchDocument('subtopic', 3, 'Modules', 'Packaging', 'import python files'),
+    ])
+
+    hits, total = backend.search(['func'], limit=10, offset=0)
+    assert total == 2
+    assert [(h.kind, h.ref_id) for h in hits] == [('topic', 1), ('subtopic', 2)]
+
+    hits, total = backend.search(['pyth', 'imp'], limit=10, offset=0)
+    assert [(h.kind, h.ref_id) for h in hits] == [('subtopic', 3)]
+
+    backend.delete([('subtopic', 3)])
+    assert backend.search(['imp'], limit=10, offset=0) == ([], 0)
+
+
+def test_memory_search_index_follows_shared_content_version(db):
+    index = SearchIndex()  # in-memory backend, as on databases without full-text search
+    db.session.add(Topic(title="Generators", slug="generators"))
+    db.session.commit()
+    assert index.search("generators")[1] == 1
+
+    # Written by another worker process, which bumps the shared content version
+    db.session.add(Topic(title="Generator Expressions", slug="generator-expressions"))
+    version = db.session.get(ContentVersion, 1) or ContentVersion(id=1, version=0)
+    version.version += 1
+    db.session.add(version)
+    db.session.commit()
+    assert index.search("generator")[1] == 1
+    content_version_cache.clear()  # CONTENT_VERSION_CACHE_TTL elapsed
+    assert index.search("generator")[1] == 2
+
+
+def test_content_export_import_roundtrip(app, tmp_path):
+    quizzes = [QuizFactory(), QuizFactory()]
+    QuizFactory(subtopic=quizzes[0].subtopic)
+    topic_slug = quizzes[0].subtopic.topic.slug
+    runner = app.test_cli_runner()
+
+    archive = tmp_path / 'content.jsonl.gz'
+    result = runner.invoke(content_cli, ['export', '-o', str(archive)])
+    assert result.exit_code == 0, result.output
+    with gzip.open(archive, 'rt') as f:
+        records = [json.loads(line) for line in f]
+    assert [r['type'] for r in records] == ['topic'] * 2 + ['subtopic'] * 2 + ['quiz'] * 3
+
+    def counts():
+        return Topic.query.count(), SubTopic.query.count(), Quiz.query.count()
+
+    before = counts()
+    result = runner.invoke(content_cli, ['import', str(archive)])
+    assert result.exit_code == 0, result.output
+    assert counts() == before  # slug upserts and quiz replacement make re-imports idempotent
+
+    # Edited archive: renamed subtopic, one quiz dropped, a new topic with a subtopic
+    edited = [r for r in records if not (r['type'] == 'quiz' and r['question'] == records[-1]['question'])]
+    edited[2]['title'] = 'Renamed Subtopic'
+    edited += [
+        {'type': 'topic', 'slug': 'imported-topic', 'title': 'Imported Topic'},
+        {'type': 'subtopic', 'topic': 'imported-topic', 'slug': 'imported-sub', 'title': 'Imported Sub',
+         'content': 'Imported body text', 'status': 'published'},
+        {'type': 'quiz', 'subtopic': 'imported-sub', 'question': 'Imported question?',
+         'option_a': '1', 'option_b': '2', 'option_c': '3', 'option_d': '4', 'correct_answer': 'C'},
+    ]
+    plain = tmp_path / 'edited.jsonl'
+    plain.write_text(''.join(json.dumps(r) + '\n' for r in edited))
+
+    result = runner.invoke(content_cli, ['import', str(plain), '--dry-run'])
+    assert result.exit_code == 0, result.output
+    assert 'Dry run' in result.output and counts() == before
+
+    version = db.session.get(ContentVersion, 1)
+    shared_before = version.version if version else 0
+    result = runner.invoke(content_cli, ['import', str(plain), '--chunk-size', '1'])
+    assert result.exit_code == 0, result.output
+    # Web workers notice the import through the shared content version
+    assert db.session.get(ContentVersion, 1).version == shared_before + 1
+    assert 'no restart needed' in result.output
+    assert counts() == (before[0] + 1, before[1] + 1, before[2])
+    assert SubTopic.query.filter_by(slug=edited[2]['slug']).one().title == 'Renamed Subtopic'
+    imported = SubTopic.query.filter_by(slug='imported-sub').one()
+    assert imported.topic.slug == 'imported-topic' and imported.quizzes[0].correct_answer == 'c'
+    assert Topic.query.filter_by(slug=topic_slug).count() == 1
+
+    # Any invalid record aborts the whole import
+    plain.write_text(
+        json.dumps({'type': 'topic', 'slug': 'never-imported', 'title': 'Never Imported'}) + '\n'
+        + json.dumps({'type': 'quiz', 'subtopic': 'missing-sub', 'question': 'Orphan question?',
+                      'option_a': '1', 'option_b': '2', 'option_c': '3', 'option_d': '4',
+                      'correct_answer': 'a'}) + '\n'
+    )
+    result = runner.invoke(content_cli, ['import', str(plain)])
+    assert result.exit_code == 1
+    assert 'line 2' in result.output and "Unknown subtopic 'missing-sub'" in result.output
+    assert Topic.query.filter_by(slug='never-imported').count() == 0